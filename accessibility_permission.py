@@ -1,11 +1,19 @@
 import sys
 import subprocess
+import threading
+from collections.abc import Callable
 
 ACCESSIBILITY_SETTINGS_URL = (
     "x-apple.systempreferences:com.apple.preference.security?Privacy_Accessibility"
 )
 
 
+# 未許可の間は頻繁に確認し、許可された後は確認間隔を倍々に延ばす
+ACCESSIBILITY_CHECK_INTERVAL_WHEN_MISSING = 1.0
+ACCESSIBILITY_CHECK_INTERVAL_WHEN_GRANTED = 10.0
+ACCESSIBILITY_CHECK_MAX_INTERVAL = 300.0
+
+
 def is_macos() -> bool:
     return sys.platform == "darwin"
 
@@ -59,3 +67,53 @@ def open_accessibility_settings() -> None:
         subprocess.run(["open", ACCESSIBILITY_SETTINGS_URL], check=False)
     except OSError:
         pass
+
+
+def next_accessibility_check_interval(granted: bool, previous_interval: float) -> float:
+    if not granted:
+        return ACCESSIBILITY_CHECK_INTERVAL_WHEN_MISSING
+    if previous_interval < ACCESSIBILITY_CHECK_INTERVAL_WHEN_GRANTED:
+        return ACCESSIBILITY_CHECK_INTERVAL_WHEN_GRANTED
+    return min(previous_interval * 2, ACCESSIBILITY_CHECK_MAX_INTERVAL)
+
+
+# 権限の確認をバックグラウンドのスレッドで行い、結果をキャッシュする。
+# UIからは is_granted() で待たずに最新の結果を読む
+class AccessibilityPermissionMonitor:
+    def __init__(
+        self,
+        check: Callable[[], bool] = is_accessibility_permission_granted,
+        enabled: bool | None = None,
+    ) -> None:
+        self.check = check
+        self.enabled = is_macos() if enabled is None else enabled
+        # macOS以外では確認する必要がないため、常に許可済みとして扱う
+        self.granted: bool | None = None if self.enabled else True
+        self.interval = 0.0
+        self.check_count = 0
+        self.stop_requested = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name="accessibility-permission", daemon=True
+        )
+
+    def is_granted(self) -> bool | None:
+        return self.granted
+
+    def start(self) -> None:
+        if self.enabled:
+            self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_requested.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def check_once(self) -> float:
+        self.granted = self.check()
+        self.check_count += 1
+        self.interval = next_accessibility_check_interval(self.granted, self.interval)
+        return self.interval
+
+    def run(self) -> None:
+        while not self.stop_requested.is_set():
+            self.stop_requested.wait(self.check_once())
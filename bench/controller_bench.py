@@ -0,0 +1,442 @@
+import argparse
+import gc
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable, Sequence
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from unittest.mock import Mock
+
+import pygame
+
+# test_main.py と同じく、画面のない環境でもpyautoguiを読み込まずに動かす
+sys.modules.setdefault("pyautogui", Mock())
+
+from mascon_controller import (  # noqa: E402
+    PROFILE_LIMITS,
+    AxisMotion,
+    ButtonDown,
+    ButtonUp,
+    ControllerEvent,
+    HatMotion,
+    MasconDevice,
+    Notch,
+    NullKeySink,
+    TrainProfile,
+    ZuikiMasconButton,
+    effective_notch_order,
+    update_notch,
+)
+from session_recording import RecordedEvent, read_recording  # noqa: E402
+
+DEFAULT_REPEATS = 5
+DEFAULT_EVENT_COUNT = 20_000
+LEVER_VALUES = (
+    -1.0,
+    -0.85,
+    -0.7,
+    -0.55,
+    -0.4,
+    -0.25,
+    -0.1,
+    0.1,
+    0.25,
+    0.4,
+    0.55,
+    0.7,
+    0.85,
+    1.0,
+)
+TAP_BUTTONS = (
+    ZuikiMasconButton.A,
+    ZuikiMasconButton.B,
+    ZuikiMasconButton.X,
+    ZuikiMasconButton.Y,
+    ZuikiMasconButton.L,
+    ZuikiMasconButton.R,
+)
+
+
+class CountingKeySink(NullKeySink):
+    def __init__(self) -> None:
+        self.keystrokes = 0
+
+    def press(self, key: str, presses: int = 1) -> None:
+        self.keystrokes += presses
+
+
+# 比較用に残した、プランナー導入前の再帰によるノッチ更新
+def legacy_update_notch(
+    current: Notch, next_notch: Notch, max_brake: Notch, sink: NullKeySink
+) -> None:
+    if current == next_notch:
+        return
+    elif Notch.N <= current < next_notch:
+        sink.press("z", next_notch - current)
+    elif current <= Notch.N and next_notch == Notch.EB:
+        sink.press("/")
+    elif next_notch < current <= Notch.N:
+        sink.press(".", current - next_notch)
+    elif current >= Notch.P1:
+        if next_notch >= Notch.P1:
+            sink.press("a", current - next_notch)
+        else:
+            sink.press("s")
+            return legacy_update_notch(Notch.N, next_notch, max_brake, sink)
+    elif current <= Notch.B1:
+        if next_notch <= Notch.B1:
+            if current == Notch.EB:
+                presses = next_notch - max_brake + 1
+            else:
+                presses = next_notch - current
+            sink.press(",", presses)
+        else:
+            sink.press("m")
+            return legacy_update_notch(Notch.N, next_notch, max_brake, sink)
+
+
+def lever_sweep_events(count: int) -> list[ControllerEvent]:
+    # B8とP5の間を往復させ、軸の細かい揺れも含める
+    events: list[ControllerEvent] = []
+    step = 0.01
+    value = -1.0
+    while len(events) < count:
+        events.append(AxisMotion(value))
+        value += step
+        if not -1.0 <= value <= 1.0:
+            step = -step
+            value += 2 * step
+    return events
+
+
+def button_tap_events(count: int) -> list[ControllerEvent]:
+    events: list[ControllerEvent] = []
+    while len(events) < count:
+        button = TAP_BUTTONS[len(events) // 2 % len(TAP_BUTTONS)]
+        events.append(ButtonDown(button))
+        events.append(ButtonUp(button))
+    return events[:count]
+
+
+def hat_events(count: int) -> list[ControllerEvent]:
+    positions = ((0, 1), (0, 0), (1, 0), (0, 0), (0, -1), (0, 0), (-1, 0), (0, 0))
+    return [HatMotion(*positions[index % len(positions)]) for index in range(count)]
+
+
+def driving_session_events(count: int, seed: int = 0) -> list[ControllerEvent]:
+    # 運転中の操作を模した、レバー操作とボタン操作が混ざったイベント列
+    rng = random.Random(seed)
+    events: list[ControllerEvent] = []
+    lever = 0
+    while len(events) < count:
+        roll = rng.random()
+        if roll < 0.7:
+            target = rng.randrange(len(LEVER_VALUES))
+            direction = 1 if target > lever else -1
+            for position in range(lever, target + direction, direction):
+                events.append(
+                    AxisMotion(LEVER_VALUES[position] + rng.uniform(-0.02, 0.02))
+                )
+            lever = target
+        elif roll < 0.8:
+            events.append(ButtonDown(ZuikiMasconButton.ZL))
+            events.append(AxisMotion(-1.0))
+            events.append(ButtonUp(ZuikiMasconButton.ZL))
+            lever = 0
+        elif roll < 0.95:
+            button = rng.choice(TAP_BUTTONS)
+            events.append(ButtonDown(button))
+            events.append(ButtonUp(button))
+        else:
+            events.append(HatMotion(0, 1))
+            events.append(HatMotion(0, 0))
+    return events[:count]
+
+
+def controller_events_from_recording(
+    events: Sequence[RecordedEvent],
+) -> list[ControllerEvent]:
+    # --record で記録した実際の運転操作を、接続・切断を除いてそのまま流す
+    controller_events: list[ControllerEvent] = []
+    for event in events:
+        match event.event_type:
+            case pygame.JOYAXISMOTION:
+                controller_events.append(
+                    AxisMotion(event.value, event.instance_id, event.index)
+                )
+            case pygame.JOYBUTTONDOWN:
+                controller_events.append(
+                    ButtonDown(ZuikiMasconButton(event.index), event.instance_id)
+                )
+            case pygame.JOYBUTTONUP:
+                controller_events.append(
+                    ButtonUp(ZuikiMasconButton(event.index), event.instance_id)
+                )
+            case pygame.JOYHATMOTION:
+                controller_events.append(HatMotion(*event.hat, event.instance_id))
+            case _:
+                pass
+    return controller_events
+
+
+WORKLOADS: dict[str, Callable[[int], list[ControllerEvent]]] = {
+    "lever_sweep": lever_sweep_events,
+    "button_taps": button_tap_events,
+    "hat": hat_events,
+    "driving_session": driving_session_events,
+}
+
+
+@dataclass(frozen=True, slots=True)
+class BenchResult:
+    name: str
+    profile: str
+    events: int
+    events_per_sec: float
+    ns_per_event: float
+    retained_blocks_per_event: float
+    peak_bytes_per_event: float
+
+
+def dispatch_event(device: MasconDevice, event: ControllerEvent) -> None:
+    match event:
+        case AxisMotion(value=value):
+            device.handle_axis_motion(value)
+        case ButtonDown(button=button):
+            device.handle_button_down(button)
+        case ButtonUp(button=button):
+            device.handle_button_up(button)
+        case HatMotion(x=x, y=y):
+            device.handle_hat_motion(x, y)
+
+
+def time_run(run: Callable[[], None], repeats: int) -> int:
+    best = sys.maxsize
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeats):
+            started = time.perf_counter_ns()
+            run()
+            best = min(best, time.perf_counter_ns() - started)
+    finally:
+        gc.enable()
+    return best
+
+
+def measure_memory(run: Callable[[], None]) -> tuple[int, int]:
+    # 解放されずに残ったメモリブロック数と、実行中に確保されたメモリの最大量
+    run()
+    gc.collect()
+    gc.disable()
+    try:
+        blocks_before = sys.getallocatedblocks()
+        tracemalloc.start()
+        try:
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        blocks_after = sys.getallocatedblocks()
+    finally:
+        gc.enable()
+    return blocks_after - blocks_before, peak
+
+
+def bench_events(
+    name: str, profile: TrainProfile, events: Sequence[ControllerEvent], repeats: int
+) -> BenchResult:
+    def make_run() -> Callable[[], None]:
+        device = MasconDevice(profile=profile, key_sink=NullKeySink())
+
+        def run() -> None:
+            for event in events:
+                dispatch_event(device, event)
+
+        return run
+
+    elapsed_ns = time_run(make_run(), repeats)
+    blocks, peak = measure_memory(make_run())
+    return BenchResult(
+        name=name,
+        profile=profile.name.lower(),
+        events=len(events),
+        events_per_sec=len(events) / (elapsed_ns / 1e9),
+        ns_per_event=elapsed_ns / len(events),
+        retained_blocks_per_event=blocks / len(events),
+        peak_bytes_per_event=peak / len(events),
+    )
+
+
+def bench_planner(
+    name: str,
+    profile: TrainProfile,
+    update: Callable[[Notch, Notch, NullKeySink], None],
+    repeats: int,
+    rounds: int = 100,
+) -> BenchResult:
+    order = effective_notch_order(PROFILE_LIMITS[profile])
+    pairs = [
+        (current, next_notch) for current in order for next_notch in order
+    ] * rounds
+    sink = NullKeySink()
+
+    def run() -> None:
+        for current, next_notch in pairs:
+            update(current, next_notch, sink)
+
+    elapsed_ns = time_run(run, repeats)
+    blocks, peak = measure_memory(run)
+    return BenchResult(
+        name=name,
+        profile=profile.name.lower(),
+        events=len(pairs),
+        events_per_sec=len(pairs) / (elapsed_ns / 1e9),
+        ns_per_event=elapsed_ns / len(pairs),
+        retained_blocks_per_event=blocks / len(pairs),
+        peak_bytes_per_event=peak / len(pairs),
+    )
+
+
+def count_keystrokes(
+    profile: TrainProfile, update: Callable[[Notch, Notch, CountingKeySink], None]
+) -> int:
+    order = effective_notch_order(PROFILE_LIMITS[profile])
+    sink = CountingKeySink()
+    for current in order:
+        for next_notch in order:
+            update(current, next_notch, sink)
+    return sink.keystrokes
+
+
+@dataclass(frozen=True, slots=True)
+class BenchReport:
+    commit: str | None
+    python: str
+    platform: str
+    event_count: int
+    repeats: int
+    results: list[BenchResult]
+    transition_keystrokes: dict[str, dict[str, int]]
+
+
+def run_benchmarks(
+    event_count: int = DEFAULT_EVENT_COUNT,
+    repeats: int = DEFAULT_REPEATS,
+    workloads: Sequence[str] = tuple(WORKLOADS),
+    recordings: Sequence[Path] = (),
+) -> BenchReport:
+    streams = {name: WORKLOADS[name](event_count) for name in workloads}
+    for path in recordings:
+        streams[f"recording:{path.stem}"] = controller_events_from_recording(
+            read_recording(path).events
+        )
+
+    results: list[BenchResult] = []
+    keystrokes: dict[str, dict[str, int]] = {}
+    for profile in TrainProfile:
+        profile_limit = PROFILE_LIMITS[profile]
+        for name, events in streams.items():
+            if events:
+                results.append(bench_events(name, profile, events, repeats))
+
+        def planner(current: Notch, next_notch: Notch, sink: NullKeySink) -> None:
+            update_notch(current, next_notch, profile_limit, sink)
+
+        def legacy(current: Notch, next_notch: Notch, sink: NullKeySink) -> None:
+            legacy_update_notch(current, next_notch, profile_limit.max_brake, sink)
+
+        results.append(bench_planner("update_notch", profile, planner, repeats))
+        results.append(bench_planner("legacy_update_notch", profile, legacy, repeats))
+        keystrokes[profile.name.lower()] = {
+            "update_notch": count_keystrokes(profile, planner),
+            "legacy_update_notch": count_keystrokes(profile, legacy),
+        }
+
+    return BenchReport(
+        commit=current_commit(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        event_count=event_count,
+        repeats=repeats,
+        results=results,
+        transition_keystrokes=keystrokes,
+    )
+
+
+def current_commit() -> str | None:
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return completed.stdout.strip()
+
+
+def format_results(report: BenchReport) -> str:
+    lines = [
+        f"{'name':<22}{'profile':<9}{'events/s':>14}{'ns/event':>11}"
+        f"{'retained/event':>16}{'peak B/event':>14}"
+    ]
+    for result in report.results:
+        lines.append(
+            f"{result.name:<22}{result.profile:<9}"
+            f"{result.events_per_sec:>14,.0f}{result.ns_per_event:>11.1f}"
+            f"{result.retained_blocks_per_event:>16.3f}"
+            f"{result.peak_bytes_per_event:>14.2f}"
+        )
+    for profile, counts in report.transition_keystrokes.items():
+        lines.append(
+            f"keystrokes for all transitions ({profile}): "
+            + ", ".join(f"{name}={count}" for name, count in counts.items())
+        )
+    return "\n".join(lines)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=DEFAULT_EVENT_COUNT)
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument(
+        "--workload", action="append", choices=tuple(WORKLOADS), dest="workloads"
+    )
+    parser.add_argument(
+        "--recording",
+        type=Path,
+        action="append",
+        default=[],
+        dest="recordings",
+        help="Session recorded with main.py --record to use as a workload.",
+    )
+    parser.add_argument(
+        "--output", type=Path, help="Write the results as JSON to this file."
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    report = run_benchmarks(
+        args.events,
+        args.repeats,
+        args.workloads or tuple(WORKLOADS),
+        args.recordings,
+    )
+    print(format_results(report))
+    if args.output is not None:
+        args.output.write_text(
+            json.dumps(asdict(report), indent=2) + "\n", encoding="utf-8"
+        )
+
+
+if __name__ == "__main__":
+    main()
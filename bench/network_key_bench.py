@@ -0,0 +1,169 @@
+import argparse
+import json
+import platform
+import sys
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from unittest.mock import Mock
+
+# test_main.py と同じく、画面のない環境でもpyautoguiを読み込まずに動かす
+sys.modules.setdefault("pyautogui", Mock())
+
+from bench.controller_bench import current_commit  # noqa: E402
+from key_receiver import KeyReceiver  # noqa: E402
+from mascon_controller import NullKeySink  # noqa: E402
+from network_key_sink import NetworkKeySink  # noqa: E402
+
+DEFAULT_ROUND_TRIPS = 2_000
+DEFAULT_DATAGRAMS = 50_000
+# 受け手がこの時間何も受け取らなければ、残りは失われたとみなす
+IDLE_TIMEOUT = 1.0
+POLL_INTERVAL = 0.00005
+
+
+@dataclass(frozen=True, slots=True)
+class RoundTripResult:
+    round_trips: int
+    lost: int
+    p50_us: float
+    p95_us: float
+    p99_us: float
+    max_us: float
+
+
+@dataclass(frozen=True, slots=True)
+class ThroughputResult:
+    datagrams: int
+    received: int
+    lost: int
+    send_per_sec: float
+    receive_per_sec: float
+
+
+@dataclass(frozen=True, slots=True)
+class BenchReport:
+    commit: str | None
+    python: str
+    platform: str
+    round_trip: RoundTripResult
+    throughput: ThroughputResult
+
+
+def wait_for(condition: Callable[[], bool], timeout: float) -> bool:
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() >= deadline:
+            return False
+        time.sleep(POLL_INTERVAL)
+    return True
+
+
+def bench_round_trip(count: int) -> RoundTripResult:
+    receiver = KeyReceiver(NullKeySink(), ("127.0.0.1", 0))
+    receiver.start()
+    sink = NetworkKeySink(receiver.address)
+    sink.start()
+    lost = 0
+    try:
+        # 1つずつ送り、返ってきてから次を送る。往復の時間は返信を受けたスレッドが測る
+        for index in range(count):
+            sink.echo()
+            if not wait_for(lambda: sink.round_trip.count + lost > index, IDLE_TIMEOUT):
+                lost += 1
+    finally:
+        sink.close()
+        receiver.close()
+
+    histogram = sink.round_trip
+    return RoundTripResult(
+        round_trips=count,
+        lost=lost,
+        p50_us=histogram.percentile_ns(0.50) / 1000,
+        p95_us=histogram.percentile_ns(0.95) / 1000,
+        p99_us=histogram.percentile_ns(0.99) / 1000,
+        max_us=histogram.max_ns / 1000,
+    )
+
+
+def bench_throughput(count: int) -> ThroughputResult:
+    receiver = KeyReceiver(NullKeySink(), ("127.0.0.1", 0))
+    receiver.start()
+    sink = NetworkKeySink(receiver.address)
+    try:
+        # KeyEmitterが詰めて送るときと同じく、待たずに送り続ける
+        started = time.perf_counter_ns()
+        for _ in range(count):
+            sink.press("z")
+        sent = time.perf_counter_ns()
+
+        received = receiver.received_count
+        finished = sent
+        while received < count:
+            if not wait_for(lambda: receiver.received_count > received, IDLE_TIMEOUT):
+                break
+            received = receiver.received_count
+            finished = time.perf_counter_ns()
+    finally:
+        sink.close()
+        receiver.close()
+
+    return ThroughputResult(
+        datagrams=count,
+        received=received,
+        lost=count - received,
+        send_per_sec=count / ((sent - started) / 1e9),
+        receive_per_sec=received / (max(finished, sent) - started) * 1e9,
+    )
+
+
+def run_benchmarks(
+    round_trips: int = DEFAULT_ROUND_TRIPS, datagrams: int = DEFAULT_DATAGRAMS
+) -> BenchReport:
+    return BenchReport(
+        commit=current_commit(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        round_trip=bench_round_trip(round_trips),
+        throughput=bench_throughput(datagrams),
+    )
+
+
+def format_results(report: BenchReport) -> str:
+    round_trip = report.round_trip
+    throughput = report.throughput
+    return "\n".join(
+        [
+            f"round trip ({round_trip.round_trips}, lost {round_trip.lost}): "
+            f"p50 {round_trip.p50_us:.1f} us, p95 {round_trip.p95_us:.1f} us, "
+            f"p99 {round_trip.p99_us:.1f} us, max {round_trip.max_us:.1f} us",
+            f"throughput ({throughput.datagrams}, lost {throughput.lost}): "
+            f"send {throughput.send_per_sec:,.0f}/s, "
+            f"receive {throughput.receive_per_sec:,.0f}/s",
+        ]
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--round-trips", type=int, default=DEFAULT_ROUND_TRIPS)
+    parser.add_argument("--datagrams", type=int, default=DEFAULT_DATAGRAMS)
+    parser.add_argument(
+        "--output", type=Path, help="Write the results as JSON to this file."
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    report = run_benchmarks(args.round_trips, args.datagrams)
+    print(format_results(report))
+    if args.output is not None:
+        args.output.write_text(
+            json.dumps(asdict(report), indent=2) + "\n", encoding="utf-8"
+        )
+
+
+if __name__ == "__main__":
+    main()
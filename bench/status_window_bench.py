@@ -0,0 +1,192 @@
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tkinter as tk
+from collections.abc import Callable, Sequence
+from dataclasses import asdict, dataclass
+from itertools import cycle, islice
+from pathlib import Path
+from unittest.mock import Mock
+
+# test_main.py と同じく、画面のない環境でもpyautoguiを読み込まずに動かす
+sys.modules.setdefault("pyautogui", Mock())
+
+from bench.controller_bench import current_commit  # noqa: E402
+from mascon_controller import (  # noqa: E402
+    MasconController,
+    ProfileLimit,
+    TrainProfile,
+    effective_notch_order,
+)
+from status_window import (  # noqa: E402
+    COLOR_MUTED,
+    COLOR_SURFACE,
+    StatusWindow,
+)
+
+DEFAULT_SWITCHES = 300
+# 60Hzの1フレーム
+FRAME_BUDGET_US = 1_000_000 / 60
+
+
+# 比較用に残した、ラベルを使い回す前の作り直しによるノッチバーの更新
+def legacy_rebuild_notch_bar(
+    window: StatusWindow,
+    notch_bar: tk.Frame,
+    labels: list[tk.Label],
+    profile_limit: ProfileLimit,
+) -> None:
+    for label in labels:
+        window.forget_widget(label)
+    labels.clear()
+
+    for item in effective_notch_order(profile_limit):
+        label = tk.Label(
+            notch_bar,
+            text=item.name,
+            width=3,
+            font=("Helvetica", 10, "bold"),
+            bg=COLOR_SURFACE,
+            fg=COLOR_MUTED,
+            relief="flat",
+            padx=4,
+            pady=4,
+        )
+        label.pack(side="left", padx=2)
+        labels.append(label)
+
+
+@dataclass(frozen=True, slots=True)
+class SwitchResult:
+    name: str
+    switches: int
+    mean_us: float
+    p95_us: float
+    max_us: float
+    frame_fraction: float
+
+
+def time_switches(
+    name: str,
+    switch: Callable[[TrainProfile], None],
+    root: tk.Tk,
+    switches: int,
+) -> SwitchResult:
+    # Tkの配置計算と再描画まで含めて、1回の切り替えにかかった時間を測る。
+    # 最初の切り替えで表示が変わるよう、標準の次の車種から順に切り替える
+    profiles = cycle((*tuple(TrainProfile)[1:], TrainProfile.DEFAULT))
+    elapsed_us: list[float] = []
+    for profile in islice(profiles, switches):
+        started = time.perf_counter_ns()
+        switch(profile)
+        root.update_idletasks()
+        elapsed_us.append((time.perf_counter_ns() - started) / 1000)
+
+    p95_us = (
+        statistics.quantiles(elapsed_us, n=20)[-1]
+        if len(elapsed_us) > 1
+        else elapsed_us[0]
+    )
+    return SwitchResult(
+        name=name,
+        switches=switches,
+        mean_us=statistics.fmean(elapsed_us),
+        p95_us=p95_us,
+        max_us=max(elapsed_us),
+        frame_fraction=max(elapsed_us) / FRAME_BUDGET_US,
+    )
+
+
+def bench_profile_switch(root: tk.Tk, switches: int) -> list[SwitchResult]:
+    controller = MasconController()
+    window = StatusWindow(root, controller)
+
+    # 作り直す方はノッチバー以外の描画を含まないため、比較は使い回す方に不利になる
+    legacy_notch_bar = tk.Frame(root)
+    legacy_notch_bar.pack()
+    legacy_labels: list[tk.Label] = []
+
+    def legacy(profile: TrainProfile) -> None:
+        legacy_rebuild_notch_bar(
+            window,
+            legacy_notch_bar,
+            legacy_labels,
+            controller.primary.profile_limits[profile],
+        )
+
+    try:
+        return [
+            time_switches("legacy_rebuild", legacy, root, switches),
+            time_switches("pooled", window.change_profile, root, switches),
+        ]
+    finally:
+        window.accessibility_monitor.stop()
+
+
+@dataclass(frozen=True, slots=True)
+class BenchReport:
+    commit: str | None
+    python: str
+    platform: str
+    tk: str
+    results: list[SwitchResult]
+
+
+def run_benchmarks(root: tk.Tk, switches: int = DEFAULT_SWITCHES) -> BenchReport:
+    return BenchReport(
+        commit=current_commit(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        tk=str(tk.TkVersion),
+        results=bench_profile_switch(root, switches),
+    )
+
+
+def format_results(results: Sequence[SwitchResult]) -> str:
+    lines = [
+        f"{'name':<16}{'switches':>10}{'mean us':>11}{'p95 us':>11}"
+        f"{'max us':>11}{'max/frame':>11}"
+    ]
+    for result in results:
+        lines.append(
+            f"{result.name:<16}{result.switches:>10}"
+            f"{result.mean_us:>11.1f}{result.p95_us:>11.1f}"
+            f"{result.max_us:>11.1f}{result.frame_fraction:>11.3f}"
+        )
+    return "\n".join(lines)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--switches", type=int, default=DEFAULT_SWITCHES)
+    parser.add_argument(
+        "--output", type=Path, help="Write the results as JSON to this file."
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    try:
+        root = tk.Tk()
+    except tk.TclError as error:
+        print(f"Tkのウィンドウを作れませんでした: {error}", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        report = run_benchmarks(root, args.switches)
+    finally:
+        root.destroy()
+
+    print(format_results(report.results))
+    if args.output is not None:
+        args.output.write_text(
+            json.dumps(asdict(report), indent=2) + "\n", encoding="utf-8"
+        )
+
+
+if __name__ == "__main__":
+    main()
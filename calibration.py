@@ -0,0 +1,101 @@
+import json
+from collections.abc import Callable, Sequence
+from pathlib import Path
+from typing import Protocol
+
+import pygame
+
+from mascon_controller import AXIS_NOTCHES, DEFAULT_LEVER_AXIS, AxisCalibration
+
+
+class CalibrationJoystick(Protocol):
+    def get_name(self) -> str: ...
+
+    def get_numaxes(self) -> int: ...
+
+    def get_axis(self, axis_number: int) -> float: ...
+
+
+def load_calibrations(path: Path) -> dict[str, AxisCalibration]:
+    if not path.exists():
+        return {}
+
+    data = json.loads(path.read_text(encoding="utf-8"))
+    # lever_axis がない古いファイルは、ズイキマスコンの軸とみなす
+    return {
+        name: AxisCalibration(
+            tuple(float(value) for value in entry["thresholds"]),
+            int(entry.get("lever_axis", DEFAULT_LEVER_AXIS)),
+        )
+        for name, entry in data["devices"].items()
+    }
+
+
+def save_calibrations(path: Path, calibrations: dict[str, AxisCalibration]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = {
+        "devices": {
+            name: {
+                "thresholds": list(calibration.thresholds),
+                "lever_axis": calibration.lever_axis,
+            }
+            for name, calibration in calibrations.items()
+        }
+    }
+    path.write_text(
+        json.dumps(data, ensure_ascii=False, indent=2) + "\n", encoding="utf-8"
+    )
+
+
+def find_lever_axis(readings: Sequence[Sequence[float]]) -> int:
+    # ノッチごとの読み取り値のうち、最も大きく動いた軸をレバーの軸とみなす
+    axis_count = len(readings[0])
+    return max(
+        range(axis_count),
+        key=lambda axis: (
+            max(reading[axis] for reading in readings)
+            - min(reading[axis] for reading in readings)
+        ),
+    )
+
+
+def calibration_from_detents(
+    values: Sequence[float], lever_axis: int = DEFAULT_LEVER_AXIS
+) -> AxisCalibration:
+    # 隣り合うノッチの読み取り値の中間を境界にする
+    return AxisCalibration(
+        tuple((lower + upper) / 2 for lower, upper in zip(values, values[1:])),
+        lever_axis,
+    )
+
+
+def calibrate_joystick(
+    joystick: CalibrationJoystick,
+    read_line: Callable[[str], str] = input,
+    pump: Callable[[], None] = pygame.event.pump,
+) -> AxisCalibration:
+    readings: list[list[float]] = []
+    for notch in AXIS_NOTCHES:
+        read_line(f"レバーを {notch.name} に合わせてEnterキーを押してください: ")
+        pump()
+        readings.append(
+            [joystick.get_axis(axis) for axis in range(joystick.get_numaxes())]
+        )
+
+    lever_axis = find_lever_axis(readings)
+    return calibration_from_detents(
+        [reading[lever_axis] for reading in readings], lever_axis
+    )
+
+
+def run_calibration(
+    joystick: CalibrationJoystick,
+    path: Path,
+    read_line: Callable[[str], str] = input,
+    pump: Callable[[], None] = pygame.event.pump,
+) -> AxisCalibration:
+    calibration = calibrate_joystick(joystick, read_line, pump)
+    calibrations = load_calibrations(path)
+    calibrations[joystick.get_name()] = calibration
+    save_calibrations(path, calibrations)
+    return calibration
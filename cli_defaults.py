@@ -0,0 +1,22 @@
+from pathlib import Path
+from typing import Literal
+
+# コマンドラインの既定値と解析に使う値だけを置く。起動を遅くしないよう、
+# 機能ごとのモジュールは読み込まず、その機能を使うときに読み込む
+
+CONFIG_DIR = Path.home() / ".config" / "zuiki-mascon-to-jrets"
+DEFAULT_CALIBRATION_PATH = CONFIG_DIR / "calibration.json"
+DEFAULT_MAPPING_CONFIG_PATH = CONFIG_DIR / "mapping.toml"
+
+NETWORK_KEY_PORT = 47810
+
+type LogFormat = Literal["text", "json"]
+
+LOG_FORMATS: tuple[LogFormat, ...] = ("text", "json")
+
+
+def parse_address(text: str) -> tuple[str, int]:
+    host, separator, port = text.rpartition(":")
+    if not separator or not host or not port.isdigit() or int(port) > 65535:
+        raise ValueError(f"expected HOST:PORT: {text!r}")
+    return host.removeprefix("[").removesuffix("]"), int(port)
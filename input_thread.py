@@ -0,0 +1,210 @@
+import math
+import os
+import threading
+import time
+from collections.abc import Iterable
+from typing import Protocol
+
+import pygame
+
+from key_emitter import KeyEmitter
+from mascon_controller import (
+    AxisMotion,
+    ButtonDown,
+    ButtonUp,
+    MASCON_BUTTON_NUMBERS,
+    ControllerEvent,
+    HatMotion,
+    MasconController,
+    ZuikiMasconButton,
+)
+from startup_report import StartupReport
+
+INPUT_WAIT_TIMEOUT_MS = 100
+
+INPUT_EVENT_TYPES = (
+    pygame.JOYDEVICEADDED,
+    pygame.JOYDEVICEREMOVED,
+    pygame.JOYAXISMOTION,
+    pygame.JOYBUTTONDOWN,
+    pygame.JOYBUTTONUP,
+    pygame.JOYHATMOTION,
+    pygame.QUIT,
+)
+
+
+# --verbose のときだけ読み込むStateLogのうち、状態を書き出す部分
+class StateLogger(Protocol):
+    def log_state(self, controller: MasconController) -> None: ...
+
+
+class EventRecorder(Protocol):
+    def record_pygame_events(
+        self, events: Iterable[pygame.event.Event], timestamp_ns: int
+    ) -> None: ...
+
+    def close(self) -> None: ...
+
+
+def initialize_pygame(controller: MasconController) -> None:
+    # ウィンドウは開かないため、入力スレッドからイベントを待てるようダミーの映像ドライバーを使う
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    # 音声などは使わないため、イベントの受け取りに必要な映像とジョイスティックだけを初期化する
+    pygame.display.init()
+    pygame.joystick.init()
+    pygame.display.set_allow_screensaver(True)
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed(INPUT_EVENT_TYPES)
+    controller.initialize_joysticks()
+
+
+def handle_pygame_events(
+    controller: MasconController,
+    events: Iterable[pygame.event.Event],
+    state_log: StateLogger | None = None,
+    dequeued_ns: int | None = None,
+) -> bool:
+    batch: list[ControllerEvent] = []
+    should_continue = True
+    # SDLのイベントはpygameから時刻を取れないため、取り出した時刻を起点にする
+    if dequeued_ns is None:
+        dequeued_ns = time.monotonic_ns()
+    devices = controller.devices
+    for event in events:
+        attributes = event.dict
+        match event.type:
+            case pygame.JOYDEVICEADDED:
+                controller.register_joystick(attributes["device_index"])
+            case pygame.JOYDEVICEREMOVED:
+                controller.unregister_joystick(attributes["instance_id"])
+            # 登録していないデバイスやレバー以外の軸、マスコンにないボタンは、
+            # イベントを作る前に捨てる
+            case pygame.JOYAXISMOTION:
+                device = devices.get(attributes["instance_id"])
+                if device is not None and attributes["axis"] == device.lever_axis:
+                    batch.append(
+                        AxisMotion(
+                            attributes["value"],
+                            attributes["instance_id"],
+                            attributes["axis"],
+                            dequeued_ns,
+                        )
+                    )
+            case pygame.JOYBUTTONDOWN | pygame.JOYBUTTONUP:
+                if (
+                    attributes["instance_id"] in devices
+                    and attributes["button"] in MASCON_BUTTON_NUMBERS
+                ):
+                    button_event = (
+                        ButtonDown if event.type == pygame.JOYBUTTONDOWN else ButtonUp
+                    )
+                    batch.append(
+                        button_event(
+                            ZuikiMasconButton(attributes["button"]),
+                            attributes["instance_id"],
+                            dequeued_ns,
+                        )
+                    )
+            case pygame.JOYHATMOTION:
+                if attributes["instance_id"] in devices:
+                    x, y = attributes["value"]
+                    batch.append(
+                        HatMotion(x, y, attributes["instance_id"], dequeued_ns)
+                    )
+            case pygame.QUIT:
+                should_continue = False
+                break
+            case _:
+                pass
+
+    controller.handle_events(batch)
+    if not should_continue:
+        controller.release_all_inputs()
+
+    if state_log is not None:
+        state_log.log_state(controller)
+
+    return should_continue
+
+
+class InputThread(threading.Thread):
+    def __init__(
+        self,
+        controller: MasconController,
+        state_log: StateLogger | None = None,
+        recorder: EventRecorder | None = None,
+        startup_report: StartupReport | None = None,
+        key_emitter: KeyEmitter | None = None,
+    ) -> None:
+        super().__init__(name="input", daemon=True)
+        self.controller = controller
+        self.state_log = state_log
+        self.recorder = recorder
+        self.startup_report = startup_report
+        self.key_emitter = key_emitter
+        self.stop_requested = threading.Event()
+
+    def run(self) -> None:
+        # macOSではジョイスティックの検出が初期化したスレッドのRunLoopに紐づくため、
+        # SDLの初期化からイベント待ちまでをこのスレッドで行う
+        initialize_pygame(self.controller)
+        if self.startup_report is not None:
+            self.startup_report.mark("sdl_init")
+        try:
+            while not self.stop_requested.is_set():
+                if not self.wait_and_handle_events():
+                    break
+        finally:
+            with self.controller.lock:
+                self.controller.release_all_inputs()
+            if self.recorder is not None:
+                self.recorder.close()
+            if self.startup_report is not None:
+                self.startup_report.report()
+            pygame.quit()
+
+    def wait_timeout_ms(self) -> int:
+        with self.controller.lock:
+            deadline = self.controller.pending_deadline
+            now = self.controller.primary.clock()
+        if deadline is None:
+            return INPUT_WAIT_TIMEOUT_MS
+        return max(1, min(INPUT_WAIT_TIMEOUT_MS, math.ceil((deadline - now) * 1000)))
+
+    def wait_and_handle_events(self) -> bool:
+        event = pygame.event.wait(self.wait_timeout_ms())
+        if event.type == pygame.NOEVENT:
+            with self.controller.lock:
+                self.controller.poll_timers()
+                self.check_key_backlog()
+                self.controller.primary.key_sink.flush()
+            return True
+
+        # 記録やロック待ち、タイマーの処理にかかった時間も遅延に含めるよう、取り出した直後の時刻を使う
+        dequeued_ns = time.monotonic_ns()
+        events = [event, *pygame.event.get()]
+        if self.recorder is not None:
+            self.recorder.record_pygame_events(events, dequeued_ns)
+        with self.controller.lock:
+            # 入力が続いても予約したキー操作が遅れないよう、イベントの前に期限を確認する
+            self.controller.poll_timers()
+            should_continue = handle_pygame_events(
+                self.controller, events, self.state_log, dequeued_ns
+            )
+            self.check_key_backlog()
+            self.controller.primary.key_sink.flush()
+        if self.startup_report is not None and not self.startup_report.is_reported:
+            self.startup_report.mark("first_event")
+            self.startup_report.report()
+        return should_continue
+
+    def check_key_backlog(self) -> None:
+        if self.key_emitter is not None:
+            self.controller.check_key_backlog(
+                self.key_emitter.depth, self.key_emitter.dropped_count
+            )
+
+    def stop(self) -> None:
+        self.stop_requested.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
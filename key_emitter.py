@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Literal, Protocol
+
+from latency_stats import EventKind, LatencyStats
+from mascon_controller import KeySink
+
+
+# --verbose のときだけ読み込むStateLogのうち、送ったキーを書き出す部分
+class KeyLog(Protocol):
+    def log_key(self, kind: str, key: str, presses: int = 1) -> None: ...
+
+
+KEY_QUEUE_MAXSIZE = 256
+
+
+@dataclass(frozen=True, slots=True)
+class KeyAction:
+    kind: Literal["down", "up", "press"]
+    key: str
+    presses: int = 1
+    # 遅延計測の起点となったイベントの種類と取り出し時刻
+    origin: tuple[EventKind, int] | None = None
+
+
+# KeySinkとして受け取ったキー操作をキューに積み、専用スレッドで出力先へ送る。
+# キューが満杯のときは新しく来たkey_down/pressを捨てて dropped_count に数える。
+# key_upは押しっぱなしを防ぐため、満杯でも必ず受け付ける。
+class KeyEmitter:
+    def __init__(
+        self,
+        sink: KeySink,
+        maxsize: int = KEY_QUEUE_MAXSIZE,
+        min_interval: float = 0.0,
+        latency_stats: LatencyStats | None = None,
+        log: KeyLog | None = None,
+    ) -> None:
+        self.sink = sink
+        self.latency_stats = latency_stats
+        self.log = log
+        self.maxsize = maxsize
+        self.min_interval = min_interval
+        self.actions: deque[KeyAction] = deque()
+        self.condition = threading.Condition()
+        self.dropped_count = 0
+        # 出力先へ送ったキー操作の、操作の種類とキーごとの回数
+        self.key_counts: dict[tuple[str, str], int] = {}
+        # 出力先が例外を投げたキー操作の数
+        self.error_count = 0
+        self.last_error: Exception | None = None
+        self.is_emitting = False
+        self.is_closed = False
+        self.thread = threading.Thread(target=self.run, name="key-emitter", daemon=True)
+
+    @property
+    def depth(self) -> int:
+        return len(self.actions)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def close(self) -> None:
+        with self.condition:
+            self.is_closed = True
+            self.condition.notify_all()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def enqueue(self, action: KeyAction) -> bool:
+        with self.condition:
+            if action.kind != "up" and len(self.actions) >= self.maxsize:
+                self.dropped_count += 1
+                return False
+            self.actions.append(action)
+            self.condition.notify_all()
+            return True
+
+    def take_origin(self) -> tuple[EventKind, int] | None:
+        if self.latency_stats is None:
+            return None
+        return self.latency_stats.take_event()
+
+    def key_down(self, key: str) -> None:
+        self.enqueue(KeyAction("down", key, origin=self.take_origin()))
+
+    def key_up(self, key: str) -> None:
+        self.enqueue(KeyAction("up", key, origin=self.take_origin()))
+
+    def press(self, key: str, presses: int = 1) -> None:
+        self.enqueue(KeyAction("press", key, presses, self.take_origin()))
+
+    def flush(self) -> None:
+        # 出力先へのflushはキューが空になった時点で出力スレッドが行う
+        pass
+
+    def wait_until_idle(self, timeout: float | None = None) -> bool:
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not self.actions and not self.is_emitting, timeout
+            )
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.actions or self.is_closed)
+                if not self.actions:
+                    return
+                action = self.actions.popleft()
+                self.is_emitting = True
+
+            try:
+                self.emit(action)
+            except Exception as error:
+                # pyautoguiのフェイルセーフやX11で解決できないキーで、出力スレッドを止めない
+                self.error_count += 1
+                self.last_error = error
+            finally:
+                with self.condition:
+                    self.is_emitting = False
+                    self.condition.notify_all()
+
+    def emit(self, action: KeyAction) -> None:
+        if self.log is not None:
+            self.log.log_key(action.kind, action.key, action.presses)
+        counter = (action.kind, action.key)
+        self.key_counts[counter] = self.key_counts.get(counter, 0) + action.presses
+        match action.kind:
+            case "down":
+                self.sink.key_down(action.key)
+                self.record_latency(action)
+                self.pace()
+            case "up":
+                self.sink.key_up(action.key)
+                self.record_latency(action)
+                self.pace()
+            case "press":
+                for index in range(action.presses):
+                    self.sink.press(action.key)
+                    if index == 0:
+                        self.record_latency(action)
+                    self.pace()
+
+    def record_latency(self, action: KeyAction) -> None:
+        if self.latency_stats is not None and action.origin is not None:
+            kind, event_time_ns = action.origin
+            self.latency_stats.record(kind, time.monotonic_ns() - event_time_ns)
+
+    def pace(self) -> None:
+        if self.min_interval > 0:
+            self.sink.flush()
+            time.sleep(self.min_interval)
+        elif not self.actions:
+            self.sink.flush()
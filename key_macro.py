@@ -0,0 +1,129 @@
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Literal, Protocol
+
+from key_scheduler import KeyScheduler, ScheduledTimer
+
+
+# keys を同時に押して離す
+@dataclass(frozen=True)
+class Tap:
+    keys: tuple[str, ...]
+
+
+# keys を同時に押し、duration 秒後に離す
+@dataclass(frozen=True)
+class Hold:
+    keys: tuple[str, ...]
+    duration: float
+
+
+@dataclass(frozen=True)
+class Wait:
+    duration: float
+
+
+type MacroStep = Tap | Hold | Wait
+
+
+@dataclass(frozen=True)
+class Macro:
+    steps: tuple[MacroStep, ...]
+
+
+@dataclass(frozen=True, slots=True)
+class MacroAction:
+    kind: Literal["down", "up"]
+    key: str
+    # マクロを始めてからこの操作を行うまでの秒数
+    offset: float
+
+
+class MacroKeySink(Protocol):
+    def key_down(self, key: str) -> None: ...
+
+    def key_up(self, key: str) -> None: ...
+
+
+def compile_macro(macro: Macro) -> tuple[MacroAction, ...]:
+    # 手順を、開始からの時刻付きのキー操作の平らな列にする
+    actions: list[MacroAction] = []
+    offset = 0.0
+    for step in macro.steps:
+        match step:
+            case Tap(keys=keys) | Hold(keys=keys) if not keys:
+                raise ValueError("macro step has no keys")
+            case Tap(keys=keys):
+                actions.extend(MacroAction("down", key, offset) for key in keys)
+                actions.extend(MacroAction("up", key, offset) for key in reversed(keys))
+            case Hold(keys=keys, duration=duration):
+                if duration < 0:
+                    raise ValueError(f"negative hold duration: {duration}")
+                actions.extend(MacroAction("down", key, offset) for key in keys)
+                offset += duration
+                actions.extend(MacroAction("up", key, offset) for key in reversed(keys))
+            case Wait(duration=duration):
+                if duration < 0:
+                    raise ValueError(f"negative wait duration: {duration}")
+                offset += duration
+    if not actions:
+        raise ValueError("macro has no key actions")
+    return tuple(actions)
+
+
+# 1回分のマクロの実行。待ちが必要な操作はスケジューラーに予約し、入力の処理を止めない
+@dataclass
+class MacroRun:
+    actions: tuple[MacroAction, ...]
+    sink: MacroKeySink
+    scheduler: KeyScheduler
+    clock: Callable[[], float]
+    started_at: float
+    on_finish: Callable[[], None]
+    index: int = 0
+    held_keys: list[str] = field(default_factory=list)
+    timer: ScheduledTimer | None = None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.index == len(self.actions)
+
+    def advance(self) -> None:
+        now = self.clock()
+        latency_stats = self.scheduler.latency_stats
+        while not self.is_finished and (
+            self.started_at + self.actions[self.index].offset <= now
+        ):
+            action = self.actions[self.index]
+            if latency_stats is not None:
+                # 開始時刻から見た予定よりどれだけ遅れたか
+                latency_stats.record_macro_step_lag(
+                    round((now - self.started_at - action.offset) * 1e9)
+                )
+            if action.kind == "down":
+                self.sink.key_down(action.key)
+                self.held_keys.append(action.key)
+            else:
+                self.sink.key_up(action.key)
+                # fnキーの回避策で足した離す操作は、押したキーに含まれない
+                if action.key in self.held_keys:
+                    self.held_keys.remove(action.key)
+            self.index += 1
+
+        if self.is_finished:
+            self.timer = None
+            self.on_finish()
+        else:
+            self.timer = self.scheduler.schedule(
+                self.started_at + self.actions[self.index].offset, self.advance
+            )
+
+    def cancel(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        # 押したまま取り消さないよう、押しているキーを逆順に離す
+        for key in reversed(self.held_keys):
+            self.sink.key_up(key)
+        self.held_keys.clear()
+        self.index = len(self.actions)
@@ -0,0 +1,291 @@
+import argparse
+import ipaddress
+import socket
+import sys
+import threading
+
+from cli_defaults import NETWORK_KEY_PORT, parse_address
+from mascon_controller import (
+    FN_WORKAROUND_KEYS,
+    KEY_NAMES,
+    KeySink,
+    create_key_sink,
+)
+from network_key_sink import (
+    MAX_DATAGRAM_SIZE,
+    REPLY_POLL_INTERVAL,
+    SEQUENCE_MODULUS,
+    KeyDatagram,
+    decode_datagram,
+    encode_datagram,
+    sequence_gap,
+)
+
+RECEIVER_KEY_SINK_NAMES = ("pyautogui", "xtest")
+# キー入力を注入している間に届いた操作を溜めておく受信バッファの大きさ。
+# OSの上限を超える分は切り詰められる
+RECEIVE_BUFFER_BYTES = 1 << 20
+# 1回のpressで押す回数の上限。送り手が送るのはノッチの段数ほどで、
+# それより多い回数は壊れたか偽の操作として切り詰める
+MAX_RECEIVED_PRESSES = 16
+
+type HostAddress = ipaddress.IPv4Address | ipaddress.IPv6Address
+
+
+def parse_host(text: str) -> HostAddress:
+    try:
+        return ipaddress.ip_address(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid IP address: {text!r}") from None
+
+
+def normalize_host(host: str) -> HostAddress:
+    # IPv6で待ち受けると、IPv4の送り手は ::ffff:192.0.2.1 の形で見える
+    address = ipaddress.ip_address(host.split("%", 1)[0])
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped is not None:
+        return address.ipv4_mapped
+    return address
+
+
+# NetworkKeySinkから届いたキー操作を、このマシンのキー出力先へ送る。
+# 通し番号の抜けに気付いたら押しているキーを離して送り手へ resync を返し、遅れて届いた古い操作は順序を守るため捨てる。
+# ループバック以外で待ち受けるときは、allowed_hosts に挙げた送り手の操作だけを受け付ける
+class KeyReceiver:
+    def __init__(
+        self,
+        sink: KeySink,
+        address: tuple[str, int],
+        fn_workaround: bool = False,
+        allowed_hosts: frozenset[HostAddress] = frozenset(),
+    ) -> None:
+        self.sink = sink
+        self.fn_workaround = fn_workaround
+        self.allowed_hosts = allowed_hosts
+        self.socket = socket.socket(
+            socket.AF_INET6 if ":" in address[0] else socket.AF_INET,
+            socket.SOCK_DGRAM,
+        )
+        try:
+            self.socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_BYTES
+            )
+            self.socket.bind(address)
+        except OSError:
+            self.socket.close()
+            raise
+        if not allowed_hosts and not normalize_host(self.address[0]).is_loopback:
+            self.socket.close()
+            raise ValueError(
+                "listening on a non-loopback address requires allowed sender hosts"
+            )
+        self.socket.settimeout(REPLY_POLL_INTERVAL)
+        self.session: int | None = None
+        self.expected_sequence = 0
+        self.held_keys: set[str] = set()
+        self.received_count = 0
+        self.lost_count = 0
+        self.stale_count = 0
+        self.invalid_count = 0
+        self.rejected_count = 0
+        self.resync_request_count = 0
+        self.stop_requested = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name="key-receiver", daemon=True
+        )
+
+    @property
+    def address(self) -> tuple[str, int]:
+        host, port, *_ = self.socket.getsockname()
+        return host, port
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_requested.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def close(self) -> None:
+        self.stop()
+        self.release_held_keys()
+        self.socket.close()
+
+    def run(self) -> None:
+        while not self.stop_requested.is_set():
+            try:
+                data, peer = self.socket.recvfrom(MAX_DATAGRAM_SIZE)
+            except TimeoutError:
+                continue
+            except OSError:
+                # Windowsでは、送り返した先が閉じているとICMPによるエラーが次の受信で返る
+                continue
+            self.handle_datagram(data, peer)
+
+    def is_allowed(self, peer: tuple[str, int]) -> bool:
+        host = normalize_host(peer[0])
+        return host.is_loopback or host in self.allowed_hosts
+
+    def handle_datagram(self, data: bytes, peer: tuple[str, int]) -> None:
+        if not self.is_allowed(peer):
+            self.rejected_count += 1
+            return
+        try:
+            datagram = decode_datagram(data)
+        except ValueError:
+            self.invalid_count += 1
+            return
+        if datagram.kind == "resync" or (
+            datagram.kind != "echo" and datagram.key not in KEY_NAMES
+        ):
+            self.invalid_count += 1
+            return
+
+        if datagram.session != self.session:
+            # 送り手が起動し直したら、押したままのキーを離して新しい番号から数え直す
+            self.release_held_keys()
+            self.session = datagram.session
+            self.expected_sequence = datagram.sequence
+
+        gap = sequence_gap(self.expected_sequence, datagram.sequence)
+        if gap < 0:
+            self.stale_count += 1
+            return
+        if gap > 0:
+            self.lost_count += gap
+            # 失われた操作がkey_upだとキーが押したままになるため、押しているキーを離しておく
+            self.release_held_keys()
+            self.request_resync(datagram, peer)
+        self.expected_sequence = (datagram.sequence + 1) % SEQUENCE_MODULUS
+        self.received_count += 1
+        try:
+            self.apply(datagram, peer)
+        except ValueError:
+            # X11で解決できないキーなど
+            self.invalid_count += 1
+
+    def apply(self, datagram: KeyDatagram, peer: tuple[str, int]) -> None:
+        match datagram.kind:
+            case "down":
+                self.sink.key_down(datagram.key)
+                self.held_keys.add(datagram.key)
+            case "up":
+                self.key_up(datagram.key)
+            case "press":
+                self.sink.press(
+                    datagram.key, min(datagram.presses, MAX_RECEIVED_PRESSES)
+                )
+            case _:
+                self.socket.sendto(encode_datagram(datagram), peer)
+                return
+        self.sink.flush()
+
+    def key_up(self, key: str) -> None:
+        self.sink.key_up(key)
+        self.held_keys.discard(key)
+        # 送り手はpyautoguiの回避策を知らないため、受け手の出力先に合わせてここで離す
+        if self.fn_workaround and key in FN_WORKAROUND_KEYS:
+            self.sink.key_up("fn")
+
+    def release_held_keys(self) -> None:
+        for key in sorted(self.held_keys):
+            self.key_up(key)
+        self.sink.flush()
+
+    def request_resync(self, datagram: KeyDatagram, peer: tuple[str, int]) -> None:
+        self.resync_request_count += 1
+        # 最初に抜けた番号と、抜けに気付いた操作を送った時刻を返す
+        reply = KeyDatagram(
+            "resync",
+            "",
+            1,
+            datagram.session,
+            self.expected_sequence,
+            datagram.timestamp_ns,
+        )
+        try:
+            self.socket.sendto(encode_datagram(reply), peer)
+        except OSError:
+            # 届かなくても、次の抜けでまた知らせる
+            pass
+
+    def format_summary(self) -> str:
+        return (
+            f"受信: {self.received_count} / 欠落: {self.lost_count} / "
+            f"順序違い: {self.stale_count} / 不正: {self.invalid_count} / "
+            f"拒否: {self.rejected_count} / "
+            f"合わせ直しの要求: {self.resync_request_count}"
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Receive key actions from main.py --key-sink network."
+    )
+    parser.add_argument(
+        "--listen",
+        type=parse_address,
+        default=("127.0.0.1", NETWORK_KEY_PORT),
+        help=(
+            f"HOST:PORT to listen on. Defaults to 127.0.0.1:{NETWORK_KEY_PORT}; "
+            f"use 0.0.0.0:{NETWORK_KEY_PORT} with --allow to accept keys from "
+            "another machine."
+        ),
+    )
+    parser.add_argument(
+        "--allow",
+        type=parse_host,
+        action="append",
+        default=[],
+        metavar="HOST",
+        help=(
+            "IP address of a machine allowed to send keys. Required when "
+            "listening on a non-loopback address; may be repeated."
+        ),
+    )
+    parser.add_argument(
+        "--key-sink",
+        choices=RECEIVER_KEY_SINK_NAMES,
+        default="pyautogui",
+        help="Backend used to inject the received keys on this machine.",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    sink = create_key_sink(args.key_sink)
+    try:
+        receiver = KeyReceiver(
+            sink,
+            args.listen,
+            fn_workaround=args.key_sink == "pyautogui",
+            allowed_hosts=frozenset(args.allow),
+        )
+    except ValueError:
+        print(
+            "ループバック以外で待ち受けるときは、--allow でキー入力を送るマシンの"
+            "IPアドレスを指定してください",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    except OSError as error:
+        print(
+            f"{args.listen[0]}:{args.listen[1]} で待ち受けられませんでした: {error}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    host, port = receiver.address
+    print(f"{host}:{port} でキー入力を待ち受けています。 Ctrl+C で終了します")
+    try:
+        receiver.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.close()
+    print(receiver.format_summary())
+
+
+if __name__ == "__main__":
+    main()
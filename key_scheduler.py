@@ -0,0 +1,70 @@
+import heapq
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from latency_stats import LatencyStats
+
+
+@dataclass(order=True, slots=True)
+class ScheduledTimer:
+    due: float
+    sequence: int
+    callback: Callable[[], None] = field(compare=False)
+    is_cancelled: bool = field(default=False, compare=False)
+
+    def cancel(self) -> None:
+        self.is_cancelled = True
+
+
+# 呼び出し側が now を書き換えて進める時計。記録の再生とテストで、実時間を待たずにタイマーを進める
+class ManualClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+# 予約したキー操作を期限の順に並べたヒープ。時刻は呼び出し側の単調増加する時計で渡すため、
+# テストでは仮想の時計で進められる。取り消した予約はヒープから除かず、取り出すときに読み飛ばす
+class KeyScheduler:
+    def __init__(self, latency_stats: LatencyStats | None = None) -> None:
+        self.timers: list[ScheduledTimer] = []
+        self.sequence = 0
+        self.latency_stats = latency_stats
+        self.fired_count = 0
+        self.max_lag = 0.0
+
+    @property
+    def next_deadline(self) -> float | None:
+        while self.timers and self.timers[0].is_cancelled:
+            heapq.heappop(self.timers)
+        return self.timers[0].due if self.timers else None
+
+    def schedule(self, due: float, callback: Callable[[], None]) -> ScheduledTimer:
+        # 同じ期限の予約は登録した順に実行する
+        self.sequence += 1
+        timer = ScheduledTimer(due, self.sequence, callback)
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def run_due(self, now: float) -> int:
+        fired_count = 0
+        while self.timers and self.timers[0].due <= now:
+            timer = heapq.heappop(self.timers)
+            if timer.is_cancelled:
+                continue
+
+            lag = now - timer.due
+            self.max_lag = max(self.max_lag, lag)
+            if self.latency_stats is not None:
+                self.latency_stats.record_timer_lag(round(lag * 1e9))
+            fired_count += 1
+            timer.callback()
+        self.fired_count += fired_count
+        return fired_count
+
+    def cancel_all(self) -> None:
+        for timer in self.timers:
+            timer.cancel()
+        self.timers.clear()
@@ -0,0 +1,127 @@
+from array import array
+from bisect import bisect_left
+from typing import Literal
+
+type EventKind = Literal["axis", "button", "hat"]
+
+EVENT_KINDS: tuple[EventKind, ...] = ("axis", "button", "hat")
+
+LATENCY_BUCKET_MIN_NS = 50_000
+LATENCY_BUCKET_MAX_NS = 10_000_000_000
+LATENCY_BUCKET_GROWTH = 2 ** (1 / 4)
+
+
+def latency_bucket_bounds() -> tuple[int, ...]:
+    # 50µsから10sまで、約19%刻みの対数バケット
+    bounds: list[int] = []
+    bound = float(LATENCY_BUCKET_MIN_NS)
+    while bound < LATENCY_BUCKET_MAX_NS:
+        bounds.append(round(bound))
+        bound *= LATENCY_BUCKET_GROWTH
+    bounds.append(LATENCY_BUCKET_MAX_NS)
+    return tuple(bounds)
+
+
+LATENCY_BUCKET_BOUNDS_NS = latency_bucket_bounds()
+
+
+class LatencyHistogram:
+    def __init__(self) -> None:
+        # 最後のバケットは上限を超えた値を数える
+        self.counts = array("q", bytes(8 * (len(LATENCY_BUCKET_BOUNDS_NS) + 1)))
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, latency_ns: int) -> None:
+        self.counts[bisect_left(LATENCY_BUCKET_BOUNDS_NS, latency_ns)] += 1
+        self.count += 1
+        self.total_ns += latency_ns
+        if latency_ns > self.max_ns:
+            self.max_ns = latency_ns
+
+    def percentile_ns(self, quantile: float) -> int:
+        if self.count == 0:
+            return 0
+
+        rank = quantile * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                if index == len(LATENCY_BUCKET_BOUNDS_NS):
+                    return self.max_ns
+                # バケットの上限を返すが、実測の最大値は超えない
+                return min(LATENCY_BUCKET_BOUNDS_NS[index], self.max_ns)
+        return self.max_ns
+
+
+class LatencyStats:
+    def __init__(self) -> None:
+        self.histograms: dict[EventKind, LatencyHistogram] = {
+            kind: LatencyHistogram() for kind in EVENT_KINDS
+        }
+        # 予約したキー操作が期限からどれだけ遅れて実行されたか
+        self.timer_lag = LatencyHistogram()
+        # マクロの各キー操作が、マクロの開始時刻から見た予定よりどれだけ遅れたか
+        self.macro_step_lag = LatencyHistogram()
+        self.event_kind: EventKind | None = None
+        self.event_time_ns = 0
+
+    def begin_event(self, kind: EventKind, timestamp_ns: int) -> None:
+        self.event_kind = kind
+        self.event_time_ns = timestamp_ns
+
+    def end_event(self) -> None:
+        # キーを出さなかったイベントの時刻を、後のタイマーや合わせ直しのキーに残さない
+        self.event_kind = None
+
+    def take_event(self) -> tuple[EventKind, int] | None:
+        # 1つのイベントから出る最初のキー操作だけを計測対象にする
+        if self.event_kind is None:
+            return None
+
+        event = (self.event_kind, self.event_time_ns)
+        self.event_kind = None
+        return event
+
+    def record(self, kind: EventKind, latency_ns: int) -> None:
+        self.histograms[kind].record(latency_ns)
+
+    def record_timer_lag(self, lag_ns: int) -> None:
+        self.timer_lag.record(lag_ns)
+
+    def record_macro_step_lag(self, lag_ns: int) -> None:
+        self.macro_step_lag.record(lag_ns)
+
+    def summary_ms(self) -> dict[EventKind, dict[str, float | int]]:
+        return {
+            kind: {
+                "count": histogram.count,
+                "p50": histogram.percentile_ns(0.5) / 1e6,
+                "p95": histogram.percentile_ns(0.95) / 1e6,
+                "p99": histogram.percentile_ns(0.99) / 1e6,
+                "max": histogram.max_ns / 1e6,
+            }
+            for kind, histogram in self.histograms.items()
+        }
+
+    def format_summary(self) -> str:
+        lines = [
+            f"{kind}: n={values['count']} "
+            f"p50={values['p50']:.1f}ms p95={values['p95']:.1f}ms "
+            f"p99={values['p99']:.1f}ms max={values['max']:.1f}ms"
+            for kind, values in self.summary_ms().items()
+        ]
+        for name, histogram in (
+            ("timer_lag", self.timer_lag),
+            ("macro_step_lag", self.macro_step_lag),
+        ):
+            if histogram.count:
+                lines.append(
+                    f"{name}: n={histogram.count} "
+                    f"p50={histogram.percentile_ns(0.5) / 1e6:.1f}ms "
+                    f"p99={histogram.percentile_ns(0.99) / 1e6:.1f}ms "
+                    f"max={histogram.max_ns / 1e6:.1f}ms"
+                )
+        return "\n".join(lines)
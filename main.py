@@ -1,23 +1,50 @@
-import argparse
-import sys
-import tkinter as tk
-from collections.abc import Callable
-from typing import Protocol
+import time
 
-import pygame
+# --startup-report でモジュールの読み込みにかかった時間も表示するため、最初に時刻を取る
+STARTED_AT = time.perf_counter()
 
-from accessibility_permission import (
+import argparse  # noqa: E402
+import signal  # noqa: E402
+import sys  # noqa: E402
+from collections.abc import Callable  # noqa: E402
+from pathlib import Path  # noqa: E402
+from types import FrameType  # noqa: E402
+from typing import Protocol  # noqa: E402
+
+import pygame  # noqa: E402
+
+from accessibility_permission import (  # noqa: E402
     is_accessibility_permission_granted,
     is_macos,
     prompt_for_accessibility_permission,
 )
-from mascon_controller import (
-    PYGAME_POLL_INTERVAL_MS,
+from cli_defaults import (  # noqa: E402
+    DEFAULT_CALIBRATION_PATH,
+    DEFAULT_MAPPING_CONFIG_PATH,
+    LOG_FORMATS,
+    NETWORK_KEY_PORT,
+    parse_address,
+)
+from input_thread import InputThread, StateLogger, initialize_pygame  # noqa: E402
+from key_emitter import KeyEmitter, KeyLog  # noqa: E402
+from latency_stats import LatencyStats  # noqa: E402
+from mascon_controller import (  # noqa: E402
+    DEFAULT_NOTCH_HYSTERESIS,
+    KEY_SINK_NAMES,
+    NOTCH_KEYS,
+    AxisCalibration,
+    KeySink,
     MasconController,
+    MasconDevice,
+    NotchFilter,
     TrainProfile,
-    ZuikiMasconButton,
+    XTestKeySink,
+    create_key_sink,
+    mapped_keys,
 )
-from status_window import StatusWindow
+from startup_report import StartupReport  # noqa: E402
+
+INPUT_THREAD_WATCH_INTERVAL_MS = 100
 
 
 class TkRoot(Protocol):
@@ -26,6 +53,28 @@ class TkRoot(Protocol):
     def mainloop(self) -> None: ...
 
 
+class ClosableWindow(Protocol):
+    def close(self) -> None: ...
+
+
+# 以下は指定したオプションで使うときだけ読み込むモジュールの型
+class RecordedNotchSettings(Protocol):
+    @property
+    def hysteresis(self) -> float: ...
+    @property
+    def min_dwell(self) -> float: ...
+
+
+class VerboseLog(KeyLog, StateLogger, Protocol):
+    def start(self) -> None: ...
+    def close(self) -> None: ...
+
+
+class BackgroundServer(Protocol):
+    def start(self) -> None: ...
+    def stop(self) -> None: ...
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -34,7 +83,123 @@ def parse_args() -> argparse.Namespace:
         default="default",
         help="Train profile for notch limits. default preserves the previous behavior.",
     )
-    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument(
+        "--key-sink",
+        choices=(*KEY_SINK_NAMES, "network"),
+        default="pyautogui",
+        help=(
+            "Backend for key output. xtest sends keys directly through X11 XTest. "
+            "print prints each key action instead of sending it, "
+            "both live and with --replay. "
+            "network sends them over UDP to key_receiver.py."
+        ),
+    )
+    parser.add_argument(
+        "--key-receiver",
+        type=parse_address,
+        default=("127.0.0.1", NETWORK_KEY_PORT),
+        help=(
+            "HOST:PORT of key_receiver.py for --key-sink network. "
+            f"Defaults to 127.0.0.1:{NETWORK_KEY_PORT}."
+        ),
+    )
+    parser.add_argument(
+        "--key-interval-ms",
+        type=float,
+        default=0.0,
+        help="Minimum interval between emitted key actions in milliseconds.",
+    )
+    parser.add_argument(
+        "--calibration",
+        type=Path,
+        default=DEFAULT_CALIBRATION_PATH,
+        help="Lever calibration file to load, or to write with --calibrate.",
+    )
+    parser.add_argument(
+        "--calibrate",
+        action="store_true",
+        help="Record the lever position of each notch and save the calibration.",
+    )
+    parser.add_argument(
+        "--hysteresis",
+        type=float,
+        help=(
+            "Axis distance the lever must move past a notch boundary to switch. "
+            f"Defaults to {DEFAULT_NOTCH_HYSTERESIS}, or the recorded value with "
+            "--replay."
+        ),
+    )
+    parser.add_argument(
+        "--min-dwell-ms",
+        type=float,
+        help=(
+            "Time the lever must stay in a new notch before it is committed. "
+            "Defaults to 0, or the recorded value with --replay."
+        ),
+    )
+    parser.add_argument(
+        "--mapping",
+        type=Path,
+        default=DEFAULT_MAPPING_CONFIG_PATH,
+        help=(
+            "TOML file with button mappings and train profiles. "
+            "Changes are applied while running."
+        ),
+    )
+    parser.add_argument(
+        "--record",
+        type=Path,
+        help="Record every controller event to this file.",
+    )
+    parser.add_argument(
+        "--replay",
+        type=Path,
+        help="Replay a recorded session instead of reading the controller.",
+    )
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=1.0,
+        help="Replay speed multiplier. 0 replays as fast as possible.",
+    )
+    parser.add_argument(
+        "--no-gui",
+        action="store_true",
+        help="Run without the status window. Use --verbose to print the state.",
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=LOG_FORMATS,
+        default="text",
+        help="Format of the --verbose log. json writes one JSON object per line.",
+    )
+    parser.add_argument(
+        "--startup-report",
+        action="store_true",
+        help="Print how long each startup phase took until the first event.",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print input-to-key latency percentiles on exit.",
+    )
+    metrics = parser.add_mutually_exclusive_group()
+    metrics.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Serve Prometheus metrics at http://127.0.0.1:PORT/metrics.",
+    )
+    metrics.add_argument(
+        "--metrics-socket",
+        type=Path,
+        help="Serve Prometheus metrics over HTTP on this Unix socket.",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Log the controller state and emitted keys to stdout.",
+    )
     return parser.parse_args()
 
 
@@ -49,63 +214,387 @@ def warn_if_accessibility_permission_is_missing() -> None:
         )
 
 
-def handle_pygame_events(
-    controller: MasconController, args: argparse.Namespace
+def load_axis_calibrations(path: Path) -> dict[str, AxisCalibration]:
+    if not path.exists():
+        return {}
+    from calibration import load_calibrations
+
+    try:
+        return load_calibrations(path)
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as error:
+        print(
+            f"キャリブレーションファイル {path} を読み込めませんでした: {error}",
+            file=sys.stderr,
+        )
+        return {}
+
+
+def calibrate(path: Path) -> None:
+    from calibration import run_calibration
+
+    controller = MasconController()
+    initialize_pygame(controller)
+    try:
+        if not controller.joysticks:
+            print("コントローラーが認識されていません", file=sys.stderr)
+            sys.exit(1)
+
+        joystick = next(iter(controller.joysticks.values()))
+        try:
+            calibration = run_calibration(joystick, path)
+        except ValueError as error:
+            print(f"キャリブレーションに失敗しました: {error}", file=sys.stderr)
+            sys.exit(1)
+    finally:
+        pygame.quit()
+
+    print(
+        f"キャリブレーション結果 (レバーの軸: {calibration.lever_axis}) を "
+        f"{path} に保存しました"
+    )
+
+
+def create_notch_filter(
+    args: argparse.Namespace, recording: RecordedNotchSettings | None = None
+) -> NotchFilter:
+    # 指定がなければ、再生時は記録したときの設定を使う
+    notch_filter = (
+        NotchFilter()
+        if recording is None
+        else NotchFilter(recording.hysteresis, recording.min_dwell)
+    )
+    if args.hysteresis is not None:
+        notch_filter.hysteresis = args.hysteresis
+    if args.min_dwell_ms is not None:
+        notch_filter.min_dwell = args.min_dwell_ms / 1000
+    return notch_filter
+
+
+def create_controller(
+    args: argparse.Namespace,
+    key_sink: KeySink,
+    latency_stats: LatencyStats,
+    recording: RecordedNotchSettings | None = None,
+) -> MasconController:
+    return MasconController(
+        MasconDevice(
+            profile=TrainProfile[args.profile.upper()],
+            key_sink=key_sink,
+            notch_filter=create_notch_filter(args, recording),
+            fn_workaround=args.key_sink == "pyautogui",
+        ),
+        axis_calibrations=load_axis_calibrations(args.calibration),
+        latency_stats=latency_stats,
+    )
+
+
+def load_mapping_file(path: Path, controller: MasconController) -> None:
+    # ファイルがなければ組み込みの設定を使う
+    if not path.exists():
+        return
+    from mapping_config import apply_mapping_config, load_mapping_config
+
+    try:
+        apply_mapping_config(controller, load_mapping_config(path))
+    except (OSError, ValueError) as error:
+        print(
+            f"マッピングファイル {path} を読み込めませんでした: {error}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+def warn_about_mapping_reload_error(path: Path, error: Exception) -> None:
+    print(
+        f"マッピングファイル {path} を読み込めませんでした。"
+        f"以前の設定を使い続けます: {error}",
+        file=sys.stderr,
+    )
+
+
+def resolve_mapped_keys(sink: KeySink, controller: MasconController) -> None:
+    if not isinstance(sink, XTestKeySink):
+        return
+    # 読み込み直したマッピングも、切り替える前にX11で送れるかを確かめる
+    controller.resolve_keys = sink.resolve_keys
+    try:
+        sink.resolve_keys(
+            mapped_keys(controller.primary.compiled_mapping) | set(NOTCH_KEYS)
+        )
+    except ValueError as error:
+        print(f"X11で送れないキーがあります: {error}", file=sys.stderr)
+        sys.exit(1)
+
+
+def create_output_sink(args: argparse.Namespace) -> KeySink:
+    if args.key_sink != "network":
+        return create_key_sink(args.key_sink)
+    from network_key_sink import NetworkKeySink
+
+    host, port = args.key_receiver
+    try:
+        return NetworkKeySink(args.key_receiver)
+    except OSError as error:
+        print(
+            f"キー入力の送り先 {host}:{port} に接続できませんでした: {error}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+def request_notch_resync(controller: MasconController) -> None:
+    with controller.lock:
+        controller.request_resync()
+
+
+def start_network_key_sink(sink: KeySink, controller: MasconController) -> None:
+    # NetworkKeySinkを作っていなければ、モジュールも読み込まれていない
+    if "network_key_sink" not in sys.modules:
+        return
+    from network_key_sink import NetworkKeySink
+
+    if isinstance(sink, NetworkKeySink):
+        sink.on_resync_request = lambda: request_notch_resync(controller)
+        sink.start()
+
+
+def close_network_key_sink(sink: KeySink) -> None:
+    if "network_key_sink" not in sys.modules:
+        return
+    from network_key_sink import NetworkKeySink
+
+    if isinstance(sink, NetworkKeySink):
+        sink.close()
+
+
+def create_state_log(args: argparse.Namespace) -> VerboseLog | None:
+    if not args.verbose:
+        return None
+    from state_log import StateLog
+
+    return StateLog(sys.stdout, args.log_format)
+
+
+def create_metrics_server(
+    args: argparse.Namespace,
+    controller: MasconController,
+    emitter: KeyEmitter,
+    latency_stats: LatencyStats,
+) -> BackgroundServer | None:
+    if args.metrics_port is None and args.metrics_socket is None:
+        return None
+    # HTTPサーバーの読み込みは重いため、メトリクスを出すときだけ読み込む
+    from metrics_server import MetricsExporter, MetricsServer
+
+    exporter = MetricsExporter(controller, emitter, latency_stats)
+    try:
+        return MetricsServer(exporter, args.metrics_port, args.metrics_socket)
+    except OSError as error:
+        exporter.close()
+        print(
+            f"メトリクスのサーバーを起動できませんでした: {error}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+def replay(args: argparse.Namespace) -> None:
+    from session_recording import read_recording, replay_session
+
+    try:
+        recording = read_recording(args.replay)
+    except (OSError, ValueError) as error:
+        print(
+            f"記録ファイル {args.replay} を読み込めませんでした: {error}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    latency_stats = LatencyStats()
+    state_log = create_state_log(args)
+    sink = create_output_sink(args)
+    emitter = KeyEmitter(
+        sink,
+        min_interval=args.key_interval_ms / 1000,
+        latency_stats=latency_stats,
+        log=state_log,
+    )
+    controller = create_controller(args, emitter, latency_stats, recording)
+    resolve_mapped_keys(sink, controller)
+    load_mapping_file(args.mapping, controller)
+
+    if state_log is not None:
+        state_log.start()
+    start_network_key_sink(sink, controller)
+    emitter.start()
+    try:
+        replay_session(
+            recording.events,
+            controller,
+            speed=args.replay_speed or None,
+            state_log=state_log,
+        )
+    finally:
+        emitter.close()
+        close_network_key_sink(sink)
+        if state_log is not None:
+            state_log.close()
+
+    if args.stats:
+        print(latency_stats.format_summary())
+
+
+def stop_input(
+    input_thread: InputThread,
+    emitter: KeyEmitter,
+    latency_stats: LatencyStats | None = None,
 ) -> None:
-    for event in pygame.event.get():
-        match event.type:
-            case pygame.JOYDEVICEADDED:
-                controller.register_joystick(event.dict["device_index"])
-            case pygame.JOYDEVICEREMOVED:
-                controller.unregister_joystick(event.dict["instance_id"])
-            case pygame.JOYAXISMOTION:
-                controller.handle_axis_motion(event.dict["value"])
-            case pygame.JOYBUTTONDOWN:
-                controller.handle_button_down(ZuikiMasconButton(event.dict["button"]))
-            case pygame.JOYBUTTONUP:
-                controller.handle_button_up(ZuikiMasconButton(event.dict["button"]))
-            case pygame.JOYHATMOTION:
-                controller.handle_hat_motion(*event.dict["value"])
-            case pygame.QUIT:
-                controller.release_all_inputs()
-                sys.exit()
-            case _:
-                pass
-
-        if args.verbose:
-            controller.print_state()
-
-
-def poll_pygame_events(
-    root: TkRoot, controller: MasconController, args: argparse.Namespace
+    input_thread.stop()
+    emitter.close()
+    if latency_stats is not None:
+        print(latency_stats.format_summary())
+
+
+def close_when_input_thread_stops(
+    root: TkRoot, input_thread: InputThread, status_window: ClosableWindow
 ) -> None:
-    handle_pygame_events(controller, args)
+    if not input_thread.is_alive():
+        status_window.close()
+        return
+
     root.after(
-        PYGAME_POLL_INTERVAL_MS,
-        lambda: poll_pygame_events(root, controller, args),
+        INPUT_THREAD_WATCH_INTERVAL_MS,
+        lambda: close_when_input_thread_stops(root, input_thread, status_window),
     )
 
 
-def initialize_pygame(controller: MasconController) -> None:
-    pygame.init()
-    pygame.display.set_allow_screensaver(True)
-    controller.initialize_joysticks()
+def run_status_window(
+    controller: MasconController,
+    input_thread: InputThread,
+    emitter: KeyEmitter,
+    latency_stats: LatencyStats,
+    print_stats: bool,
+    startup_report: StartupReport | None = None,
+) -> None:
+    # --no-gui のときにTkを読み込まないよう、ここで読み込む
+    import tkinter as tk
+
+    from status_window import StatusWindow
+
+    root = tk.Tk()
+    status_window = StatusWindow(
+        root,
+        controller,
+        on_close=lambda: stop_input(
+            input_thread, emitter, latency_stats if print_stats else None
+        ),
+        latency_stats=latency_stats,
+    )
+    if startup_report is not None:
+        startup_report.mark("status_window")
+
+    emitter.start()
+    input_thread.start()
+
+    close_when_input_thread_stops(root, input_thread, status_window)
+    root.mainloop()
+
+
+def run_headless(
+    input_thread: InputThread,
+    emitter: KeyEmitter,
+    latency_stats: LatencyStats | None = None,
+) -> None:
+    def request_stop(signum: int, frame: FrameType | None) -> None:
+        input_thread.stop_requested.set()
+
+    # 入力スレッドは次のイベント待ちのタイムアウトで止まり、押したままのキーを離す
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, request_stop)
+
+    emitter.start()
+    input_thread.start()
+    input_thread.join()
+    stop_input(input_thread, emitter, latency_stats)
 
 
 def main() -> None:
+    startup_report = StartupReport(STARTED_AT, sys.stderr)
+    startup_report.mark("import")
     args = parse_args()
-    controller = MasconController(profile=TrainProfile[args.profile.upper()])
+    if args.calibrate:
+        calibrate(args.calibration)
+        return
+    if args.replay is not None:
+        replay(args)
+        return
+
+    latency_stats = LatencyStats()
+    state_log = create_state_log(args)
+    key_sink = create_output_sink(args)
+    emitter = KeyEmitter(
+        key_sink,
+        min_interval=args.key_interval_ms / 1000,
+        latency_stats=latency_stats,
+        log=state_log,
+    )
+    controller = create_controller(args, emitter, latency_stats)
+    resolve_mapped_keys(key_sink, controller)
+    load_mapping_file(args.mapping, controller)
+    startup_report.mark("key_sink_and_controller")
 
     prompt_for_accessibility_permission()
     warn_if_accessibility_permission_is_missing()
 
-    root = tk.Tk()
-    StatusWindow(root, controller)
+    recorder = None
+    if args.record is not None:
+        from session_recording import SessionRecorder
 
-    initialize_pygame(controller)
+        recorder = SessionRecorder(
+            args.record,
+            hysteresis=controller.primary.notch_filter.hysteresis,
+            min_dwell=controller.primary.notch_filter.min_dwell,
+        )
+    input_thread = InputThread(
+        controller,
+        state_log=state_log,
+        recorder=recorder,
+        startup_report=startup_report if args.startup_report else None,
+        key_emitter=emitter,
+    )
+    from mapping_config import MappingConfigWatcher
 
-    poll_pygame_events(root, controller, args)
-    root.mainloop()
+    mapping_watcher = MappingConfigWatcher(
+        args.mapping, controller, on_error=warn_about_mapping_reload_error
+    )
+    metrics_server = create_metrics_server(args, controller, emitter, latency_stats)
+    mapping_watcher.start()
+    start_network_key_sink(key_sink, controller)
+    if state_log is not None:
+        state_log.start()
+    if metrics_server is not None:
+        metrics_server.start()
+    try:
+        if args.no_gui:
+            run_headless(input_thread, emitter, latency_stats if args.stats else None)
+        else:
+            run_status_window(
+                controller,
+                input_thread,
+                emitter,
+                latency_stats,
+                args.stats,
+                startup_report,
+            )
+    finally:
+        mapping_watcher.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+        # キー出力が止まった後に閉じる
+        close_network_key_sink(key_sink)
+        # 入力スレッドとキー出力が止まった後に、残りの記録を書き出す
+        if state_log is not None:
+            state_log.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,297 @@
+import threading
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import cast
+
+from key_macro import Hold, Macro, MacroStep, Tap, Wait
+from mascon_controller import (
+    MAPPING_TO_KEYBOARD,
+    PROFILE_LABELS,
+    PROFILE_LIMITS,
+    DeviceBinding,
+    DpadButton,
+    HoldKeys,
+    KeyMapping,
+    MasconController,
+    Notch,
+    ProfileLimit,
+    RepeatKey,
+    TrainProfile,
+    ZuikiMasconButton,
+)
+
+MAPPING_CONFIG_POLL_INTERVAL = 1.0
+
+type FileSignature = tuple[int, int] | None
+
+
+@dataclass(frozen=True)
+class MappingConfig:
+    mapping: KeyMapping
+    profile_limits: dict[TrainProfile, ProfileLimit]
+    profile_labels: dict[TrainProfile, str]
+    device_bindings: dict[str, DeviceBinding] = field(default_factory=dict)
+
+
+def as_table(value: object, context: str, keys: tuple[str, ...]) -> dict[str, object]:
+    if not isinstance(value, dict):
+        raise ValueError(f"{context}: expected a table")
+    # TOMLのテーブルのキーは常に文字列
+    table = cast(dict[str, object], value)
+    for key in table:
+        if key not in keys:
+            raise ValueError(f"{context}: unknown setting {key}")
+    return table
+
+
+def as_list(value: object, context: str) -> list[object]:
+    if not isinstance(value, list):
+        raise ValueError(f"{context}: expected a list")
+    return cast(list[object], value)
+
+
+def parse_keys(value: object, context: str) -> tuple[str, ...]:
+    if isinstance(value, str):
+        return (value,)
+    keys: list[str] = []
+    for key in as_list(value, context):
+        if not isinstance(key, str):
+            raise ValueError(f"{context}: keys must be strings")
+        keys.append(key)
+    return tuple(keys)
+
+
+def parse_seconds(value: object, context: str) -> float:
+    if isinstance(value, bool) or not isinstance(value, int | float):
+        raise ValueError(f"{context}: expected a number of seconds")
+    return float(value)
+
+
+def parse_macro_step(value: object, context: str) -> MacroStep:
+    step = as_table(value, context, ("tap", "hold", "duration", "wait"))
+    match sorted(step):
+        case ["tap"]:
+            return Tap(parse_keys(step["tap"], context))
+        case ["duration", "hold"]:
+            return Hold(
+                parse_keys(step["hold"], context),
+                parse_seconds(step["duration"], context),
+            )
+        case ["wait"]:
+            return Wait(parse_seconds(step["wait"], context))
+        case _:
+            raise ValueError(f"{context}: unknown macro step")
+
+
+def parse_button_entry(
+    value: object, context: str
+) -> str | tuple[str, ...] | HoldKeys | RepeatKey | Macro:
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return parse_keys(cast(list[object], value), context)
+
+    entry = as_table(
+        value, context, ("hold", "duration", "repeat", "interval", "macro")
+    )
+    match sorted(entry):
+        case ["duration", "hold"]:
+            return HoldKeys(
+                parse_keys(entry["hold"], context),
+                parse_seconds(entry["duration"], context),
+            )
+        case ["interval", "repeat"] if isinstance(entry["repeat"], str):
+            return RepeatKey(entry["repeat"], parse_seconds(entry["interval"], context))
+        case ["macro"]:
+            return Macro(
+                tuple(
+                    parse_macro_step(step, f"{context} step {index + 1}")
+                    for index, step in enumerate(as_list(entry["macro"], context))
+                )
+            )
+        case _:
+            raise ValueError(f"{context}: unknown mapping")
+
+
+def parse_button(name: str) -> ZuikiMasconButton | DpadButton:
+    upper = name.upper()
+    if upper in ZuikiMasconButton.__members__:
+        return ZuikiMasconButton[upper]
+    if upper in DpadButton.__members__:
+        return DpadButton[upper]
+    raise ValueError(f"unknown button: {name}")
+
+
+def parse_notch(value: object, context: str) -> Notch:
+    if not isinstance(value, str) or value.upper() not in Notch.__members__:
+        raise ValueError(f"{context}: unknown notch {value!r}")
+    return Notch[value.upper()]
+
+
+def parse_profile(
+    value: object, context: str, limit: ProfileLimit, label: str
+) -> tuple[ProfileLimit, str]:
+    profile = as_table(value, context, ("label", "max_power", "max_brake"))
+    max_power = parse_notch(profile.get("max_power", limit.max_power.name), context)
+    max_brake = parse_notch(profile.get("max_brake", limit.max_brake.name), context)
+    if not Notch.P1 <= max_power <= Notch.P5:
+        raise ValueError(f"{context}: max_power must be between P1 and P5")
+    if not Notch.B8 <= max_brake <= Notch.B1:
+        raise ValueError(f"{context}: max_brake must be between B1 and B8")
+
+    new_label = profile.get("label", label)
+    if not isinstance(new_label, str) or not new_label:
+        raise ValueError(f"{context}: label must be a non-empty string")
+    return ProfileLimit(max_power=max_power, max_brake=max_brake), new_label
+
+
+def parse_buttons(value: object, context: str, base: KeyMapping) -> KeyMapping:
+    mapping = dict(base)
+    buttons = as_table(
+        value,
+        context,
+        tuple(
+            name.lower()
+            for name in (*ZuikiMasconButton.__members__, *DpadButton.__members__)
+        ),
+    )
+    for name, entry in buttons.items():
+        mapping[parse_button(name)] = parse_button_entry(entry, f"{context}.{name}")
+    return mapping
+
+
+def parse_device_binding(
+    value: object, context: str, mapping: KeyMapping
+) -> DeviceBinding:
+    # 書かなかった項目は、ファイル全体の設定とキャリブレーションの結果を使う
+    device = as_table(value, context, ("buttons", "profile", "lever_axis"))
+    profile = device.get("profile")
+    if profile is not None and (
+        not isinstance(profile, str) or profile.upper() not in TrainProfile.__members__
+    ):
+        raise ValueError(f"{context}: unknown profile {profile!r}")
+    lever_axis = device.get("lever_axis")
+    if lever_axis is not None and (
+        isinstance(lever_axis, bool)
+        or not isinstance(lever_axis, int)
+        or lever_axis < 0
+    ):
+        raise ValueError(f"{context}: lever_axis must be a non-negative integer")
+    return DeviceBinding(
+        mapping=parse_buttons(device["buttons"], f"{context}.buttons", mapping)
+        if "buttons" in device
+        else None,
+        profile=None if profile is None else TrainProfile[profile.upper()],
+        lever_axis=lever_axis,
+    )
+
+
+def parse_mapping_config(data: dict[str, object]) -> MappingConfig:
+    # ファイルに書かれていないボタンと車種は組み込みの設定を使う
+    config = as_table(data, "mapping file", ("buttons", "profiles", "devices"))
+
+    mapping = parse_buttons(config.get("buttons", {}), "buttons", MAPPING_TO_KEYBOARD)
+
+    profile_limits = dict(PROFILE_LIMITS)
+    profile_labels = dict(PROFILE_LABELS)
+    profiles = as_table(
+        config.get("profiles", {}),
+        "profiles",
+        tuple(name.lower() for name in TrainProfile.__members__),
+    )
+    for name, value in profiles.items():
+        profile = TrainProfile[name.upper()]
+        profile_limits[profile], profile_labels[profile] = parse_profile(
+            value, f"profiles.{name}", profile_limits[profile], profile_labels[profile]
+        )
+
+    # デバイス名はジョイスティックの名前そのままのため、どんな名前でも受け付ける
+    devices = config.get("devices", {})
+    if not isinstance(devices, dict):
+        raise ValueError("devices: expected a table")
+    device_bindings = {
+        name: parse_device_binding(value, f'devices."{name}"', mapping)
+        for name, value in cast(dict[str, object], devices).items()
+    }
+    return MappingConfig(mapping, profile_limits, profile_labels, device_bindings)
+
+
+def load_mapping_config(path: Path) -> MappingConfig:
+    # 実行中に見張るだけなら使わないため、ファイルを読むときに読み込む
+    import tomllib
+
+    with path.open("rb") as file:
+        return parse_mapping_config(tomllib.load(file))
+
+
+def file_signature(path: Path) -> FileSignature:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def apply_mapping_config(controller: MasconController, config: MappingConfig) -> None:
+    # 入力スレッドがイベントを処理していない間に入れ替える
+    with controller.lock:
+        controller.apply_mapping(
+            config.mapping,
+            config.profile_limits,
+            config.profile_labels,
+            config.device_bindings,
+        )
+
+
+# 設定ファイルの更新日時と大きさをバックグラウンドのスレッドで見張り、
+# 変わったら読み直して反映する。読み込めないときは以前の設定を使い続ける
+class MappingConfigWatcher:
+    def __init__(
+        self,
+        path: Path,
+        controller: MasconController,
+        on_error: Callable[[Path, Exception], None],
+        interval: float = MAPPING_CONFIG_POLL_INTERVAL,
+    ) -> None:
+        self.path = path
+        self.controller = controller
+        self.on_error = on_error
+        self.interval = interval
+        self.signature = file_signature(path)
+        self.reload_count = 0
+        self.error_count = 0
+        self.stop_requested = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name="mapping-config", daemon=True
+        )
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_requested.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def check_once(self) -> bool:
+        signature = file_signature(self.path)
+        if signature == self.signature:
+            return False
+        self.signature = signature
+        # ファイルを消したときは、次に作られるまで今の設定を使い続ける
+        if signature is None:
+            return False
+
+        try:
+            apply_mapping_config(self.controller, load_mapping_config(self.path))
+        except (OSError, ValueError) as error:
+            self.error_count += 1
+            self.on_error(self.path, error)
+            return False
+        self.reload_count += 1
+        return True
+
+    def run(self) -> None:
+        while not self.stop_requested.wait(self.interval):
+            self.check_once()
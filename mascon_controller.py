@@ -1,12 +1,19 @@
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from collections.abc import Callable, Iterable, Sequence
 from dataclasses import dataclass, field
 from enum import Enum, IntEnum, auto
+from functools import cache
+from typing import ClassVar, Protocol, TextIO
 
 import pygame
-import pyautogui
-from pyautogui import press
 
-INPUT_POLL_HZ = 60
-PYGAME_POLL_INTERVAL_MS = 1000 // INPUT_POLL_HZ
+from key_macro import Macro, MacroAction, MacroRun, compile_macro
+from key_scheduler import KeyScheduler, ScheduledTimer
+from latency_stats import EVENT_KINDS, EventKind, LatencyStats
 
 
 class TrainProfile(Enum):
@@ -37,11 +44,15 @@ class ZuikiMasconButton(IntEnum):
     CAPTURE = 13
 
 
-class DpadButton(Enum):
-    UP = auto()
-    DOWN = auto()
-    LEFT = auto()
-    RIGHT = auto()
+# マスコンのボタン番号と重ならない番号にして、ボタンと同じ配列の添字に使う
+class DpadButton(IntEnum):
+    UP = 16
+    DOWN = 17
+    LEFT = 18
+    RIGHT = 19
+
+
+MAPPING_SLOT_COUNT = max(DpadButton) + 1
 
 
 class Notch(IntEnum):
@@ -75,7 +86,26 @@ PROFILE_LIMITS: dict[TrainProfile, ProfileLimit] = {
 }
 
 
-MAPPING_TO_KEYBOARD: dict[ZuikiMasconButton | DpadButton, str | tuple[str, ...]] = {
+# ボタンを押すと keys を押し、ボタンを離しても duration 秒間は押したままにする
+@dataclass(frozen=True)
+class HoldKeys:
+    keys: tuple[str, ...]
+    duration: float
+
+
+# ボタンを押している間、key を interval 秒ごとに押し直す
+@dataclass(frozen=True)
+class RepeatKey:
+    key: str
+    interval: float
+
+
+type KeyMapping = dict[
+    ZuikiMasconButton | DpadButton,
+    str | tuple[str, ...] | HoldKeys | RepeatKey | Macro,
+]
+
+MAPPING_TO_KEYBOARD: KeyMapping = {
     # 警笛（2段目）
     ZuikiMasconButton.A: "backspace",
     # 警笛（1段目）
@@ -109,60 +139,517 @@ MAPPING_TO_KEYBOARD: dict[ZuikiMasconButton | DpadButton, str | tuple[str, ...]]
 }
 
 
-def map_to_keys(button: ZuikiMasconButton | DpadButton) -> tuple[str, ...]:
-    match MAPPING_TO_KEYBOARD[button]:
+# pyautoguiのキー名からX11のkeysym名への対応。英数字1文字のキーはそのままkeysym名として解決する
+X11_KEYSYM_NAMES: dict[str, str] = {
+    "backspace": "BackSpace",
+    "enter": "Return",
+    "return": "Return",
+    "\n": "Return",
+    "esc": "Escape",
+    "escape": "Escape",
+    "space": "space",
+    "tab": "Tab",
+    "\t": "Tab",
+    "up": "Up",
+    "down": "Down",
+    "left": "Left",
+    "right": "Right",
+    "home": "Home",
+    "end": "End",
+    "pageup": "Prior",
+    "pagedown": "Next",
+    "insert": "Insert",
+    "del": "Delete",
+    "delete": "Delete",
+    "pause": "Pause",
+    "capslock": "Caps_Lock",
+    "command": "Super_L",
+    "win": "Super_L",
+    "winleft": "Super_L",
+    "winright": "Super_R",
+    "ctrl": "Control_L",
+    "ctrlleft": "Control_L",
+    "ctrlright": "Control_R",
+    "shift": "Shift_L",
+    "shiftleft": "Shift_L",
+    "shiftright": "Shift_R",
+    "alt": "Alt_L",
+    "altleft": "Alt_L",
+    "altright": "Alt_R",
+    "option": "Alt_L",
+    "optionleft": "Alt_L",
+    "optionright": "Alt_R",
+    # XF86のkeysymは XTestKeySink が読み込む
+    "volumeup": "XF86_AudioRaiseVolume",
+    "volumedown": "XF86_AudioLowerVolume",
+    "volumemute": "XF86_AudioMute",
+    " ": "space",
+    "!": "exclam",
+    '"': "quotedbl",
+    "#": "numbersign",
+    "$": "dollar",
+    "%": "percent",
+    "&": "ampersand",
+    "'": "apostrophe",
+    "(": "parenleft",
+    ")": "parenright",
+    "*": "asterisk",
+    "+": "plus",
+    ",": "comma",
+    "-": "minus",
+    ".": "period",
+    "/": "slash",
+    ":": "colon",
+    ";": "semicolon",
+    "<": "less",
+    "=": "equal",
+    ">": "greater",
+    "?": "question",
+    "@": "at",
+    "[": "bracketleft",
+    "\\": "backslash",
+    "]": "bracketright",
+    "^": "asciicircum",
+    "_": "underscore",
+    "`": "grave",
+    "{": "braceleft",
+    "|": "bar",
+    "}": "braceright",
+    "~": "asciitilde",
+    **{f"f{number}": f"F{number}" for number in range(1, 25)},
+    **{f"num{number}": f"KP_{number}" for number in range(10)},
+}
+
+# X11にkeysymがなく、XTestでは送れないキー
+X11_UNSUPPORTED_KEYS = frozenset({"fn"})
+
+
+class KeySink(Protocol):
+    def key_down(self, key: str) -> None: ...
+
+    def key_up(self, key: str) -> None: ...
+
+    def press(self, key: str, presses: int = 1) -> None: ...
+
+    def flush(self) -> None: ...
+
+
+# キー入力にしか使わないため、スクリーンショット(Pillow)やメッセージボックスなどの
+# pyautoguiの任意依存は読み込ませない
+PYAUTOGUI_UNUSED_MODULES = ("pyscreeze", "pymsgbox", "pytweening", "mouseinfo")
+
+
+def block_unused_pyautogui_modules() -> None:
+    for name in PYAUTOGUI_UNUSED_MODULES:
+        if name not in sys.modules:
+            sys.modules[name] = None  # pyright: ignore[reportArgumentType]
+
+
+class PyAutoGuiKeySink:
+    def __init__(self) -> None:
+        # 起動を速くするため、このキー出力先を使うときに初めて読み込む
+        block_unused_pyautogui_modules()
+        import pyautogui
+
+        # pyautoguiは呼び出しごとに既定で0.1秒待つ。キー入力の間隔はKeyEmitterの
+        # --key-interval-ms で決めるため、ここでは待たない
+        pyautogui.PAUSE = 0
+        self.pyautogui_key_down = pyautogui.keyDown
+        self.pyautogui_key_up = pyautogui.keyUp
+        self.pyautogui_press = pyautogui.press
+
+    def key_down(self, key: str) -> None:
+        self.pyautogui_key_down(key)
+
+    def key_up(self, key: str) -> None:
+        self.pyautogui_key_up(key)
+
+    def press(self, key: str, presses: int = 1) -> None:
+        self.pyautogui_press(key, presses)
+
+    def flush(self) -> None:
+        pass
+
+
+class XTestKeySink:
+    def __init__(self, display_name: str | None = None) -> None:
+        # Linux専用の経路でのみ読み込む。型はローカルのスタブで補う
+        from Xlib import X, XK  # pyright: ignore[reportMissingModuleSource]
+        from Xlib.display import Display  # pyright: ignore[reportMissingModuleSource]
+        from Xlib.ext.xtest import (  # pyright: ignore[reportMissingModuleSource]
+            fake_input,
+        )
+
+        XK.load_keysym_group("xf86")
+        self.display = Display(display_name)
+        self.key_press_event = X.KeyPress
+        self.key_release_event = X.KeyRelease
+        self.string_to_keysym = XK.string_to_keysym
+        self.fake_input = fake_input
+        self.keycodes: dict[str, int] = {}
+
+    def resolve_keys(self, keys: Iterable[str]) -> None:
+        # キーコードを起動時にまとめて解決し、解決できないキーは最初に押す前に弾く
+        for key in keys:
+            self.keycode(key)
+
+    def keycode(self, key: str) -> int:
+        keycode = self.keycodes.get(key)
+        if keycode is None:
+            keysym = self.string_to_keysym(X11_KEYSYM_NAMES.get(key, key))
+            keycode = self.display.keysym_to_keycode(keysym) if keysym else 0
+            if not keycode:
+                raise ValueError(f"unknown key for X11: {key!r}")
+            self.keycodes[key] = keycode
+        return keycode
+
+    def key_down(self, key: str) -> None:
+        self.fake_input(self.display, self.key_press_event, self.keycode(key))
+
+    def key_up(self, key: str) -> None:
+        self.fake_input(self.display, self.key_release_event, self.keycode(key))
+
+    def press(self, key: str, presses: int = 1) -> None:
+        for _ in range(presses):
+            self.key_down(key)
+            self.key_up(key)
+
+    def flush(self) -> None:
+        self.display.flush()
+
+    def close(self) -> None:
+        self.display.close()
+
+
+# キーを送らずに捨てる。キー出力先を指定しないデバイスやキャリブレーションで使う
+class NullKeySink:
+    def key_down(self, key: str) -> None:
+        pass
+
+    def key_up(self, key: str) -> None:
+        pass
+
+    def press(self, key: str, presses: int = 1) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+
+@dataclass
+class RecordingKeySink:
+    actions: list[tuple[str, str]] = field(default_factory=list)
+    flush_count: int = 0
+
+    def key_down(self, key: str) -> None:
+        self.actions.append(("down", key))
+
+    def key_up(self, key: str) -> None:
+        self.actions.append(("up", key))
+
+    def press(self, key: str, presses: int = 1) -> None:
+        self.actions.extend(("press", key) for _ in range(presses))
+
+    def flush(self) -> None:
+        self.flush_count += 1
+
+    def pressed_keys(self) -> list[str]:
+        return [key for action, key in self.actions if action == "press"]
+
+
+# キーを送らずに、送るはずだった操作を1行ずつ書き出す。溜めずに書き出すため、
+# 実行中のマスコン操作にも使える
+@dataclass
+class PrintingKeySink:
+    file: TextIO = field(default_factory=lambda: sys.stdout)
+
+    def key_down(self, key: str) -> None:
+        print("down", key, file=self.file)
+
+    def key_up(self, key: str) -> None:
+        print("up", key, file=self.file)
+
+    def press(self, key: str, presses: int = 1) -> None:
+        for _ in range(presses):
+            print("press", key, file=self.file)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+
+KEY_SINK_NAMES = ("pyautogui", "xtest", "print")
+
+
+def create_key_sink(name: str) -> KeySink:
+    match name:
+        case "pyautogui":
+            return PyAutoGuiKeySink()
+        case "xtest":
+            return XTestKeySink()
+        case "print":
+            return PrintingKeySink()
+        case _:
+            raise ValueError(f"unknown key sink: {name}")
+
+
+# マッピングに使えるキー名。pyautoguiのキー名に合わせ、X11では X11_KEYSYM_NAMES で解決する
+KEY_NAMES: frozenset[str] = frozenset(
+    (
+        *(
+            chr(code)
+            for code in range(ord(" "), ord("~") + 1)
+            if not chr(code).isupper()
+        ),
+        *(f"f{number}" for number in range(1, 25)),
+        *(f"num{number}" for number in range(10)),
+        *X11_KEYSYM_NAMES,
+        "\t",
+        "\n",
+        "altleft",
+        "altright",
+        "capslock",
+        "ctrlleft",
+        "ctrlright",
+        "del",
+        "delete",
+        "end",
+        "escape",
+        "fn",
+        "home",
+        "insert",
+        "option",
+        "optionleft",
+        "optionright",
+        "pagedown",
+        "pageup",
+        "pause",
+        "return",
+        "shiftleft",
+        "shiftright",
+        "volumedown",
+        "volumemute",
+        "volumeup",
+        "win",
+        "winleft",
+        "winright",
+    )
+)
+
+# 離したあとにfnキーも離す必要があるキー
+# https://github.com/asweigart/pyautogui/issues/796#issuecomment-1937049349
+FN_WORKAROUND_KEYS = frozenset({"up", "down", "left", "right"})
+
+
+# マッピングの1ボタン分を、押すたびに解釈しなくてよい形にしたもの
+@dataclass(frozen=True, slots=True)
+class CompiledButton:
+    entry: str | tuple[str, ...] | HoldKeys | RepeatKey | Macro
+    down_keys: tuple[str, ...] = ()
+    # fnキーの回避策が必要なときは、矢印キーの直後にfnを含む
+    up_keys: tuple[str, ...] = ()
+    macro: tuple[MacroAction, ...] = ()
+
+
+type CompiledMapping = tuple[CompiledButton | None, ...]
+
+
+def validate_keys(keys: tuple[str, ...]) -> tuple[str, ...]:
+    if not keys:
+        raise ValueError("mapping has no keys")
+    for key in keys:
+        if key not in KEY_NAMES:
+            raise ValueError(f"unknown key: {key!r}")
+    return keys
+
+
+def release_keys(keys: tuple[str, ...], fn_workaround: bool) -> tuple[str, ...]:
+    if not fn_workaround:
+        return keys
+    return tuple(
+        released
+        for key in keys
+        for released in ((key, "fn") if key in FN_WORKAROUND_KEYS else (key,))
+    )
+
+
+def compile_button(
+    entry: str | tuple[str, ...] | HoldKeys | RepeatKey | Macro, fn_workaround: bool
+) -> CompiledButton:
+    match entry:
+        case str() as key:
+            keys = validate_keys((key,))
+            return CompiledButton(entry, keys, release_keys(keys, fn_workaround))
         case tuple() as keys:
-            return keys
-        case key:
-            return (key,)
-
-
-def key_down(button: ZuikiMasconButton | DpadButton) -> None:
-    for key in map_to_keys(button):
-        pyautogui.keyDown(key)
-
-
-def key_up(button: ZuikiMasconButton | DpadButton) -> None:
-    for key in map_to_keys(button):
-        pyautogui.keyUp(key)
-
-        # 矢印キーを押すとfnキーが押されたような状態になる問題への回避策
-        # https://github.com/asweigart/pyautogui/issues/796#issuecomment-1937049349
-        if key in ("up", "down", "left", "right"):
-            pyautogui.keyUp("fn")
-
-
-def get_notch(value: float, is_zl_button_pressed: bool) -> Notch:  # noqa: C901
-    if value > 0.9:
-        return Notch.P5
-    elif value > 0.7:
-        return Notch.P4
-    elif value > 0.55:
-        return Notch.P3
-    elif value > 0.35:
-        return Notch.P2
-    elif value > 0.15:
-        return Notch.P1
-    elif value > -0.1:
-        return Notch.N
-    elif value > -0.25:
-        return Notch.B1
-    elif value > -0.35:
-        return Notch.B2
-    elif value > -0.5:
-        return Notch.B3
-    elif value > -0.6:
-        return Notch.B4
-    elif value > -0.7:
-        return Notch.B5
-    elif value > -0.8:
-        return Notch.B6
-    elif value > -0.9:
-        return Notch.B7
-    elif is_zl_button_pressed:
+            validate_keys(keys)
+            return CompiledButton(entry, keys, release_keys(keys, fn_workaround))
+        case HoldKeys(keys=keys, duration=duration):
+            if duration < 0:
+                raise ValueError(f"negative hold duration: {duration}")
+            validate_keys(keys)
+            return CompiledButton(entry, keys, release_keys(keys, fn_workaround))
+        case RepeatKey(key=key, interval=interval):
+            if interval <= 0:
+                raise ValueError(f"repeat interval must be positive: {interval}")
+            keys = validate_keys((key,))
+            return CompiledButton(entry, keys)
+        case Macro():
+            actions: list[MacroAction] = []
+            for action in compile_macro(entry):
+                validate_keys((action.key,))
+                actions.append(action)
+                if (
+                    fn_workaround
+                    and action.kind == "up"
+                    and action.key in FN_WORKAROUND_KEYS
+                ):
+                    actions.append(MacroAction("up", "fn", action.offset))
+            return CompiledButton(entry, macro=tuple(actions))
+
+
+def mapped_keys(compiled: CompiledMapping) -> set[str]:
+    return {
+        key
+        for button in compiled
+        if button is not None
+        for key in (
+            *button.down_keys,
+            *button.up_keys,
+            *(action.key for action in button.macro),
+        )
+    }
+
+
+def compile_mapping(
+    mapping: KeyMapping, fn_workaround: bool = False
+) -> CompiledMapping:
+    # ボタン番号を添字にした配列にして、不正なマッピングは最初に押す前に弾く
+    if ZuikiMasconButton.ZL in mapping:
+        raise ValueError("ZL button cannot be mapped")
+    compiled: list[CompiledButton | None] = [None] * MAPPING_SLOT_COUNT
+    for button, entry in mapping.items():
+        compiled[button] = compile_button(entry, fn_workaround)
+    return tuple(compiled)
+
+
+# 軸の値が小さい順に並べたノッチ。EBはレバー位置ではなくZLボタンで決まるため含めない
+AXIS_NOTCHES: tuple[Notch, ...] = tuple(sorted(set(Notch) - {Notch.EB}))
+
+
+# ズイキマスコンでレバーが割り当てられている軸
+DEFAULT_LEVER_AXIS = 1
+
+
+@dataclass(frozen=True)
+class AxisCalibration:
+    # 昇順に並べたノッチ境界。値がi個の境界を超えていれば AXIS_NOTCHES[i] になる
+    thresholds: tuple[float, ...]
+    # キャリブレーションで最も大きく動いた軸
+    lever_axis: int = DEFAULT_LEVER_AXIS
+
+    def __post_init__(self) -> None:
+        if len(self.thresholds) != len(AXIS_NOTCHES) - 1:
+            raise ValueError(
+                f"expected {len(AXIS_NOTCHES) - 1} thresholds, "
+                f"got {len(self.thresholds)}"
+            )
+        if any(a >= b for a, b in zip(self.thresholds, self.thresholds[1:])):
+            raise ValueError("thresholds must be strictly increasing")
+
+
+# ズイキマスコン ZKNS-013 の実測値に合わせた境界
+DEFAULT_AXIS_CALIBRATION = AxisCalibration(
+    (-0.9, -0.8, -0.7, -0.6, -0.5, -0.35, -0.25, -0.1, 0.15, 0.35, 0.55, 0.7, 0.9)
+)
+
+
+def quantize_axis(value: float, calibration: AxisCalibration) -> Notch:
+    return AXIS_NOTCHES[bisect_left(calibration.thresholds, value)]
+
+
+def get_notch(
+    value: float,
+    is_zl_button_pressed: bool,
+    calibration: AxisCalibration = DEFAULT_AXIS_CALIBRATION,
+) -> Notch:
+    notch = quantize_axis(value, calibration)
+    if notch == Notch.B8 and is_zl_button_pressed:
         return Notch.EB
-    else:
-        return Notch.B8
+    return notch
+
+
+DEFAULT_NOTCH_HYSTERESIS = 0.02
+
+
+# 境界付近でレバーの値が揺れてもノッチが行き来しないよう、確定したノッチから離れるには
+# 境界を hysteresis 以上越える必要があり、min_dwell 秒以上同じノッチに留まる必要がある。
+# ZLボタンによるEBは扱わず、レバー位置としてのノッチだけを返す
+@dataclass
+class NotchFilter:
+    hysteresis: float = DEFAULT_NOTCH_HYSTERESIS
+    min_dwell: float = 0.0
+    notch: Notch | None = None
+    pending_notch: Notch | None = None
+    pending_since: float = 0.0
+    unfiltered_notch: Notch | None = None
+    suppressed_count: int = 0
+
+    @property
+    def pending_deadline(self) -> float | None:
+        if self.pending_notch is None:
+            return None
+        return self.pending_since + self.min_dwell
+
+    def hysteresis_candidate(
+        self, value: float, unfiltered: Notch, calibration: AxisCalibration
+    ) -> Notch:
+        if self.notch is None or unfiltered == self.notch or self.hysteresis <= 0:
+            return unfiltered
+
+        if unfiltered > self.notch:
+            candidate = quantize_axis(value - self.hysteresis, calibration)
+            return candidate if candidate > self.notch else self.notch
+
+        candidate = quantize_axis(value + self.hysteresis, calibration)
+        return candidate if candidate < self.notch else self.notch
+
+    def update(self, value: float, now: float, calibration: AxisCalibration) -> Notch:
+        unfiltered = quantize_axis(value, calibration)
+        candidate = self.hysteresis_candidate(value, unfiltered, calibration)
+        if (
+            unfiltered != self.unfiltered_notch
+            and unfiltered != self.notch
+            and candidate == self.notch
+        ):
+            self.suppressed_count += 1
+        self.unfiltered_notch = unfiltered
+
+        if self.notch is None or self.min_dwell <= 0:
+            self.notch = candidate
+            return candidate
+
+        committed_notch = self.notch
+        if candidate == committed_notch:
+            self.discard_pending()
+        elif candidate != self.pending_notch:
+            self.discard_pending()
+            self.pending_notch = candidate
+            self.pending_since = now
+        next_notch = self.poll(now)
+        return committed_notch if next_notch is None else next_notch
+
+    def discard_pending(self) -> None:
+        if self.pending_notch is not None:
+            self.suppressed_count += 1
+            self.pending_notch = None
+
+    def poll(self, now: float) -> Notch | None:
+        deadline = self.pending_deadline
+        if deadline is None or now < deadline:
+            return None
+
+        self.notch = self.pending_notch
+        self.pending_notch = None
+        return self.notch
 
 
 def project_notch(raw_notch: Notch, profile_limit: ProfileLimit) -> Notch:
@@ -174,33 +661,6 @@ def project_notch(raw_notch: Notch, profile_limit: ProfileLimit) -> Notch:
         return raw_notch
 
 
-def update_notch(current: Notch, next_notch: Notch, max_brake: Notch) -> None:
-    if current == next_notch:
-        return
-    elif Notch.N <= current < next_notch:
-        press("z", next_notch - current)
-    elif current <= Notch.N and next_notch == Notch.EB:
-        press("/")
-    elif next_notch < current <= Notch.N:
-        press(".", current - next_notch)
-    elif current >= Notch.P1:
-        if next_notch >= Notch.P1:
-            press("a", current - next_notch)
-        else:
-            press("s")
-            return update_notch(Notch.N, next_notch, max_brake)
-    elif current <= Notch.B1:
-        if next_notch <= Notch.B1:
-            if current == Notch.EB:
-                presses = next_notch - max_brake + 1
-            else:
-                presses = next_notch - current
-            press(",", presses)
-        else:
-            press("m")
-            return update_notch(Notch.N, next_notch, max_brake)
-
-
 def effective_notch_order(profile_limit: ProfileLimit) -> tuple[Notch, ...]:
     return tuple(
         notch
@@ -210,49 +670,468 @@ def effective_notch_order(profile_limit: ProfileLimit) -> tuple[Notch, ...]:
     )
 
 
+# ゲーム側でノッチを動かすキー。最短手順が複数あるときは、この順に先に見つかった手順を使う
+NOTCH_KEYS = ("z", "a", "s", ".", ",", "/", "m")
+
+type NotchTransitions = dict[tuple[Notch, Notch], tuple[str, ...]]
+
+
+def apply_notch_key(  # noqa: C901
+    current: Notch, key: str, profile_limit: ProfileLimit
+) -> Notch | None:
+    match key:
+        case "z" if Notch.N <= current < profile_limit.max_power:
+            return Notch(current + 1)
+        case "a" if Notch.P2 <= current <= profile_limit.max_power:
+            return Notch(current - 1)
+        case "s" if current >= Notch.P1:
+            return Notch.N
+        case "." if profile_limit.max_brake < current <= Notch.N:
+            return Notch(current - 1)
+        case "," if profile_limit.max_brake <= current <= Notch.B2:
+            return Notch(current + 1)
+        case "," if current == Notch.EB:
+            return profile_limit.max_brake
+        case "/" if Notch.EB < current <= Notch.N:
+            return Notch.EB
+        case "m" if current <= Notch.B1:
+            return Notch.N
+        case _:
+            return None
+
+
+def shortest_notch_keys(
+    start: Notch, profile_limit: ProfileLimit
+) -> dict[Notch, tuple[str, ...]]:
+    paths: dict[Notch, tuple[str, ...]] = {start: ()}
+    queue = deque([start])
+    while queue:
+        current = queue.popleft()
+        # EBを経由すると非常ブレーキが掛かるため、EBは始点か終点としてのみ使う
+        if current == Notch.EB and current != start:
+            continue
+        for key in NOTCH_KEYS:
+            next_notch = apply_notch_key(current, key, profile_limit)
+            if next_notch is not None and next_notch not in paths:
+                paths[next_notch] = (*paths[current], key)
+                queue.append(next_notch)
+    return paths
+
+
+@cache
+def build_notch_transitions(profile_limit: ProfileLimit) -> NotchTransitions:
+    transitions: NotchTransitions = {}
+    for start in effective_notch_order(profile_limit):
+        for goal, keys in shortest_notch_keys(start, profile_limit).items():
+            transitions[start, goal] = keys
+    return transitions
+
+
+def update_notch(
+    current: Notch, next_notch: Notch, profile_limit: ProfileLimit, sink: KeySink
+) -> None:
+    for key in build_notch_transitions(profile_limit)[current, next_notch]:
+        sink.press(key)
+
+
+# ゲーム側のノッチが分からなくても、どのノッチからこの順に押しても必ずたどり着く基準のノッチと、
+# そのためのキー。当てはまらないキーはゲーム側で無視される
+RESYNC_ANCHOR_KEYS: dict[Notch, tuple[str, ...]] = {
+    Notch.N: ("s", "m"),
+    Notch.EB: ("s", "/"),
+}
+
+
+@cache
+def build_resync_keys(profile_limit: ProfileLimit) -> dict[Notch, tuple[str, ...]]:
+    # 基準のノッチを経由して目的のノッチに合わせるキーのうち、最も少ないもの
+    transitions = build_notch_transitions(profile_limit)
+    return {
+        goal: min(
+            (
+                anchor_keys + transitions[anchor, goal]
+                for anchor, anchor_keys in RESYNC_ANCHOR_KEYS.items()
+            ),
+            key=len,
+        )
+        for goal in effective_notch_order(profile_limit)
+    }
+
+
+@dataclass(frozen=True, slots=True)
+class AxisMotion:
+    kind: ClassVar[EventKind] = "axis"
+    value: float
+    instance_id: int = 0
+    axis: int = DEFAULT_LEVER_AXIS
+    timestamp_ns: int = 0
+
+
+@dataclass(frozen=True, slots=True)
+class ButtonDown:
+    kind: ClassVar[EventKind] = "button"
+    button: ZuikiMasconButton
+    instance_id: int = 0
+    timestamp_ns: int = 0
+
+
+@dataclass(frozen=True, slots=True)
+class ButtonUp:
+    kind: ClassVar[EventKind] = "button"
+    button: ZuikiMasconButton
+    instance_id: int = 0
+    timestamp_ns: int = 0
+
+
+@dataclass(frozen=True, slots=True)
+class HatMotion:
+    kind: ClassVar[EventKind] = "hat"
+    x: int
+    y: int
+    instance_id: int = 0
+    timestamp_ns: int = 0
+
+
+type ControllerEvent = AxisMotion | ButtonDown | ButtonUp | HatMotion
+
+
+def coalesce_axis_motions(batch: Sequence[ControllerEvent]) -> list[ControllerEvent]:
+    # ZLボタンはノッチの解釈を変えるため、その前後をまたいで軸入力をまとめない
+    superseded_devices: set[int] = set()
+    coalesced: list[ControllerEvent] = []
+    for event in reversed(batch):
+        match event:
+            case AxisMotion(instance_id=instance_id):
+                if instance_id in superseded_devices:
+                    continue
+                superseded_devices.add(instance_id)
+            case (
+                ButtonDown(button=ZuikiMasconButton.ZL)
+                | ButtonUp(button=ZuikiMasconButton.ZL)
+            ):
+                superseded_devices.clear()
+            case _:
+                pass
+        coalesced.append(event)
+    coalesced.reverse()
+    return coalesced
+
+
+@dataclass(frozen=True)
+class ControllerState:
+    profile: TrainProfile
+    raw_notch: Notch
+    notch: Notch
+    pressed_buttons: frozenset[ZuikiMasconButton | DpadButton]
+    joystick_count: int
+    profile_limit: ProfileLimit
+    # TrainProfile の定義順に並べた車種の表示名
+    profile_labels: tuple[str, ...]
+    suppressed_transitions: int = 0
+    # 状態が変わるたびに増える番号。状態の比較には含めない
+    version: int = field(default=0, compare=False)
+
+
+STATE_SUBSCRIPTION_MAXSIZE = 64
+
+
+# 状態の変化を購読者ごとのキューに届ける。届ける側は待たず、
+# キューが満杯のときは最も古いスナップショットを捨てて dropped_count に数える
+class StateSubscription:
+    def __init__(self, maxsize: int = STATE_SUBSCRIPTION_MAXSIZE) -> None:
+        self.states: deque[ControllerState] = deque(maxlen=maxsize)
+        self.condition = threading.Condition()
+        self.dropped_count = 0
+
+    def deliver(self, state: ControllerState) -> None:
+        with self.condition:
+            if len(self.states) == self.states.maxlen:
+                self.dropped_count += 1
+            self.states.append(state)
+            self.condition.notify()
+
+    def get(self, timeout: float | None = None) -> ControllerState | None:
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.states, timeout):
+                return None
+            return self.states.popleft()
+
+    def drain(self) -> list[ControllerState]:
+        with self.condition:
+            states = list(self.states)
+            self.states.clear()
+            return states
+
+    def latest(self) -> ControllerState | None:
+        states = self.drain()
+        return states[-1] if states else None
+
+
+# ボタンイベントのうち、マスコンのボタンとして扱う番号
+MASCON_BUTTON_NUMBERS: frozenset[int] = frozenset(ZuikiMasconButton)
+
+
+# 押すとゲーム側のノッチを合わせ直すボタンの組み合わせ
+DEFAULT_RESYNC_CHORD: frozenset[ZuikiMasconButton] = frozenset(
+    {ZuikiMasconButton.ZL, ZuikiMasconButton.CAPTURE}
+)
+# 組み合わせの最初のボタンの操作を、残りのボタンが押されるまで待つ秒数。
+# 組み合わせで合わせ直すときに、ボタンごとのキーやEBを送らないようにする
+RESYNC_CHORD_WINDOW = 0.15
+# キー出力のキューにこれより多く溜まったら、出し切った後にノッチを合わせ直す
+RESYNC_BACKLOG_THRESHOLD = 64
+
+
+# 接続したデバイスの名前ごとの割り当て。Noneの項目はコントローラーと同じものを使う
+@dataclass(frozen=True)
+class DeviceBinding:
+    mapping: KeyMapping | None = None
+    profile: TrainProfile | None = None
+    key_sink: KeySink | None = None
+    # Noneならキャリブレーションで検出した軸を使う
+    lever_axis: int | None = None
+
+
+# 1台のデバイスのノッチと押しているボタンを追う状態機械
 @dataclass
-class MasconController:
+class MasconDevice:
     profile: TrainProfile = TrainProfile.DEFAULT
     raw_notch: Notch = Notch.N
     pressed_buttons: set[ZuikiMasconButton | DpadButton] = field(default_factory=set)
-    joysticks: dict[int, pygame.joystick.JoystickType] = field(default_factory=dict)
+    key_sink: KeySink = field(default_factory=NullKeySink)
+    mapping: KeyMapping = field(default_factory=lambda: MAPPING_TO_KEYBOARD)
+    profile_limits: dict[TrainProfile, ProfileLimit] = field(
+        default_factory=lambda: PROFILE_LIMITS
+    )
+    axis_calibration: AxisCalibration = DEFAULT_AXIS_CALIBRATION
+    notch_filter: NotchFilter = field(default_factory=NotchFilter)
+    clock: Callable[[], float] = time.monotonic
+    lever_axis: int = DEFAULT_LEVER_AXIS
+    # 矢印キーを押すとfnキーが押されたような状態になるpyautoguiの問題への回避策を使うか
+    fn_workaround: bool = False
+    scheduler: KeyScheduler = field(
+        default_factory=KeyScheduler, repr=False, compare=False
+    )
+    # ボタンごとに予約中の時間指定のキー操作。ボタンの状態が変わると取り消す
+    timers: dict[ZuikiMasconButton | DpadButton, ScheduledTimer] = field(
+        default_factory=dict, repr=False, compare=False
+    )
+    macro_runs: dict[ZuikiMasconButton | DpadButton, MacroRun] = field(
+        default_factory=dict, repr=False, compare=False
+    )
+    resync_chord: frozenset[ZuikiMasconButton] = DEFAULT_RESYNC_CHORD
+    # 組み合わせを押し切ったため、割り当てたキーを送らなかったボタン
+    chord_buttons: set[ZuikiMasconButton | DpadButton] = field(
+        default_factory=set, repr=False, compare=False
+    )
+    # 組み合わせの続きを待つため、押した操作を保留しているボタン
+    deferred_chord_button: ZuikiMasconButton | None = field(
+        default=None, repr=False, compare=False
+    )
+    chord_timer: ScheduledTimer | None = field(default=None, repr=False, compare=False)
+    resync_count: int = 0
+    notch_transitions: NotchTransitions = field(init=False, repr=False, compare=False)
+    compiled_mapping: CompiledMapping = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.notch_transitions = build_notch_transitions(self.profile_limit)
+        self.compiled_mapping = compile_mapping(self.mapping, self.fn_workaround)
 
     @property
     def profile_limit(self) -> ProfileLimit:
-        return PROFILE_LIMITS[self.profile]
+        return self.profile_limits[self.profile]
 
     @property
     def notch(self) -> Notch:
         return project_notch(self.raw_notch, self.profile_limit)
 
-    def handle_axis_motion(self, value: float) -> None:
+    def send_notch_keys(self, current: Notch, next_notch: Notch) -> None:
+        for key in self.notch_transitions[current, next_notch]:
+            self.key_sink.press(key)
+
+    def resync_notch(self) -> None:
+        # キーの取りこぼしや車種の切り替えでずれたゲーム側のノッチを、基準のノッチを経由して
+        # 今のノッチに合わせ直す
+        for key in build_resync_keys(self.profile_limit)[self.notch]:
+            self.key_sink.press(key)
+        self.resync_count += 1
+
+    def apply_lever_notch(self, lever_notch: Notch) -> None:
         current_notch = self.notch
-        next_raw_notch = get_notch(value, ZuikiMasconButton.ZL in self.pressed_buttons)
+        if lever_notch == Notch.B8 and ZuikiMasconButton.ZL in self.pressed_buttons:
+            next_raw_notch = Notch.EB
+        else:
+            next_raw_notch = lever_notch
         next_notch = project_notch(next_raw_notch, self.profile_limit)
 
-        update_notch(current_notch, next_notch, self.profile_limit.max_brake)
+        self.send_notch_keys(current_notch, next_notch)
 
         self.raw_notch = next_raw_notch
 
-    def handle_button_down(self, button: ZuikiMasconButton) -> None:
-        self.pressed_buttons.add(button)
+    def handle_axis_motion(self, value: float) -> None:
+        lever_notch = self.notch_filter.update(
+            value, self.clock(), self.axis_calibration
+        )
+        self.apply_lever_notch(lever_notch)
+
+    def poll_pending_notch(self) -> bool:
+        lever_notch = self.notch_filter.poll(self.clock())
+        if lever_notch is None:
+            return False
+        self.apply_lever_notch(lever_notch)
+        return True
+
+    def cancel_timer(self, button: ZuikiMasconButton | DpadButton) -> None:
+        timer = self.timers.pop(button, None)
+        if timer is not None:
+            timer.cancel()
+
+    def send_key_down(self, compiled: CompiledButton) -> None:
+        for key in compiled.down_keys:
+            self.key_sink.key_down(key)
+
+    def send_key_up(self, compiled: CompiledButton) -> None:
+        for key in compiled.up_keys:
+            self.key_sink.key_up(key)
+
+    def end_hold(
+        self, button: ZuikiMasconButton | DpadButton, compiled: CompiledButton
+    ) -> None:
+        del self.timers[button]
+        self.send_key_up(compiled)
+
+    def repeat_key(
+        self, button: ZuikiMasconButton | DpadButton, key: str, interval: float
+    ) -> None:
+        self.key_sink.press(key)
+        # 処理が遅れても押し直しをまとめて出さないよう、次の期限は今から数える
+        self.timers[button] = self.scheduler.schedule(
+            self.clock() + interval, lambda: self.repeat_key(button, key, interval)
+        )
+
+    def press_mapped(self, button: ZuikiMasconButton | DpadButton) -> None:
+        compiled = self.compiled_mapping[button]
+        if compiled is None:
+            return
+
+        is_holding = button in self.timers
+        self.cancel_timer(button)
+        match compiled.entry:
+            case HoldKeys(duration=duration):
+                # 押したままの間に押し直したときは、離す時刻だけを延ばす
+                if not is_holding:
+                    self.send_key_down(compiled)
+                self.timers[button] = self.scheduler.schedule(
+                    self.clock() + duration, lambda: self.end_hold(button, compiled)
+                )
+            case RepeatKey(key=key, interval=interval):
+                self.repeat_key(button, key, interval)
+            case Macro():
+                self.toggle_macro(button, compiled.macro)
+            case _:
+                self.send_key_down(compiled)
+
+    def toggle_macro(
+        self, button: ZuikiMasconButton | DpadButton, actions: tuple[MacroAction, ...]
+    ) -> None:
+        # 実行中のマクロのボタンをもう一度押すと取り消す
+        run = self.macro_runs.pop(button, None)
+        if run is not None:
+            run.cancel()
+            return
+
+        run = MacroRun(
+            actions,
+            self.key_sink,
+            self.scheduler,
+            self.clock,
+            self.clock(),
+            lambda: self.finish_macro(button),
+        )
+        self.macro_runs[button] = run
+        run.advance()
+
+    def finish_macro(self, button: ZuikiMasconButton | DpadButton) -> None:
+        del self.macro_runs[button]
+
+    def release_mapped(self, button: ZuikiMasconButton | DpadButton) -> None:
+        compiled = self.compiled_mapping[button]
+        if compiled is None:
+            return
+
+        match compiled.entry:
+            case HoldKeys() | Macro():
+                # 予約した時刻に離す
+                pass
+            case RepeatKey():
+                self.cancel_timer(button)
+            case _:
+                self.send_key_up(compiled)
+
+    def press_button(self, button: ZuikiMasconButton) -> None:
         if button == ZuikiMasconButton.ZL:
             if self.raw_notch == Notch.B8:
-                update_notch(self.notch, Notch.EB, self.profile_limit.max_brake)
+                self.send_notch_keys(self.notch, Notch.EB)
                 self.raw_notch = Notch.EB
         else:
-            key_down(button)
+            self.press_mapped(button)
+
+    def discard_deferred_chord_button(self) -> ZuikiMasconButton | None:
+        button = self.deferred_chord_button
+        if self.chord_timer is not None:
+            self.chord_timer.cancel()
+        self.deferred_chord_button = None
+        self.chord_timer = None
+        return button
+
+    def press_deferred_chord_button(self) -> None:
+        # 組み合わせにならなかったので、保留していた操作を送る
+        button = self.discard_deferred_chord_button()
+        if button is not None:
+            self.press_button(button)
+
+    def handle_button_down(self, button: ZuikiMasconButton) -> None:
+        self.pressed_buttons.add(button)
+        if button in self.resync_chord:
+            if self.resync_chord <= self.pressed_buttons:
+                deferred = self.discard_deferred_chord_button()
+                self.resync_notch()
+                self.chord_buttons.add(button)
+                if deferred is not None:
+                    self.chord_buttons.add(deferred)
+                return
+            if len(self.resync_chord) > 1 and self.deferred_chord_button is None:
+                self.deferred_chord_button = button
+                self.chord_timer = self.scheduler.schedule(
+                    self.clock() + RESYNC_CHORD_WINDOW, self.press_deferred_chord_button
+                )
+                return
+        elif self.deferred_chord_button is not None:
+            # 組み合わせにないボタンを押したら、組み合わせにはならない
+            self.press_deferred_chord_button()
+        self.press_button(button)
 
     def handle_button_up(self, button: ZuikiMasconButton) -> None:
+        if button not in self.pressed_buttons:
+            # 割り当ての入れ替えで、押している途中にキーを離したボタン
+            return
+        if button == self.deferred_chord_button:
+            # 組み合わせになる前に離したボタンは、押してすぐ離したものとして送る
+            self.press_deferred_chord_button()
         self.pressed_buttons.remove(button)
+        if button in self.chord_buttons:
+            self.chord_buttons.remove(button)
+            # 押している間にレバーをB8に入れるとEBになるため、ZLは離す処理を続ける
+            if button != ZuikiMasconButton.ZL:
+                return
         if button == ZuikiMasconButton.ZL:
             if self.notch == Notch.EB:
                 current_notch = self.notch
                 self.raw_notch = Notch.B8
                 next_notch = project_notch(self.raw_notch, self.profile_limit)
-                update_notch(current_notch, next_notch, self.profile_limit.max_brake)
+                self.send_notch_keys(current_notch, next_notch)
         else:
-            key_up(button)
+            self.release_mapped(button)
 
     def handle_hat_motion(self, x: int, y: int) -> None:
         for is_pressed, direction in (
@@ -262,18 +1141,236 @@ class MasconController:
             (x == 1, DpadButton.RIGHT),
         ):
             if is_pressed and direction not in self.pressed_buttons:
-                key_down(direction)
+                self.press_mapped(direction)
                 self.pressed_buttons.add(direction)
             if not is_pressed and direction in self.pressed_buttons:
-                key_up(direction)
+                self.release_mapped(direction)
                 self.pressed_buttons.remove(direction)
 
+    def handle_event(self, event: ControllerEvent) -> None:
+        match event:
+            case AxisMotion(value=value):
+                self.handle_axis_motion(value)
+            case ButtonDown(button=button):
+                self.handle_button_down(button)
+            case ButtonUp(button=button):
+                self.handle_button_up(button)
+            case HatMotion(x=x, y=y):
+                self.handle_hat_motion(x, y)
+
     def change_profile(self, profile: TrainProfile) -> None:
         self.profile = profile
+        self.notch_transitions = build_notch_transitions(self.profile_limit)
+        # 車種によって上限が変わると、キーを送らずにノッチが変わることがある
+        self.resync_notch()
+
+    def release_mapped_keys(self) -> None:
+        # 押し続ける時間が残っているキーも離し、予約はすべて取り消す。
+        # ZLボタンはキーを割り当てられず、ノッチの状態に関わるため押したままにしておく
+        released = set(self.timers)
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers.clear()
+        deferred = self.discard_deferred_chord_button()
+        for button in self.pressed_buttons - self.chord_buttons:
+            # 保留しているボタンはキーを送っておらず、押し続ける時間が過ぎたキーはすでに離している
+            if button == deferred:
+                continue
+            compiled = self.compiled_mapping[button]
+            if compiled is not None and not isinstance(compiled.entry, HoldKeys):
+                released.add(button)
+        for run in self.macro_runs.values():
+            run.cancel()
+        self.macro_runs.clear()
+        for button in released:
+            compiled = self.compiled_mapping[button]
+            if compiled is not None:
+                self.send_key_up(compiled)
+        self.chord_buttons.clear()
+        self.pressed_buttons &= {ZuikiMasconButton.ZL}
+
+    def release_all_inputs(self) -> None:
+        self.release_mapped_keys()
+        self.pressed_buttons.clear()
+        self.key_sink.flush()
+
+    def stop_key_repeats(self) -> None:
+        # 押したままのボタンの繰り返し入力だけを止め、ボタンは押したままにしておく
+        for button in self.pressed_buttons:
+            compiled = self.compiled_mapping[button]
+            if compiled is not None and isinstance(compiled.entry, RepeatKey):
+                self.cancel_timer(button)
+
+    def replace_mapping(
+        self,
+        mapping: KeyMapping,
+        compiled_mapping: CompiledMapping,
+        profile_limits: dict[TrainProfile, ProfileLimit],
+    ) -> None:
+        # 古い割り当てで押したキーは、入れ替える前に古い割り当てのまま離す
+        self.release_mapped_keys()
+        self.key_sink.flush()
+        previous_limit = self.profile_limit
+        self.mapping = mapping
+        self.compiled_mapping = compiled_mapping
+        self.profile_limits = profile_limits
+        self.notch_transitions = build_notch_transitions(self.profile_limit)
+        if self.profile_limit != previous_limit:
+            self.resync_notch()
+
+
+# 画面とコマンドラインの設定に結び付いた主デバイスの状態機械を持ち、
+# 接続中のデバイスごとの状態機械へinstance_idでイベントを振り分ける
+@dataclass
+class MasconController:
+    primary: MasconDevice = field(default_factory=MasconDevice)
+    joysticks: dict[int, pygame.joystick.JoystickType] = field(default_factory=dict)
+    axis_calibrations: dict[str, AxisCalibration] = field(default_factory=dict)
+    device_bindings: dict[str, DeviceBinding] = field(default_factory=dict)
+    profile_labels: dict[TrainProfile, str] = field(
+        default_factory=lambda: PROFILE_LABELS
+    )
+    latency_stats: LatencyStats | None = None
+    # キー出力先で送れるかを確かめ、送れないキーがあればValueErrorを投げる
+    resolve_keys: Callable[[Iterable[str]], None] | None = field(
+        default=None, repr=False, compare=False
+    )
+    # 入力スレッドとTkスレッドの両方から状態を触るため、操作と読み取りはこのロックを取って行う
+    lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+    devices: dict[int, MasconDevice] = field(
+        default_factory=dict, repr=False, compare=False
+    )
+    ignored_event_count: int = 0
+    # 振り分けたイベントの種類ごとの数
+    event_counts: dict[EventKind, int] = field(
+        default_factory=lambda: dict.fromkeys(EVENT_KINDS, 0)
+    )
+    removed_device_count: int = 0
+    resync_backlog: int = RESYNC_BACKLOG_THRESHOLD
+    is_resync_pending: bool = False
+    seen_dropped_count: int = 0
+    last_state: ControllerState = field(init=False, repr=False, compare=False)
+    subscriptions: list[StateSubscription] = field(
+        default_factory=list, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        if self.primary.scheduler.latency_stats is None:
+            self.primary.scheduler.latency_stats = self.latency_stats
+        self.last_state = self.build_state(0)
+
+    @property
+    def all_devices(self) -> list[MasconDevice]:
+        # 主デバイスは未接続でも画面の操作を受けるため、常に先頭に含める
+        return [
+            self.primary,
+            *(device for device in self.devices.values() if device is not self.primary),
+        ]
+
+    @property
+    def pending_deadline(self) -> float | None:
+        deadlines = [
+            deadline
+            for deadline in (
+                self.primary.scheduler.next_deadline,
+                *(device.notch_filter.pending_deadline for device in self.all_devices),
+            )
+            if deadline is not None
+        ]
+        return min(deadlines, default=None)
+
+    def poll_timers(self) -> None:
+        self.primary.scheduler.run_due(self.primary.clock())
+        self.poll_pending_notch()
+
+    def poll_pending_notch(self) -> bool:
+        is_committed = False
+        for device in self.all_devices:
+            is_committed |= device.poll_pending_notch()
+        if is_committed:
+            self.publish_state()
+        return is_committed
+
+    def handle_event(self, event: ControllerEvent) -> None:
+        device = self.devices.get(event.instance_id)
+        if device is None or (
+            isinstance(event, AxisMotion) and event.axis != device.lever_axis
+        ):
+            self.ignored_event_count += 1
+            return
+
+        self.event_counts[event.kind] += 1
+        if self.latency_stats is not None and event.timestamp_ns:
+            self.latency_stats.begin_event(event.kind, event.timestamp_ns)
+        try:
+            device.handle_event(event)
+        finally:
+            if self.latency_stats is not None:
+                self.latency_stats.end_event()
+
+    def handle_events(self, batch: Sequence[ControllerEvent]) -> None:
+        for event in coalesce_axis_motions(batch):
+            self.handle_event(event)
+            self.publish_state()
+
+    def change_profile(self, profile: TrainProfile) -> None:
+        self.primary.change_profile(profile)
+        self.publish_state()
+
+    def attach_device(self, instance_id: int, name: str = "") -> MasconDevice:
+        primary = self.primary
+        calibration = self.axis_calibrations.get(name, DEFAULT_AXIS_CALIBRATION)
+        binding = self.device_bindings.get(name) or DeviceBinding()
+        lever_axis = (
+            calibration.lever_axis if binding.lever_axis is None else binding.lever_axis
+        )
+        if (
+            binding.mapping is None
+            and binding.profile is None
+            and binding.key_sink is None
+            and primary not in self.devices.values()
+        ):
+            # 割り当てやキー出力先を変えないデバイスは、主デバイスが空いていればそこに結び付ける
+            primary.axis_calibration = calibration
+            primary.lever_axis = lever_axis
+            device = primary
+        else:
+            device = MasconDevice(
+                profile=primary.profile if binding.profile is None else binding.profile,
+                profile_limits=primary.profile_limits,
+                key_sink=primary.key_sink
+                if binding.key_sink is None
+                else binding.key_sink,
+                mapping=primary.mapping if binding.mapping is None else binding.mapping,
+                axis_calibration=calibration,
+                notch_filter=NotchFilter(
+                    primary.notch_filter.hysteresis, primary.notch_filter.min_dwell
+                ),
+                clock=primary.clock,
+                lever_axis=lever_axis,
+                fn_workaround=primary.fn_workaround,
+                scheduler=primary.scheduler,
+            )
+        self.devices[instance_id] = device
+        return device
+
+    def detach_device(self, instance_id: int) -> None:
+        device = self.devices.pop(instance_id, None)
+        if device is not None:
+            # 切断されたデバイスのボタンが押しっぱなしにならないよう離す
+            device.release_all_inputs()
 
     def register_joystick(self, device_index: int) -> None:
         joystick = pygame.joystick.Joystick(device_index)
-        self.joysticks[joystick.get_instance_id()] = joystick
+        instance_id = joystick.get_instance_id()
+        self.joysticks[instance_id] = joystick
+        device = self.attach_device(instance_id, joystick.get_name())
+        if self.removed_device_count:
+            # 切断されている間のゲーム側の操作に備え、つなぎ直したらノッチを合わせ直す
+            device.resync_notch()
+        self.publish_state()
 
     def initialize_joysticks(self) -> None:
         for device_index in range(pygame.joystick.get_count()):
@@ -281,16 +1378,109 @@ class MasconController:
 
     def unregister_joystick(self, instance_id: int) -> None:
         self.joysticks.pop(instance_id, None)
+        self.detach_device(instance_id)
+        self.removed_device_count += 1
+        self.publish_state()
 
     def release_all_inputs(self) -> None:
-        for button in list(self.pressed_buttons):
-            if button != ZuikiMasconButton.ZL:
-                key_up(button)
-            self.pressed_buttons.discard(button)
-
-    def print_state(self) -> None:
-        print(
-            self.notch.name,
-            self.raw_notch.name,
-            {button.name for button in self.pressed_buttons},
+        for device in self.all_devices:
+            device.release_all_inputs()
+        self.publish_state()
+
+    def stop_key_repeats(self) -> None:
+        for device in self.all_devices:
+            device.stop_key_repeats()
+
+    def resync_all_notches(self) -> None:
+        for device in self.all_devices:
+            device.resync_notch()
+
+    def check_key_backlog(self, depth: int, dropped_count: int) -> None:
+        # キー出力が追いつかずに溜まったり捨てたりしたキーがあると、ゲーム側のノッチがずれている
+        # 恐れがある。溜まったキーを出し切ってから合わせ直す
+        if depth > self.resync_backlog or dropped_count != self.seen_dropped_count:
+            self.seen_dropped_count = dropped_count
+            self.is_resync_pending = True
+        elif self.is_resync_pending and depth == 0:
+            self.is_resync_pending = False
+            self.resync_all_notches()
+
+    def request_resync(self) -> None:
+        # キー出力先がキーの取りこぼしを知らせてきたときも、溜まったキーを出し切ってから合わせ直す
+        self.is_resync_pending = True
+
+    def apply_mapping(
+        self,
+        mapping: KeyMapping,
+        profile_limits: dict[TrainProfile, ProfileLimit],
+        profile_labels: dict[TrainProfile, str],
+        device_bindings: dict[str, DeviceBinding] | None = None,
+    ) -> None:
+        # 先にすべて変換しておき、不正な割り当てなら何も変えずに例外を投げる
+        fn_workaround = self.primary.fn_workaround
+        compiled_mapping = compile_mapping(mapping, fn_workaround)
+        keys = mapped_keys(compiled_mapping)
+        for binding in (device_bindings or {}).values():
+            if binding.mapping is not None:
+                keys |= mapped_keys(compile_mapping(binding.mapping, fn_workaround))
+        if self.resolve_keys is not None:
+            self.resolve_keys(keys)
+        if set(profile_limits) != set(TrainProfile):
+            raise ValueError("profile limits must cover every train profile")
+        if set(profile_labels) != set(TrainProfile):
+            raise ValueError("profile labels must cover every train profile")
+
+        shared_mapping = self.primary.mapping
+        for device in self.all_devices:
+            # デバイスごとに割り当てたマッピングはそのまま使い続ける
+            if device.mapping is shared_mapping:
+                device.replace_mapping(mapping, compiled_mapping, profile_limits)
+            else:
+                device.replace_mapping(
+                    device.mapping, device.compiled_mapping, profile_limits
+                )
+        self.profile_labels = profile_labels
+        if device_bindings is not None:
+            # 接続中のデバイスは今の割り当てのまま、次に接続したデバイスから使う
+            self.device_bindings = device_bindings
+        self.publish_state()
+
+    def build_state(self, version: int) -> ControllerState:
+        primary = self.primary
+        return ControllerState(
+            profile=primary.profile,
+            raw_notch=primary.raw_notch,
+            notch=primary.notch,
+            pressed_buttons=frozenset(primary.pressed_buttons),
+            joystick_count=len(self.joysticks),
+            profile_limit=primary.profile_limit,
+            profile_labels=tuple(
+                self.profile_labels[profile] for profile in TrainProfile
+            ),
+            suppressed_transitions=primary.notch_filter.suppressed_count,
+            version=version,
         )
+
+    def snapshot(self) -> ControllerState:
+        # 前回から変わっていなければ同じスナップショットを返し、versionも進めない
+        state = self.build_state(self.last_state.version + 1)
+        if state != self.last_state:
+            self.last_state = state
+            for subscription in self.subscriptions:
+                subscription.deliver(state)
+        return self.last_state
+
+    def publish_state(self) -> None:
+        # 購読者がいなければスナップショットを作らない
+        if self.subscriptions:
+            self.snapshot()
+
+    def subscribe(self, maxsize: int = STATE_SUBSCRIPTION_MAXSIZE) -> StateSubscription:
+        subscription = StateSubscription(maxsize)
+        subscription.deliver(self.snapshot())
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: StateSubscription) -> None:
+        if subscription in self.subscriptions:
+            self.subscriptions.remove(subscription)
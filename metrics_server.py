@@ -0,0 +1,309 @@
+import socketserver
+import threading
+from collections.abc import Iterable
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+
+from key_emitter import KeyEmitter
+from latency_stats import LATENCY_BUCKET_BOUNDS_NS, LatencyHistogram, LatencyStats
+from mascon_controller import (
+    ControllerState,
+    MasconController,
+    MasconDevice,
+    TrainProfile,
+)
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PATH = "/metrics"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+METRIC_PREFIX = "zuiki_mascon"
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            f'{name}="{escape_label_value(value)}"' for name, value in labels.items()
+        )
+        + "}"
+    )
+
+
+def format_value(value: float) -> str:
+    # 大きなカウンターも丸めずに書く
+    return str(value) if isinstance(value, int) else repr(value)
+
+
+class MetricsWriter:
+    def __init__(self) -> None:
+        self.lines: list[str] = []
+
+    def metric(
+        self,
+        name: str,
+        metric_type: str,
+        help_text: str,
+        samples: Iterable[tuple[dict[str, str], float]],
+    ) -> None:
+        self.lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        self.lines.append(f"# TYPE {METRIC_PREFIX}_{name} {metric_type}")
+        for labels, value in samples:
+            self.sample(name, labels, value)
+
+    def sample(self, name: str, labels: dict[str, str], value: float) -> None:
+        self.lines.append(
+            f"{METRIC_PREFIX}_{name}{format_labels(labels)} {format_value(value)}"
+        )
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        histograms: Iterable[tuple[dict[str, str], LatencyHistogram]],
+    ) -> None:
+        self.metric(name, "histogram", help_text, ())
+        for labels, histogram in histograms:
+            # 記録中の配列を一度に写し取り、数え途中の値を読まないようにする
+            counts = histogram.counts.tolist()
+            cumulative = 0
+            for bound_ns, count in zip(LATENCY_BUCKET_BOUNDS_NS, counts):
+                cumulative += count
+                self.sample(
+                    f"{name}_bucket",
+                    {**labels, "le": f"{bound_ns / 1e9:g}"},
+                    cumulative,
+                )
+            total = cumulative + counts[-1]
+            self.sample(f"{name}_bucket", {**labels, "le": "+Inf"}, total)
+            self.sample(f"{name}_sum", labels, histogram.total_ns / 1e9)
+            self.sample(f"{name}_count", labels, total)
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+# 入力スレッドのロックを取らずに読めるものだけから、Prometheusのテキスト形式を作る。
+# 状態は購読したスナップショット、カウンターは他のスレッドが増やす整数をそのまま読む
+class MetricsExporter:
+    def __init__(
+        self,
+        controller: MasconController,
+        emitter: KeyEmitter | None = None,
+        latency_stats: LatencyStats | None = None,
+    ) -> None:
+        self.controller = controller
+        self.emitter = emitter
+        self.latency_stats = latency_stats
+        with controller.lock:
+            self.subscription = controller.subscribe(maxsize=1)
+        self.state: ControllerState = controller.last_state
+
+    def devices(self) -> list[MasconDevice]:
+        # 入力スレッドが接続・切断で書き換えても、写し取った一覧だけを見る
+        return self.controller.all_devices
+
+    def close(self) -> None:
+        with self.controller.lock:
+            self.controller.unsubscribe(self.subscription)
+
+    def render(self) -> str:
+        state = self.subscription.latest()
+        if state is not None:
+            self.state = state
+        state = self.state
+        controller = self.controller
+        writer = MetricsWriter()
+
+        writer.metric(
+            "events_total",
+            "counter",
+            "Controller events handled, by event type.",
+            (
+                ({"type": kind}, count)
+                for kind, count in dict(controller.event_counts).items()
+            ),
+        )
+        writer.metric(
+            "ignored_events_total",
+            "counter",
+            "Events dropped because of an unknown device or a non-lever axis.",
+            [({}, controller.ignored_event_count)],
+        )
+        writer.metric(
+            "suppressed_transitions_total",
+            "counter",
+            "Notch changes suppressed by hysteresis or dwell time.",
+            [({}, state.suppressed_transitions)],
+        )
+        writer.metric(
+            "notch_resyncs_total",
+            "counter",
+            "Resynchronisations of the game's notch.",
+            [({}, sum(device.resync_count for device in self.devices()))],
+        )
+        writer.metric(
+            "notch",
+            "gauge",
+            "Current notch after profile limits (P5=5, N=0, EB=-9).",
+            [({}, int(state.notch))],
+        )
+        writer.metric(
+            "raw_notch",
+            "gauge",
+            "Current lever notch before profile limits.",
+            [({}, int(state.raw_notch))],
+        )
+        writer.metric(
+            "profile_info",
+            "gauge",
+            "Selected train profile.",
+            (
+                (
+                    {"profile": profile.name.lower(), "label": label},
+                    1 if profile == state.profile else 0,
+                )
+                for profile, label in zip(TrainProfile, state.profile_labels)
+            ),
+        )
+        writer.metric(
+            "joysticks",
+            "gauge",
+            "Connected joysticks.",
+            [({}, state.joystick_count)],
+        )
+
+        if self.emitter is not None:
+            writer.metric(
+                "keys_emitted_total",
+                "counter",
+                "Key actions sent to the key sink, by action and key.",
+                (
+                    ({"action": action, "key": key}, count)
+                    for (action, key), count in sorted(
+                        dict(self.emitter.key_counts).items()
+                    )
+                ),
+            )
+            writer.metric(
+                "key_queue_depth",
+                "gauge",
+                "Key actions waiting in the emitter queue.",
+                [({}, self.emitter.depth)],
+            )
+            writer.metric(
+                "key_sink_errors_total",
+                "counter",
+                "Key actions whose key sink raised an error.",
+                [({}, self.emitter.error_count)],
+            )
+            writer.metric(
+                "key_queue_dropped_total",
+                "counter",
+                "Key actions dropped because the emitter queue was full.",
+                [({}, self.emitter.dropped_count)],
+            )
+
+        if self.latency_stats is not None:
+            writer.histogram(
+                "input_latency_seconds",
+                "Time from a controller event to its first key action.",
+                (
+                    ({"type": kind}, histogram)
+                    for kind, histogram in self.latency_stats.histograms.items()
+                ),
+            )
+            writer.histogram(
+                "timer_lag_seconds",
+                "Delay of scheduled key actions past their deadline.",
+                [({}, self.latency_stats.timer_lag)],
+            )
+            writer.histogram(
+                "macro_step_lag_seconds",
+                "Delay of macro key actions past their planned time.",
+                [({}, self.latency_stats.macro_step_lag)],
+            )
+        return writer.text()
+
+
+def create_request_handler(
+    exporter: MetricsExporter,
+) -> type[BaseHTTPRequestHandler]:
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path != METRICS_PATH:
+                self.send_error(404)
+                return
+            body = exporter.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", METRICS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: object) -> None:
+            # 取得のたびに標準エラー出力へ書かない
+            pass
+
+        def address_string(self) -> str:
+            # Unixソケットでは接続元のアドレスがない
+            return str(self.client_address or "unix")
+
+    return MetricsRequestHandler
+
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    def __init__(self, path: Path, handler_class: type[BaseHTTPRequestHandler]) -> None:
+        # 前回の起動で残ったソケットファイルを消してから待ち受ける
+        if path.is_socket():
+            path.unlink()
+        super().__init__(str(path), handler_class)
+        self.socket_path = path
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.socket_path.unlink(missing_ok=True)
+
+
+# localhostのポートかUnixソケットで /metrics を返すサーバーを、専用のスレッドで動かす
+class MetricsServer:
+    def __init__(
+        self,
+        exporter: MetricsExporter,
+        port: int | None = None,
+        socket_path: Path | None = None,
+    ) -> None:
+        handler_class = create_request_handler(exporter)
+        self.exporter = exporter
+        if socket_path is not None:
+            self.server: socketserver.BaseServer = UnixHTTPServer(
+                socket_path, handler_class
+            )
+        elif port is not None:
+            self.server = HTTPServer((METRICS_HOST, port), handler_class)
+        else:
+            raise ValueError("either port or socket_path is required")
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="metrics", daemon=True
+        )
+
+    @property
+    def port(self) -> int | None:
+        if isinstance(self.server, HTTPServer):
+            return self.server.server_port
+        return None
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        if self.thread.is_alive():
+            self.server.shutdown()
+            self.thread.join()
+        self.server.server_close()
+        self.exporter.close()
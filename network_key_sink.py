@@ -0,0 +1,183 @@
+import secrets
+import socket
+import struct
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Literal, cast
+
+from latency_stats import LatencyHistogram
+
+DATAGRAM_MAGIC = b"ZK"
+DATAGRAM_VERSION = 1
+
+# 22バイトのヘッダーの後ろにキー名(UTF-8)が続く:
+# マジック, 版, 種類, 回数, 送り手のセッション, 通し番号, 送った時刻(ns)
+DATAGRAM_HEADER = struct.Struct("!2sBBHIIQ")
+MAX_KEY_BYTES = 32
+MAX_DATAGRAM_SIZE = DATAGRAM_HEADER.size + MAX_KEY_BYTES
+SEQUENCE_MODULUS = 2**32
+
+# down/up/press/echoは送り手から受け手へ、resyncは受け手から送り手へ送る。
+# echoは受け手がそのまま送り返し、往復の時間を測るのに使う
+type DatagramKind = Literal["down", "up", "press", "echo", "resync"]
+
+DATAGRAM_KINDS: tuple[DatagramKind, ...] = ("down", "up", "press", "echo", "resync")
+DATAGRAM_KIND_CODES = {kind: code for code, kind in enumerate(DATAGRAM_KINDS)}
+
+# 受け手からの返信を待つスレッドが、止める指示を確かめる間隔
+REPLY_POLL_INTERVAL = 0.1
+
+
+@dataclass(frozen=True, slots=True)
+class KeyDatagram:
+    kind: DatagramKind
+    key: str
+    presses: int
+    session: int
+    sequence: int
+    timestamp_ns: int
+
+
+def encode_datagram(datagram: KeyDatagram) -> bytes:
+    key = datagram.key.encode()
+    if len(key) > MAX_KEY_BYTES:
+        raise ValueError(f"key name is too long: {datagram.key!r}")
+    return (
+        DATAGRAM_HEADER.pack(
+            DATAGRAM_MAGIC,
+            DATAGRAM_VERSION,
+            DATAGRAM_KIND_CODES[datagram.kind],
+            datagram.presses,
+            datagram.session,
+            datagram.sequence,
+            datagram.timestamp_ns,
+        )
+        + key
+    )
+
+
+def decode_datagram(data: bytes) -> KeyDatagram:
+    if len(data) < DATAGRAM_HEADER.size or len(data) > MAX_DATAGRAM_SIZE:
+        raise ValueError(f"invalid datagram size: {len(data)}")
+    magic, version, code, presses, session, sequence, timestamp_ns = cast(
+        tuple[bytes, int, int, int, int, int, int], DATAGRAM_HEADER.unpack_from(data)
+    )
+    if magic != DATAGRAM_MAGIC or version != DATAGRAM_VERSION:
+        raise ValueError("not a key datagram")
+    if code >= len(DATAGRAM_KINDS):
+        raise ValueError(f"unknown datagram kind: {code}")
+    try:
+        key = data[DATAGRAM_HEADER.size :].decode()
+    except UnicodeDecodeError as error:
+        raise ValueError("key name is not UTF-8") from error
+    return KeyDatagram(
+        DATAGRAM_KINDS[code], key, presses, session, sequence, timestamp_ns
+    )
+
+
+def sequence_gap(expected: int, sequence: int) -> int:
+    # 通し番号は一周するため、差が半周未満なら先、それ以外は過去の番号とみなす
+    gap = (sequence - expected) % SEQUENCE_MODULUS
+    return gap if gap < SEQUENCE_MODULUS // 2 else gap - SEQUENCE_MODULUS
+
+
+def connect_udp(address: tuple[str, int]) -> socket.socket:
+    family, socket_type, proto, _, socket_address = socket.getaddrinfo(
+        *address, type=socket.SOCK_DGRAM
+    )[0]
+    sock = socket.socket(family, socket_type, proto)
+    try:
+        sock.connect(socket_address)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+# キー操作を通し番号と時刻つきのUDPデータグラムにして、別のマシンの key_receiver.py へ送る。
+# 再送はせず、受け手が番号の抜けに気付いたら resync を返してくるので、
+# on_resync_request でノッチを合わせ直してもらう
+class NetworkKeySink:
+    def __init__(
+        self,
+        address: tuple[str, int],
+        on_resync_request: Callable[[], None] | None = None,
+    ) -> None:
+        self.socket = connect_udp(address)
+        self.socket.settimeout(REPLY_POLL_INTERVAL)
+        self.on_resync_request = on_resync_request
+        # 送り手を起動し直したことを、受け手が通し番号の巻き戻りと区別できるようにする
+        self.session = secrets.randbits(32)
+        self.sequence = 0
+        self.send_error_count = 0
+        self.resync_request_count = 0
+        self.round_trip = LatencyHistogram()
+        self.stop_requested = threading.Event()
+        self.thread = threading.Thread(
+            target=self.receive_replies, name="network-key-sink", daemon=True
+        )
+
+    def send(self, kind: DatagramKind, key: str = "", presses: int = 1) -> None:
+        datagram = KeyDatagram(
+            kind, key, presses, self.session, self.sequence, time.monotonic_ns()
+        )
+        self.sequence = (self.sequence + 1) % SEQUENCE_MODULUS
+        try:
+            self.socket.send(encode_datagram(datagram))
+        except OSError:
+            # 受け手が起動していないなどで届かなかった操作は、後続の番号の抜けとして受け手が気付く
+            self.send_error_count += 1
+
+    def key_down(self, key: str) -> None:
+        self.send("down", key)
+
+    def key_up(self, key: str) -> None:
+        self.send("up", key)
+
+    def press(self, key: str, presses: int = 1) -> None:
+        self.send("press", key, presses)
+
+    def echo(self) -> None:
+        self.send("echo")
+
+    def flush(self) -> None:
+        pass
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def close(self) -> None:
+        self.stop_requested.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.socket.close()
+
+    def receive_replies(self) -> None:
+        while not self.stop_requested.is_set():
+            try:
+                data = self.socket.recv(MAX_DATAGRAM_SIZE)
+            except TimeoutError:
+                continue
+            except OSError:
+                # 受け手がいないときのICMPによるエラーは、次の返信を待つ
+                continue
+            self.handle_reply(data, time.monotonic_ns())
+
+    def handle_reply(self, data: bytes, received_ns: int) -> None:
+        try:
+            datagram = decode_datagram(data)
+        except ValueError:
+            return
+        if datagram.session != self.session:
+            return
+        match datagram.kind:
+            case "echo":
+                self.round_trip.record(received_ns - datagram.timestamp_ns)
+            case "resync":
+                self.resync_request_count += 1
+                if self.on_resync_request is not None:
+                    self.on_resync_request()
+            case _:
+                pass
@@ -0,0 +1,311 @@
+import struct
+import time
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+import pygame
+
+from input_thread import StateLogger, handle_pygame_events
+from key_scheduler import ManualClock
+from mascon_controller import DEFAULT_NOTCH_HYSTERESIS, MasconController
+
+RECORDING_MAGIC = b"ZMREC\x00\x02\x00"
+
+# 先頭に記録時のノッチ判定の設定 (ヒステリシス, 最短の滞在秒数) を置く
+RECORDING_HEADER = struct.Struct("<dd")
+# 1イベント28バイトの固定長レコード:
+# 時刻(ns), 種類, ハットのx, ハットのy, 予備, instance_id, 軸/ボタン/デバイス番号, 軸の値
+RECORD = struct.Struct("<qBbbxiId")
+# 接続のレコードの直後には、キャリブレーションと割り当てを引くためのデバイス名を長さつきで置く
+DEVICE_NAME_LENGTH = struct.Struct("<H")
+
+RECORDED_EVENT_TYPES: tuple[int, ...] = (
+    pygame.JOYDEVICEADDED,
+    pygame.JOYDEVICEREMOVED,
+    pygame.JOYAXISMOTION,
+    pygame.JOYBUTTONDOWN,
+    pygame.JOYBUTTONUP,
+    pygame.JOYHATMOTION,
+)
+RECORDED_EVENT_CODES = {
+    event_type: code for code, event_type in enumerate(RECORDED_EVENT_TYPES)
+}
+RECORDING_BUFFER_RECORDS = 4096
+
+
+@dataclass(frozen=True, slots=True)
+class RecordedEvent:
+    timestamp_ns: int
+    event_type: int
+    instance_id: int = 0
+    index: int = 0
+    value: float = 0.0
+    hat: tuple[int, int] = (0, 0)
+    name: str = ""
+
+    def to_pygame_event(self) -> pygame.event.Event:
+        match self.event_type:
+            case pygame.JOYDEVICEADDED:
+                attributes = {"device_index": self.index}
+            case pygame.JOYAXISMOTION:
+                attributes = {
+                    "instance_id": self.instance_id,
+                    "axis": self.index,
+                    "value": self.value,
+                }
+            case pygame.JOYBUTTONDOWN | pygame.JOYBUTTONUP:
+                attributes = {"instance_id": self.instance_id, "button": self.index}
+            case pygame.JOYHATMOTION:
+                attributes = {
+                    "instance_id": self.instance_id,
+                    "hat": self.index,
+                    "value": self.hat,
+                }
+            case _:
+                attributes = {"instance_id": self.instance_id}
+        return pygame.event.Event(self.event_type, attributes)
+
+
+def recorded_event_from_pygame(
+    event: pygame.event.Event, timestamp_ns: int
+) -> RecordedEvent | None:
+    attributes = event.dict
+    match event.type:
+        case pygame.JOYDEVICEADDED:
+            device_index = attributes["device_index"]
+            try:
+                joystick = pygame.joystick.Joystick(device_index)
+            except pygame.error:
+                # 取り出す前に抜かれたデバイスは、名前なしで記録する
+                return RecordedEvent(timestamp_ns, event.type, index=device_index)
+            return RecordedEvent(
+                timestamp_ns,
+                event.type,
+                joystick.get_instance_id(),
+                device_index,
+                name=joystick.get_name(),
+            )
+        case pygame.JOYDEVICEREMOVED:
+            return RecordedEvent(
+                timestamp_ns, event.type, instance_id=attributes["instance_id"]
+            )
+        case pygame.JOYAXISMOTION:
+            return RecordedEvent(
+                timestamp_ns,
+                event.type,
+                attributes["instance_id"],
+                attributes["axis"],
+                attributes["value"],
+            )
+        case pygame.JOYBUTTONDOWN | pygame.JOYBUTTONUP:
+            return RecordedEvent(
+                timestamp_ns,
+                event.type,
+                attributes["instance_id"],
+                attributes["button"],
+            )
+        case pygame.JOYHATMOTION:
+            return RecordedEvent(
+                timestamp_ns,
+                event.type,
+                attributes["instance_id"],
+                attributes.get("hat", 0),
+                hat=attributes["value"],
+            )
+        case _:
+            return None
+
+
+@dataclass(frozen=True, slots=True)
+class SessionRecording:
+    events: list[RecordedEvent]
+    hysteresis: float = DEFAULT_NOTCH_HYSTERESIS
+    min_dwell: float = 0.0
+
+
+class SessionRecorder:
+    def __init__(
+        self,
+        path: Path,
+        hysteresis: float = DEFAULT_NOTCH_HYSTERESIS,
+        min_dwell: float = 0.0,
+        buffer_records: int = RECORDING_BUFFER_RECORDS,
+    ) -> None:
+        self.file: BinaryIO = path.open("wb", buffering=0)
+        self.file.write(RECORDING_MAGIC + RECORDING_HEADER.pack(hysteresis, min_dwell))
+        # イベントごとにwriteしないよう、固定長の領域に詰めてまとめて書き出す
+        self.buffer = bytearray(RECORD.size * buffer_records)
+        self.offset = 0
+        self.record_count = 0
+
+    def record(self, event: RecordedEvent) -> None:
+        RECORD.pack_into(
+            self.buffer,
+            self.offset,
+            event.timestamp_ns,
+            RECORDED_EVENT_CODES[event.event_type],
+            event.hat[0],
+            event.hat[1],
+            event.instance_id,
+            event.index,
+            event.value,
+        )
+        self.offset += RECORD.size
+        self.record_count += 1
+        if event.event_type == pygame.JOYDEVICEADDED:
+            # 接続はまれなため、可変長の名前はバッファを通さず直接書き出す
+            name = event.name.encode()
+            self.flush()
+            self.file.write(DEVICE_NAME_LENGTH.pack(len(name)) + name)
+        elif self.offset == len(self.buffer):
+            self.flush()
+
+    def record_pygame_events(
+        self, events: Iterable[pygame.event.Event], timestamp_ns: int
+    ) -> None:
+        for event in events:
+            recorded = recorded_event_from_pygame(event, timestamp_ns)
+            if recorded is not None:
+                self.record(recorded)
+
+    def flush(self) -> None:
+        if self.offset:
+            self.file.write(memoryview(self.buffer)[: self.offset])
+            self.offset = 0
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+
+
+def read_recording(path: Path) -> SessionRecording:
+    data = path.read_bytes()
+    if not data.startswith(RECORDING_MAGIC):
+        raise ValueError(f"not a session recording: {path}")
+
+    body = memoryview(data)[len(RECORDING_MAGIC) :]
+    if len(body) < RECORDING_HEADER.size:
+        raise ValueError(f"truncated session recording: {path}")
+    hysteresis, min_dwell = RECORDING_HEADER.unpack_from(body)
+
+    events: list[RecordedEvent] = []
+    offset = RECORDING_HEADER.size
+    while offset < len(body):
+        if len(body) - offset < RECORD.size:
+            raise ValueError(f"truncated session recording: {path}")
+        timestamp_ns, code, hat_x, hat_y, instance_id, index, value = (
+            RECORD.unpack_from(body, offset)
+        )
+        offset += RECORD.size
+        if code >= len(RECORDED_EVENT_TYPES):
+            raise ValueError(f"unknown event type {code} in {path}")
+        event_type = RECORDED_EVENT_TYPES[int(code)]
+        name = ""
+        if event_type == pygame.JOYDEVICEADDED:
+            if len(body) - offset < DEVICE_NAME_LENGTH.size:
+                raise ValueError(f"truncated session recording: {path}")
+            (length,) = DEVICE_NAME_LENGTH.unpack_from(body, offset)
+            offset += DEVICE_NAME_LENGTH.size
+            if len(body) - offset < length:
+                raise ValueError(f"truncated session recording: {path}")
+            name = bytes(body[offset : offset + length]).decode(errors="replace")
+            offset += length
+        events.append(
+            RecordedEvent(
+                timestamp_ns,
+                event_type,
+                instance_id,
+                index,
+                value,
+                (hat_x, hat_y),
+                name,
+            )
+        )
+    return SessionRecording(events, hysteresis, min_dwell)
+
+
+def group_recorded_batches(
+    events: Iterable[RecordedEvent],
+) -> Iterator[tuple[int, list[RecordedEvent]]]:
+    # 同じ時刻に取り出されたイベントは、記録時と同じく1つのバッチとして再生する
+    batch: list[RecordedEvent] = []
+    for event in events:
+        if batch and event.timestamp_ns != batch[0].timestamp_ns:
+            yield batch[0].timestamp_ns, batch
+            batch = []
+        batch.append(event)
+    if batch:
+        yield batch[0].timestamp_ns, batch
+
+
+def advance_replay_clock(
+    controller: MasconController, replay_clock: ManualClock, until: float | None
+) -> None:
+    # 予約したキー操作とノッチの確定を、記録の時刻のまま期限の順に実行する。
+    # until=None のときは予約がなくなるまで進める
+    while (deadline := controller.pending_deadline) is not None and (
+        until is None or deadline <= until
+    ):
+        replay_clock.now = max(replay_clock.now, deadline)
+        controller.poll_timers()
+    if until is not None:
+        replay_clock.now = until
+
+
+def replay_session(
+    events: Iterable[RecordedEvent],
+    controller: MasconController,
+    speed: float | None = 1.0,
+    clock: Callable[[], float] = time.monotonic,
+    sleep: Callable[[float], None] = time.sleep,
+    state_log: StateLogger | None = None,
+) -> int:
+    # speed=None のときは待たずに再生する。ノッチ確定の待ち時間は、
+    # 再生速度によらず記録時の時刻で判定する
+    replay_clock = ManualClock()
+    controller.primary.clock = replay_clock
+    started = clock()
+    first_timestamp_ns: int | None = None
+    batch_count = 0
+    device_names: dict[int, str] = {}
+    for timestamp_ns, batch in group_recorded_batches(events):
+        if first_timestamp_ns is None:
+            first_timestamp_ns = timestamp_ns
+        elapsed = (timestamp_ns - first_timestamp_ns) / 1e9
+        if speed is not None:
+            delay = started + elapsed / speed - clock()
+            if delay > 0:
+                sleep(delay)
+
+        # 記録したデバイスは再生時には接続されていないため、接続・切断は再生せず、
+        # イベントに現れたinstance_idを、記録した名前のデバイスとして登録する
+        for event in batch:
+            if event.event_type == pygame.JOYDEVICEADDED:
+                device_names[event.instance_id] = event.name
+        input_events = [
+            event
+            for event in batch
+            if event.event_type not in (pygame.JOYDEVICEADDED, pygame.JOYDEVICEREMOVED)
+        ]
+        pygame_events = [event.to_pygame_event() for event in input_events]
+        with controller.lock:
+            for event in input_events:
+                if event.instance_id not in controller.devices:
+                    controller.attach_device(
+                        event.instance_id, device_names.get(event.instance_id, "")
+                    )
+            advance_replay_clock(controller, replay_clock, elapsed)
+            handle_pygame_events(controller, pygame_events, state_log)
+            controller.primary.key_sink.flush()
+        batch_count += 1
+
+    with controller.lock:
+        # 記録の終わりで押したままのボタンの繰り返し入力は止め、押し続ける時間やマクロの残りは出し切る
+        controller.stop_key_repeats()
+        advance_replay_clock(controller, replay_clock, None)
+        controller.release_all_inputs()
+    return batch_count
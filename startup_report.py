@@ -0,0 +1,43 @@
+import time
+from collections.abc import Callable
+from typing import TextIO
+
+
+class StartupReport:
+    def __init__(
+        self,
+        started_at: float,
+        output: TextIO | None = None,
+        clock: Callable[[], float] = time.perf_counter,
+    ) -> None:
+        self.started_at = started_at
+        self.output = output
+        self.clock = clock
+        self.phases: list[tuple[str, float]] = []
+        self.last_mark = started_at
+        self.is_reported = False
+
+    def mark(self, phase: str) -> None:
+        now = self.clock()
+        self.phases.append((phase, now - self.last_mark))
+        self.last_mark = now
+
+    def has_phase(self, phase: str) -> bool:
+        return any(name == phase for name, _ in self.phases)
+
+    @property
+    def total(self) -> float:
+        return self.last_mark - self.started_at
+
+    def format(self) -> str:
+        lines = [f"{name}: {seconds * 1000:.1f} ms" for name, seconds in self.phases]
+        lines.append(f"total: {self.total * 1000:.1f} ms")
+        return "\n".join(lines)
+
+    def report(self) -> None:
+        # 最初のイベントを受け取ったときか、終了時のどちらか早い方で一度だけ出力する
+        if self.is_reported:
+            return
+        self.is_reported = True
+        if self.output is not None:
+            print(self.format(), file=self.output)
@@ -0,0 +1,196 @@
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import TextIO, cast
+
+from cli_defaults import LogFormat
+from mascon_controller import DpadButton, MasconController, Notch, ZuikiMasconButton
+
+LOG_BUFFER_CAPACITY = 4096
+LOG_FLUSH_INTERVAL = 0.1
+# 同じ内容の行が続くときに、まとめて書き出す間隔
+LOG_REPEAT_INTERVAL = 1.0
+
+
+@dataclass(frozen=True, slots=True)
+class StateEntry:
+    timestamp_ns: int
+    notch: Notch
+    raw_notch: Notch
+    pressed_buttons: frozenset[ZuikiMasconButton | DpadButton]
+    suppressed_transitions: int
+
+
+@dataclass(frozen=True, slots=True)
+class KeyEntry:
+    timestamp_ns: int
+    kind: str
+    key: str
+    presses: int
+
+
+type LogEntry = StateEntry | KeyEntry
+
+
+def entry_fields(entry: LogEntry) -> dict[str, object]:
+    # 連続する行が同じかどうかは、時刻を除いたこの内容で比べる
+    match entry:
+        case StateEntry():
+            return {
+                "event": "state",
+                "notch": entry.notch.name,
+                "raw_notch": entry.raw_notch.name,
+                "pressed_buttons": sorted(
+                    button.name for button in entry.pressed_buttons
+                ),
+                "suppressed_transitions": entry.suppressed_transitions,
+            }
+        case KeyEntry():
+            return {
+                "event": "key",
+                "kind": entry.kind,
+                "key": entry.key,
+                "presses": entry.presses,
+            }
+
+
+def format_text(fields: dict[str, object]) -> str:
+    match fields["event"]:
+        case "state":
+            buttons = cast(list[str], fields["pressed_buttons"])
+            text = (
+                f"{fields['notch']} {fields['raw_notch']} [{', '.join(buttons)}] "
+                f"suppressed={fields['suppressed_transitions']}"
+            )
+        case "key":
+            text = f"key {fields['kind']} {fields['key']}"
+            if fields["presses"] != 1:
+                text += f" x{fields['presses']}"
+        case _:
+            text = f"dropped {fields['count']} log entries"
+    if "repeated" in fields:
+        text += f" (repeated {fields['repeated']} times)"
+    return text
+
+
+# 入力スレッドとキー出力スレッドは、あらかじめ確保したリングバッファに記録を置くだけにし、
+# 文字列への変換と書き出しはバックグラウンドのスレッドで行う。
+# 書き出しが追いつかないときは古い記録から上書きし、dropped_count に数える
+class StateLog:
+    def __init__(
+        self,
+        stream: TextIO,
+        log_format: LogFormat = "text",
+        capacity: int = LOG_BUFFER_CAPACITY,
+        flush_interval: float = LOG_FLUSH_INTERVAL,
+        repeat_interval: float = LOG_REPEAT_INTERVAL,
+    ) -> None:
+        self.stream = stream
+        self.log_format = log_format
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.repeat_interval_ns = round(repeat_interval * 1e9)
+        self.entries: list[LogEntry | None] = [None] * capacity
+        self.write_count = 0
+        self.read_count = 0
+        self.dropped_count = 0
+        self.lock = threading.Lock()
+        self.last_fields: dict[str, object] | None = None
+        self.last_timestamp_ns = 0
+        self.last_written_ns = 0
+        self.repeat_count = 0
+        self.stop_requested = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="state-log", daemon=True)
+
+    def append(self, entry: LogEntry) -> None:
+        with self.lock:
+            self.entries[self.write_count % self.capacity] = entry
+            self.write_count += 1
+
+    def log_state(self, controller: MasconController) -> None:
+        self.append(
+            StateEntry(
+                time.monotonic_ns(),
+                controller.primary.notch,
+                controller.primary.raw_notch,
+                frozenset(controller.primary.pressed_buttons),
+                controller.primary.notch_filter.suppressed_count,
+            )
+        )
+
+    def log_key(self, kind: str, key: str, presses: int = 1) -> None:
+        self.append(KeyEntry(time.monotonic_ns(), kind, key, presses))
+
+    def take_entries(self) -> tuple[list[LogEntry], int]:
+        with self.lock:
+            start = max(self.read_count, self.write_count - self.capacity)
+            dropped = start - self.read_count
+            entries = [
+                self.entries[index % self.capacity]
+                for index in range(start, self.write_count)
+            ]
+            self.read_count = self.write_count
+        return [entry for entry in entries if entry is not None], dropped
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def close(self) -> None:
+        self.stop_requested.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.write_pending()
+        self.write_repeats()
+        self.stream.flush()
+
+    def run(self) -> None:
+        while not self.stop_requested.wait(self.flush_interval):
+            self.write_pending()
+            self.stream.flush()
+
+    def write_pending(self) -> None:
+        entries, dropped = self.take_entries()
+        if dropped:
+            self.dropped_count += dropped
+            self.write_repeats()
+            self.last_fields = None
+            self.write_line(
+                {"event": "dropped", "count": dropped},
+                entries[0].timestamp_ns if entries else time.monotonic_ns(),
+            )
+        for entry in entries:
+            self.write_entry(entry)
+
+    def write_entry(self, entry: LogEntry) -> None:
+        fields = entry_fields(entry)
+        if fields != self.last_fields:
+            self.write_repeats()
+            self.last_fields = fields
+            self.last_written_ns = entry.timestamp_ns
+            self.write_line(fields, entry.timestamp_ns)
+            return
+
+        # 同じ内容の行は数えるだけにし、長く続くときは一定の間隔でまとめて書き出す
+        self.repeat_count += 1
+        self.last_timestamp_ns = entry.timestamp_ns
+        if entry.timestamp_ns - self.last_written_ns >= self.repeat_interval_ns:
+            self.write_repeats()
+            self.last_written_ns = entry.timestamp_ns
+
+    def write_repeats(self) -> None:
+        if self.repeat_count and self.last_fields is not None:
+            self.write_line(
+                {**self.last_fields, "repeated": self.repeat_count},
+                self.last_timestamp_ns,
+            )
+        self.repeat_count = 0
+
+    def write_line(self, fields: dict[str, object], timestamp_ns: int) -> None:
+        if self.log_format == "json":
+            line = json.dumps(
+                {"timestamp_ns": timestamp_ns, **fields}, ensure_ascii=False
+            )
+        else:
+            line = format_text(fields)
+        self.stream.write(line + "\n")
@@ -1,24 +1,27 @@
 import sys
 import tkinter as tk
-
-import pygame
+from collections.abc import Callable
 
 from accessibility_permission import (
-    is_accessibility_permission_granted,
+    AccessibilityPermissionMonitor,
     is_macos,
     open_accessibility_settings,
 )
+from latency_stats import LatencyStats
 from mascon_controller import (
     PROFILE_LABELS,
-    PYGAME_POLL_INTERVAL_MS,
     MasconController,
     Notch,
+    ProfileLimit,
     TrainProfile,
     effective_notch_order,
 )
 from version_info import BUILD_LABEL
 
+STATUS_REFRESH_HZ = 60
+STATUS_REFRESH_INTERVAL_MS = 1000 // STATUS_REFRESH_HZ
 ACCESSIBILITY_PERMISSION_POLL_INTERVAL_MS = 1000
+LATENCY_REFRESH_INTERVAL_MS = 500
 
 COLOR_BACKGROUND = "#f6f8fa"
 COLOR_TEXT = "#24292f"
@@ -50,16 +53,41 @@ def should_show_accessibility_permission_status() -> bool:
     return is_macos()
 
 
+def latency_status(latency_stats: LatencyStats) -> str:
+    parts = [
+        f"{kind} p50 {values['p50']:.1f} / p95 {values['p95']:.1f}"
+        f" / p99 {values['p99']:.1f} / max {values['max']:.1f}"
+        for kind, values in latency_stats.summary_ms().items()
+        if values["count"]
+    ]
+    if not parts:
+        return "入力遅延 (ms): 計測なし"
+    return "入力遅延 (ms): " + "  ".join(parts)
+
+
 class StatusWindow:
-    def __init__(self, root: tk.Tk, controller: MasconController) -> None:
+    def __init__(
+        self,
+        root: tk.Tk,
+        controller: MasconController,
+        on_close: Callable[[], None] = lambda: None,
+        latency_stats: LatencyStats | None = None,
+        accessibility_monitor: AccessibilityPermissionMonitor | None = None,
+    ) -> None:
         self.root = root
         self.controller = controller
+        self.on_close = on_close
+        self.latency_stats = latency_stats
         self.show_accessibility_permission_status = (
             should_show_accessibility_permission_status()
         )
+        self.accessibility_monitor = (
+            accessibility_monitor or AccessibilityPermissionMonitor()
+        )
+        self.rendered_accessibility_granted: bool | None = None
         self.root.title("ZUIKI MASCON to JRETS")
         self.root.geometry(
-            "640x360" if self.show_accessibility_permission_status else "640x320"
+            "640x380" if self.show_accessibility_permission_status else "640x340"
         )
         self.root.resizable(False, False)
         self.root.configure(bg=COLOR_BACKGROUND)
@@ -163,8 +191,24 @@ class StatusWindow:
         self.notch_bar = tk.Frame(root, bg=COLOR_BACKGROUND)
         self.notch_bar.pack(pady=(14, 14))
 
+        # 車種を切り替えても作り直さないよう、すべてのノッチのラベルを最初に作っておく
         self.notch_labels: dict[Notch, tk.Label] = {}
-        self.rebuild_notch_bar()
+        for column, item in enumerate(Notch):
+            label = tk.Label(
+                self.notch_bar,
+                text=item.name,
+                width=3,
+                font=("Helvetica", 10, "bold"),
+                bg=COLOR_SURFACE,
+                fg=COLOR_MUTED,
+                relief="flat",
+                padx=4,
+                pady=4,
+            )
+            label.grid(row=0, column=column, padx=2)
+            label.grid_remove()
+            self.notch_labels[item] = label
+        self.visible_notches: tuple[Notch, ...] = ()
 
         self.buttons_title = tk.Label(
             root,
@@ -187,10 +231,24 @@ class StatusWindow:
         )
         self.version_label.pack(side="bottom", pady=(0, 8))
 
+        self.latency_label = tk.Label(
+            root,
+            font=("Helvetica", 10),
+            bg=COLOR_BACKGROUND,
+            fg=COLOR_MUTED,
+        )
+        self.latency_label.pack(side="bottom")
+
         self.button_labels: dict[str, tk.Label] = {}
+        self.rendered_options: dict[tk.Label, dict[str, str]] = {}
+        self.rendered_profile_limit: ProfileLimit | None = None
+        with self.controller.lock:
+            self.state_subscription = self.controller.subscribe(maxsize=1)
         if self.show_accessibility_permission_status:
+            self.accessibility_monitor.start()
             self.update_accessibility_status()
         self.update_status()
+        self.update_latency_status()
 
     def create_info_label(self, font_size: int = 12) -> tk.Label:
         label = tk.Label(
@@ -203,43 +261,82 @@ class StatusWindow:
         label.pack(fill="x", pady=2)
         return label
 
+    def configure(self, widget: tk.Label, **options: str) -> None:
+        # 前回設定した値と異なるオプションだけをTkに渡す
+        rendered = self.rendered_options.setdefault(widget, {})
+        changed = {
+            name: value
+            for name, value in options.items()
+            if rendered.get(name) != value
+        }
+        if changed:
+            widget.config(**changed)
+            rendered.update(changed)
+
+    def forget_widget(self, widget: tk.Label) -> None:
+        self.rendered_options.pop(widget, None)
+        widget.destroy()
+
     def render_status(self) -> None:
-        self.notch_label.config(
-            text=self.controller.notch.name,
-            fg=color_for_notch(self.controller.notch),
+        # 状態が変わったときだけ最新のスナップショットが届く
+        state = self.state_subscription.latest()
+        if state is None:
+            return
+
+        # 車種を切り替えたときと、設定ファイルで上限が変わったときに表示するノッチを変える
+        if state.profile_limit != self.rendered_profile_limit:
+            self.show_notch_bar(state.profile_limit)
+            self.rendered_profile_limit = state.profile_limit
+
+        self.configure(
+            self.notch_label,
+            text=state.notch.name,
+            fg=color_for_notch(state.notch),
         )
-        self.profile_limit_label.config(
+        self.configure(
+            self.profile_limit_label,
             text=(
                 "max "
-                f"{self.controller.profile_limit.max_power.name}/"
-                f"{self.controller.profile_limit.max_brake.name}"
-            )
+                f"{state.profile_limit.max_power.name}/"
+                f"{state.profile_limit.max_brake.name}"
+            ),
+        )
+        self.configure(
+            self.raw_label,
+            text=(
+                f"raw input: {state.raw_notch.name}"
+                f"  抑制したノッチ変化: {state.suppressed_transitions}"
+            ),
         )
-        self.raw_label.config(text=f"raw input: {self.controller.raw_notch.name}")
-        if self.controller.joysticks:
-            self.controller_label.config(
-                text=f"コントローラー認識数: {len(self.controller.joysticks)}",
+        if state.joystick_count:
+            self.configure(
+                self.controller_label,
+                text=f"コントローラー認識数: {state.joystick_count}",
                 fg=COLOR_MUTED,
             )
         else:
-            self.controller_label.config(
+            self.configure(
+                self.controller_label,
                 text="コントローラーが認識されていません",
                 fg=COLOR_DANGER,
             )
 
-        for train_profile, button in self.profile_buttons.items():
-            if train_profile == self.controller.profile:
-                button.config(bg=COLOR_TEXT, fg=COLOR_SURFACE)
+        for (train_profile, button), label in zip(
+            self.profile_buttons.items(), state.profile_labels
+        ):
+            if train_profile == state.profile:
+                self.configure(button, text=label, bg=COLOR_TEXT, fg=COLOR_SURFACE)
             else:
-                button.config(bg=COLOR_SURFACE, fg=COLOR_TEXT)
+                self.configure(button, text=label, bg=COLOR_SURFACE, fg=COLOR_TEXT)
 
-        for item, label in self.notch_labels.items():
-            if item == self.controller.notch:
-                label.config(bg=color_for_notch(item), fg=COLOR_SURFACE)
+        for item in self.visible_notches:
+            label = self.notch_labels[item]
+            if item == state.notch:
+                self.configure(label, bg=color_for_notch(item), fg=COLOR_SURFACE)
             else:
-                label.config(bg=COLOR_SURFACE, fg=COLOR_MUTED)
+                self.configure(label, bg=COLOR_SURFACE, fg=COLOR_MUTED)
 
-        current_buttons = {button.name for button in self.controller.pressed_buttons}
+        current_buttons = {button.name for button in state.pressed_buttons}
 
         for button_name in sorted(current_buttons):
             if button_name not in self.button_labels:
@@ -257,59 +354,65 @@ class StatusWindow:
 
         for button_name in list(self.button_labels):
             if button_name not in current_buttons:
-                self.button_labels[button_name].destroy()
-                del self.button_labels[button_name]
+                self.forget_widget(self.button_labels.pop(button_name))
 
     def update_status(self) -> None:
         self.render_status()
-        self.root.after(PYGAME_POLL_INTERVAL_MS, self.update_status)
+        self.root.after(STATUS_REFRESH_INTERVAL_MS, self.update_status)
+
+    def update_latency_status(self) -> None:
+        # 遅延はキー出力スレッドで記録されるため、状態の変化とは別に更新する
+        if self.latency_stats is not None:
+            self.configure(self.latency_label, text=latency_status(self.latency_stats))
+        self.root.after(LATENCY_REFRESH_INTERVAL_MS, self.update_latency_status)
 
     def update_accessibility_status(self) -> None:
-        is_accessibility_granted = is_accessibility_permission_granted()
+        # 確認はバックグラウンドで行われるため、ここではキャッシュを読むだけ
+        is_accessibility_granted = self.accessibility_monitor.is_granted()
+        if (
+            is_accessibility_granted is not None
+            and is_accessibility_granted != self.rendered_accessibility_granted
+        ):
+            self.render_accessibility_status(is_accessibility_granted)
+        self.root.after(
+            ACCESSIBILITY_PERMISSION_POLL_INTERVAL_MS,
+            self.update_accessibility_status,
+        )
+
+    def render_accessibility_status(self, is_accessibility_granted: bool) -> None:
+        self.rendered_accessibility_granted = is_accessibility_granted
         accessibility_text, accessibility_color = accessibility_permission_status(
             is_accessibility_granted
         )
-        self.accessibility_label.config(
+        self.configure(
+            self.accessibility_label,
             text=accessibility_text,
             fg=accessibility_color,
         )
         if is_accessibility_granted:
             self.accessibility_settings_button.pack_forget()
         else:
-            if not self.accessibility_settings_button.winfo_manager():
-                self.accessibility_settings_button.pack(side="left", padx=(8, 0))
-        self.root.after(
-            ACCESSIBILITY_PERMISSION_POLL_INTERVAL_MS,
-            self.update_accessibility_status,
-        )
-
-    def rebuild_notch_bar(self) -> None:
-        for label in self.notch_labels.values():
-            label.destroy()
-        self.notch_labels.clear()
+            self.accessibility_settings_button.pack(side="left", padx=(8, 0))
 
-        for item in effective_notch_order(self.controller.profile_limit):
-            label = tk.Label(
-                self.notch_bar,
-                text=item.name,
-                width=3,
-                font=("Helvetica", 10, "bold"),
-                bg=COLOR_SURFACE,
-                fg=COLOR_MUTED,
-                relief="flat",
-                padx=4,
-                pady=4,
-            )
-            label.pack(side="left", padx=2)
-            self.notch_labels[item] = label
+    def show_notch_bar(self, profile_limit: ProfileLimit) -> None:
+        # 列の位置は固定なので、表示するラベルを切り替えても並び順は変わらない
+        visible_notches = effective_notch_order(profile_limit)
+        for item, label in self.notch_labels.items():
+            if item in visible_notches and item not in self.visible_notches:
+                label.grid()
+            elif item not in visible_notches and item in self.visible_notches:
+                label.grid_remove()
+        self.visible_notches = visible_notches
 
     def change_profile(self, profile: TrainProfile) -> None:
-        self.controller.change_profile(profile)
-        self.rebuild_notch_bar()
+        with self.controller.lock:
+            self.controller.change_profile(profile)
         self.render_status()
 
     def close(self) -> None:
-        self.controller.release_all_inputs()
-        pygame.quit()
+        with self.controller.lock:
+            self.controller.unsubscribe(self.state_subscription)
+        self.accessibility_monitor.stop()
+        self.on_close()
         self.root.destroy()
         sys.exit()
@@ -1,3 +1,4 @@
+import threading
 from types import ModuleType
 
 from pytest_mock import MockerFixture
@@ -189,3 +190,81 @@ def test_open_accessibility_settings_ignores_open_failures(
     mocker.patch("accessibility_permission.subprocess.run", side_effect=OSError)
 
     accessibility_permission.open_accessibility_settings()
+
+
+class RecordingStopEvent:
+    def __init__(self, waits_before_stop: int) -> None:
+        self.waits_before_stop = waits_before_stop
+        self.timeouts: list[float | None] = []
+
+    def is_set(self) -> bool:
+        return len(self.timeouts) >= self.waits_before_stop
+
+    def set(self) -> None:
+        self.waits_before_stop = 0
+
+    def wait(self, timeout: float | None = None) -> bool:
+        self.timeouts.append(timeout)
+        return self.is_set()
+
+
+def test_next_accessibility_check_interval_backs_off_only_when_granted() -> None:
+    interval = 0.0
+    intervals: list[float] = []
+    for granted in (False, False, True, True, True, True, True, True, False):
+        interval = accessibility_permission.next_accessibility_check_interval(
+            granted, interval
+        )
+        intervals.append(interval)
+
+    assert intervals == [1.0, 1.0, 10.0, 20.0, 40.0, 80.0, 160.0, 300.0, 1.0]
+
+
+def test_accessibility_monitor_does_nothing_on_non_macos(
+    mocker: MockerFixture,
+) -> None:
+    patch_platform(mocker, "linux")
+    check = mocker.Mock(return_value=False)
+    monitor = accessibility_permission.AccessibilityPermissionMonitor(check)
+
+    monitor.start()
+
+    assert monitor.is_granted() is True
+    assert not monitor.thread.is_alive()
+    check.assert_not_called()
+
+
+def test_accessibility_monitor_schedules_checks_with_backoff() -> None:
+    results = iter([False, False, True, True, True])
+    monitor = accessibility_permission.AccessibilityPermissionMonitor(
+        lambda: next(results), enabled=True
+    )
+    stop_event = RecordingStopEvent(waits_before_stop=5)
+    monitor.stop_requested = stop_event  # pyright: ignore[reportAttributeAccessIssue]
+
+    assert monitor.is_granted() is None
+
+    monitor.run()
+
+    assert stop_event.timeouts == [1.0, 1.0, 10.0, 20.0, 40.0]
+    assert monitor.check_count == 5
+    assert monitor.is_granted() is True
+
+
+def test_accessibility_monitor_checks_in_background_until_stopped() -> None:
+    checked = threading.Event()
+
+    def check() -> bool:
+        checked.set()
+        return False
+
+    monitor = accessibility_permission.AccessibilityPermissionMonitor(
+        check, enabled=True
+    )
+
+    monitor.start()
+    assert checked.wait(timeout=1.0)
+    monitor.stop()
+
+    assert not monitor.thread.is_alive()
+    assert monitor.is_granted() is False
@@ -0,0 +1,152 @@
+import json
+import sys
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+
+mock = Mock()
+sys.modules["pyautogui"] = mock
+
+from calibration import (  # noqa: E402
+    calibrate_joystick,
+    calibration_from_detents,
+    find_lever_axis,
+    load_calibrations,
+    run_calibration,
+    save_calibrations,
+)
+from mascon_controller import (  # noqa: E402
+    AXIS_NOTCHES,
+    DEFAULT_AXIS_CALIBRATION,
+    AxisCalibration,
+)
+
+# test_get_notch で使っている ZKNS-013 の実測値 (B8 から P5 の順)
+DETENT_VALUES = [
+    -0.9608142338328196,
+    -0.8510086367381817,
+    -0.7490462965788751,
+    -0.6392406994842372,
+    -0.5294351023895993,
+    -0.4274727622302927,
+    -0.3176671651356548,
+    -0.20786156804101688,
+    0.003906369212927641,
+    0.24704733420819727,
+    0.43528550065614796,
+    0.6156804101687674,
+    0.8039185766167181,
+    1.0,
+]
+
+
+class FakeJoystick:
+    def __init__(
+        self, values: list[float], lever_axis: int = 1, axis_count: int = 2
+    ) -> None:
+        self.values = values
+        self.lever_axis = lever_axis
+        self.axis_count = axis_count
+        self.index = -1
+
+    def get_name(self) -> str:
+        return "ZUIKI Mascon"
+
+    def get_numaxes(self) -> int:
+        return self.axis_count
+
+    def get_axis(self, axis_number: int) -> float:
+        if axis_number == self.lever_axis:
+            return self.values[self.index]
+        return 0.01 * self.index
+
+    def advance(self, _prompt: str) -> str:
+        self.index += 1
+        return ""
+
+
+def test_calibration_from_detents_uses_midpoints() -> None:
+    calibration = calibration_from_detents([float(index) for index in range(14)])
+
+    assert calibration == AxisCalibration(tuple(index + 0.5 for index in range(13)))
+
+
+def test_calibration_from_measured_detents_is_close_to_default() -> None:
+    calibration = calibration_from_detents(DETENT_VALUES)
+
+    assert calibration.thresholds == pytest.approx(
+        DEFAULT_AXIS_CALIBRATION.thresholds, abs=0.06
+    )
+
+
+def test_find_lever_axis_picks_axis_with_largest_range() -> None:
+    readings = [[0.0, -1.0, 0.1], [0.1, 0.0, 0.1], [0.0, 1.0, 0.2]]
+
+    assert find_lever_axis(readings) == 1
+
+
+def test_calibration_from_detents_rejects_non_monotonic_readings() -> None:
+    values = list(DETENT_VALUES)
+    values[6] = values[2]
+
+    with pytest.raises(ValueError):
+        calibration_from_detents(values)
+
+
+def test_calibrate_joystick_keeps_detected_lever_axis() -> None:
+    joystick = FakeJoystick(DETENT_VALUES, lever_axis=2, axis_count=3)
+
+    calibration = calibrate_joystick(joystick, joystick.advance, pump=lambda: None)
+
+    assert calibration == calibration_from_detents(DETENT_VALUES, lever_axis=2)
+
+
+def test_load_calibrations_returns_empty_when_file_is_missing(tmp_path: Path) -> None:
+    assert load_calibrations(tmp_path / "missing.json") == {}
+
+
+def test_save_and_load_calibrations_round_trip(tmp_path: Path) -> None:
+    path = tmp_path / "nested" / "calibration.json"
+    pad_calibration = AxisCalibration(DEFAULT_AXIS_CALIBRATION.thresholds, 3)
+
+    save_calibrations(
+        path, {"ZUIKI Mascon": DEFAULT_AXIS_CALIBRATION, "pad": pad_calibration}
+    )
+
+    assert load_calibrations(path) == {
+        "ZUIKI Mascon": DEFAULT_AXIS_CALIBRATION,
+        "pad": pad_calibration,
+    }
+
+
+def test_load_calibrations_without_lever_axis_uses_default_axis(
+    tmp_path: Path,
+) -> None:
+    path = tmp_path / "calibration.json"
+    thresholds = list(DEFAULT_AXIS_CALIBRATION.thresholds)
+    path.write_text(json.dumps({"devices": {"pad": {"thresholds": thresholds}}}))
+
+    assert load_calibrations(path) == {"pad": DEFAULT_AXIS_CALIBRATION}
+
+
+def test_run_calibration_records_each_detent_and_saves_file(tmp_path: Path) -> None:
+    path = tmp_path / "calibration.json"
+    save_calibrations(path, {"other": DEFAULT_AXIS_CALIBRATION})
+    joystick = FakeJoystick(DETENT_VALUES)
+    prompts: list[str] = []
+
+    def read_line(prompt: str) -> str:
+        prompts.append(prompt)
+        return joystick.advance(prompt)
+
+    calibration = run_calibration(joystick, path, read_line, pump=lambda: None)
+
+    assert len(prompts) == len(AXIS_NOTCHES)
+    assert "B8" in prompts[0]
+    assert "P5" in prompts[-1]
+    assert calibration == calibration_from_detents(DETENT_VALUES)
+    assert load_calibrations(path) == {
+        "other": DEFAULT_AXIS_CALIBRATION,
+        "ZUIKI Mascon": calibration,
+    }
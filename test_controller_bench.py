@@ -0,0 +1,66 @@
+import json
+import sys
+from dataclasses import asdict
+from pathlib import Path
+from unittest.mock import Mock
+
+mock = Mock()
+sys.modules["pyautogui"] = mock
+
+from bench.controller_bench import (  # noqa: E402
+    WORKLOADS,
+    CountingKeySink,
+    controller_events_from_recording,
+    format_results,
+    legacy_update_notch,
+    run_benchmarks,
+)
+from mascon_controller import AxisMotion, ButtonDown, Notch, ZuikiMasconButton  # noqa: E402
+from session_recording import RecordedEvent, SessionRecorder, pygame  # noqa: E402
+
+
+def test_workloads_generate_requested_event_count() -> None:
+    for make_events in WORKLOADS.values():
+        assert len(make_events(101)) == 101
+
+
+def test_legacy_update_notch_counts_keys_like_before_planner() -> None:
+    sink = CountingKeySink()
+
+    legacy_update_notch(Notch.P3, Notch.B2, Notch.B8, sink)
+
+    assert sink.keystrokes == 3
+
+
+def test_run_benchmarks_reports_every_profile_and_planner() -> None:
+    report = run_benchmarks(event_count=50, repeats=1, workloads=("lever_sweep",))
+
+    names = {(result.name, result.profile) for result in report.results}
+    for profile in ("default", "tobu", "seibu"):
+        assert ("lever_sweep", profile) in names
+        assert ("update_notch", profile) in names
+        assert ("legacy_update_notch", profile) in names
+        keystrokes = report.transition_keystrokes[profile]
+        assert keystrokes["update_notch"] <= keystrokes["legacy_update_notch"]
+    assert all(result.ns_per_event > 0 for result in report.results)
+    assert json.loads(json.dumps(asdict(report)))["event_count"] == 50
+    assert "lever_sweep" in format_results(report)
+
+
+def test_recorded_sessions_become_workloads(tmp_path: Path) -> None:
+    path = tmp_path / "drive.zmrec"
+    recorder = SessionRecorder(path)
+    recorder.record(RecordedEvent(0, pygame.JOYDEVICEADDED))
+    recorder.record(RecordedEvent(1, pygame.JOYAXISMOTION, 0, 1, 0.5))
+    recorder.record(RecordedEvent(2, pygame.JOYBUTTONDOWN, 0, ZuikiMasconButton.A))
+    recorder.close()
+
+    report = run_benchmarks(event_count=10, repeats=1, workloads=(), recordings=[path])
+
+    assert {result.name for result in report.results} >= {"recording:drive"}
+    assert controller_events_from_recording(
+        [RecordedEvent(1, pygame.JOYAXISMOTION, 0, 1, 0.5)]
+    ) == [AxisMotion(0.5, 0, 1)]
+    assert controller_events_from_recording(
+        [RecordedEvent(2, pygame.JOYBUTTONDOWN, 0, ZuikiMasconButton.A)]
+    ) == [ButtonDown(ZuikiMasconButton.A, 0)]
@@ -0,0 +1,288 @@
+import sys
+import threading
+import time
+from unittest.mock import Mock
+
+from pytest_mock import MockerFixture
+
+mock = Mock()
+sys.modules["pyautogui"] = mock
+
+import input_thread  # noqa: E402
+from key_emitter import KeyEmitter  # noqa: E402
+from latency_stats import LatencyStats  # noqa: E402
+from mascon_controller import (  # noqa: E402
+    AxisMotion,
+    ButtonDown,
+    HatMotion,
+    MasconController,
+    MasconDevice,
+    NotchFilter,
+    RecordingKeySink,
+    ZuikiMasconButton,
+)
+
+
+def make_event(event_type: int, **attributes: object) -> Mock:
+    event = Mock()
+    event.type = event_type
+    event.dict = attributes
+    return event
+
+
+def test_handle_pygame_events_uses_controller(
+    mocker: MockerFixture,
+) -> None:
+    events = [
+        make_event(input_thread.pygame.JOYAXISMOTION, value=1.0, instance_id=0, axis=1),
+        make_event(
+            input_thread.pygame.JOYBUTTONDOWN,
+            button=ZuikiMasconButton.A,
+            instance_id=0,
+        ),
+        make_event(input_thread.pygame.JOYHATMOTION, value=(0, 1), instance_id=0),
+    ]
+    mocker.patch("input_thread.time.monotonic_ns", return_value=123)
+    controller = MasconController()
+    controller.attach_device(0)
+    handle_events_mock = mocker.patch.object(controller, "handle_events")
+
+    assert input_thread.handle_pygame_events(controller, events)
+
+    handle_events_mock.assert_called_once_with(
+        [
+            AxisMotion(1.0, 0, 1, timestamp_ns=123),
+            ButtonDown(ZuikiMasconButton.A, 0, 123),
+            HatMotion(0, 1, 0, 123),
+        ]
+    )
+
+
+def test_handle_pygame_events_logs_state_after_batch() -> None:
+    controller = MasconController(MasconDevice(key_sink=RecordingKeySink()))
+    controller.attach_device(0)
+    state_log = Mock()
+
+    input_thread.handle_pygame_events(
+        controller,
+        [
+            make_event(
+                input_thread.pygame.JOYAXISMOTION, value=0.3, instance_id=0, axis=1
+            )
+        ],
+        state_log,
+    )
+
+    state_log.log_state.assert_called_once_with(controller)
+
+
+def test_handle_pygame_events_filters_unknown_devices_axes_and_buttons(
+    mocker: MockerFixture,
+) -> None:
+    events = [
+        make_event(input_thread.pygame.JOYAXISMOTION, value=1.0, instance_id=5, axis=1),
+        make_event(input_thread.pygame.JOYAXISMOTION, value=1.0, instance_id=0, axis=0),
+        make_event(input_thread.pygame.JOYBUTTONDOWN, button=10, instance_id=0),
+        make_event(input_thread.pygame.JOYHATMOTION, value=(0, 1), instance_id=5),
+    ]
+    controller = MasconController()
+    controller.attach_device(0)
+    handle_events_mock = mocker.patch.object(controller, "handle_events")
+
+    assert input_thread.handle_pygame_events(controller, events)
+
+    handle_events_mock.assert_called_once_with([])
+
+
+def test_handle_pygame_events_stops_on_quit(
+    mocker: MockerFixture,
+) -> None:
+    events = [
+        make_event(input_thread.pygame.QUIT),
+        make_event(
+            input_thread.pygame.JOYBUTTONDOWN,
+            button=ZuikiMasconButton.A,
+            instance_id=0,
+        ),
+    ]
+    controller = MasconController()
+    release_mock = mocker.patch.object(controller, "release_all_inputs")
+    handle_events_mock = mocker.patch.object(controller, "handle_events")
+
+    assert not input_thread.handle_pygame_events(controller, events)
+
+    release_mock.assert_called_once_with()
+    handle_events_mock.assert_called_once_with([])
+
+
+def test_initialize_pygame_restricts_queue_to_input_events(
+    mocker: MockerFixture,
+) -> None:
+    display_init_mock = mocker.patch("input_thread.pygame.display.init")
+    joystick_init_mock = mocker.patch("input_thread.pygame.joystick.init")
+    mocker.patch("input_thread.pygame.display.set_allow_screensaver")
+    blocked_mock = mocker.patch("input_thread.pygame.event.set_blocked")
+    allowed_mock = mocker.patch("input_thread.pygame.event.set_allowed")
+    controller = MasconController()
+    initialize_mock = mocker.patch.object(controller, "initialize_joysticks")
+
+    input_thread.initialize_pygame(controller)
+
+    display_init_mock.assert_called_once_with()
+    joystick_init_mock.assert_called_once_with()
+    blocked_mock.assert_called_once_with(None)
+    allowed_mock.assert_called_once_with(input_thread.INPUT_EVENT_TYPES)
+    initialize_mock.assert_called_once_with()
+
+
+def test_wait_and_handle_events_handles_waited_event_with_pending_events(
+    mocker: MockerFixture,
+) -> None:
+    first = make_event(
+        input_thread.pygame.JOYAXISMOTION, value=1.0, instance_id=0, axis=1
+    )
+    second = make_event(
+        input_thread.pygame.JOYBUTTONDOWN, button=ZuikiMasconButton.A, instance_id=0
+    )
+    wait_mock = mocker.patch("input_thread.pygame.event.wait", return_value=first)
+    mocker.patch("input_thread.pygame.event.get", return_value=[second])
+    controller = MasconController()
+    controller.attach_device(0)
+    handle_axis_motion_mock = mocker.patch.object(
+        controller.primary, "handle_axis_motion"
+    )
+    handle_button_down_mock = mocker.patch.object(
+        controller.primary, "handle_button_down"
+    )
+
+    thread = input_thread.InputThread(controller)
+
+    assert thread.wait_and_handle_events()
+    wait_mock.assert_called_once_with(input_thread.INPUT_WAIT_TIMEOUT_MS)
+    handle_axis_motion_mock.assert_called_once_with(1.0)
+    handle_button_down_mock.assert_called_once_with(ZuikiMasconButton.A)
+    assert not controller.lock.locked()
+
+
+def test_wait_and_handle_events_ignores_timeout(
+    mocker: MockerFixture,
+) -> None:
+    mocker.patch(
+        "input_thread.pygame.event.wait",
+        return_value=make_event(input_thread.pygame.NOEVENT),
+    )
+    get_mock = mocker.patch("input_thread.pygame.event.get")
+
+    controller = MasconController()
+    poll_mock = mocker.patch.object(controller, "poll_pending_notch")
+
+    thread = input_thread.InputThread(controller)
+
+    assert thread.wait_and_handle_events()
+    get_mock.assert_not_called()
+    poll_mock.assert_called_once_with()
+
+
+def test_wait_and_handle_events_reports_key_backlog(
+    mocker: MockerFixture,
+) -> None:
+    mocker.patch(
+        "input_thread.pygame.event.wait",
+        return_value=make_event(input_thread.pygame.NOEVENT),
+    )
+    controller = MasconController()
+    check_mock = mocker.patch.object(controller, "check_key_backlog")
+    emitter = Mock(depth=70, dropped_count=2)
+
+    thread = input_thread.InputThread(controller, key_emitter=emitter)
+
+    assert thread.wait_and_handle_events()
+    check_mock.assert_called_once_with(70, 2)
+
+
+def test_wait_timeout_follows_pending_notch_deadline() -> None:
+    controller = MasconController(
+        MasconDevice(notch_filter=NotchFilter(min_dwell=0.05), clock=lambda: 1.0)
+    )
+    thread = input_thread.InputThread(controller)
+
+    assert thread.wait_timeout_ms() == input_thread.INPUT_WAIT_TIMEOUT_MS
+
+    controller.primary.notch_filter.update(
+        0.0, 1.0, controller.primary.axis_calibration
+    )
+    controller.primary.notch_filter.update(
+        0.3, 1.0, controller.primary.axis_calibration
+    )
+
+    assert 50 <= thread.wait_timeout_ms() <= 51
+
+
+def test_input_thread_releases_inputs_when_stopped(
+    mocker: MockerFixture,
+) -> None:
+    mocker.patch("input_thread.initialize_pygame")
+    quit_mock = mocker.patch("input_thread.pygame.quit")
+    controller = MasconController()
+    release_mock = mocker.patch.object(controller, "release_all_inputs")
+    thread = input_thread.InputThread(controller)
+    mocker.patch.object(
+        thread, "wait_and_handle_events", side_effect=thread.stop_requested.set
+    )
+
+    thread.start()
+    thread.stop()
+
+    assert not thread.is_alive()
+    release_mock.assert_called_once_with()
+    quit_mock.assert_called_once_with()
+
+
+def test_wait_and_handle_events_records_events_before_handling(
+    mocker: MockerFixture,
+) -> None:
+    event = make_event(
+        input_thread.pygame.JOYBUTTONDOWN, button=ZuikiMasconButton.A, instance_id=0
+    )
+    mocker.patch("input_thread.pygame.event.wait", return_value=event)
+    mocker.patch("input_thread.pygame.event.get", return_value=[])
+    mocker.patch("input_thread.time.monotonic_ns", return_value=7)
+    recorder = Mock()
+    thread = input_thread.InputThread(MasconController(), recorder=recorder)
+
+    assert thread.wait_and_handle_events()
+    recorder.record_pygame_events.assert_called_once_with([event], 7)
+
+
+def test_wait_and_handle_events_counts_lock_wait_as_latency(
+    mocker: MockerFixture,
+) -> None:
+    stats = LatencyStats()
+    emitter = KeyEmitter(RecordingKeySink(), latency_stats=stats)
+    controller = MasconController(MasconDevice(key_sink=emitter), latency_stats=stats)
+    controller.attach_device(0)
+    event = make_event(
+        input_thread.pygame.JOYBUTTONDOWN, button=ZuikiMasconButton.A, instance_id=0
+    )
+    locked = threading.Event()
+
+    def hold_lock() -> None:
+        with controller.lock:
+            locked.set()
+            time.sleep(0.05)
+
+    def wait_for_event(_timeout: int) -> Mock:
+        # イベントを取り出した直後に、画面のスレッドなどがロックを取る
+        threading.Thread(target=hold_lock).start()
+        locked.wait()
+        return event
+
+    mocker.patch("input_thread.pygame.event.wait", side_effect=wait_for_event)
+    mocker.patch("input_thread.pygame.event.get", return_value=[])
+
+    assert input_thread.InputThread(controller).wait_and_handle_events()
+    while emitter.actions:
+        emitter.emit(emitter.actions.popleft())
+
+    assert stats.histograms["button"].count == 1
+    assert stats.histograms["button"].max_ns >= 50_000_000
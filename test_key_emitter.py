@@ -0,0 +1,157 @@
+import sys
+from unittest.mock import Mock
+
+from pytest_mock import MockerFixture
+
+mock = Mock()
+sys.modules["pyautogui"] = mock
+
+from key_emitter import KeyAction, KeyEmitter  # noqa: E402
+from latency_stats import LatencyStats  # noqa: E402
+from mascon_controller import (  # noqa: E402
+    AxisMotion,
+    MasconController,
+    MasconDevice,
+    RecordingKeySink,
+)
+
+
+def test_key_emitter_sends_actions_in_order_from_worker_thread() -> None:
+    sink = RecordingKeySink()
+    emitter = KeyEmitter(sink)
+    emitter.start()
+
+    emitter.key_down("e")
+    emitter.press("z", 3)
+    emitter.key_up("e")
+
+    assert emitter.wait_until_idle(timeout=1.0)
+    emitter.close()
+    assert sink.actions == [
+        ("down", "e"),
+        ("press", "z"),
+        ("press", "z"),
+        ("press", "z"),
+        ("up", "e"),
+    ]
+    assert sink.flush_count >= 1
+
+
+class FailingKeySink(RecordingKeySink):
+    def key_down(self, key: str) -> None:
+        if key == "bad":
+            raise ValueError(f"unknown key for X11: {key!r}")
+        super().key_down(key)
+
+
+def test_key_emitter_keeps_running_after_sink_error() -> None:
+    sink = FailingKeySink()
+    emitter = KeyEmitter(sink)
+    emitter.start()
+
+    emitter.key_down("bad")
+    emitter.key_down("e")
+
+    assert emitter.wait_until_idle(timeout=1.0)
+    assert emitter.thread.is_alive()
+    emitter.close()
+    assert sink.actions == [("down", "e")]
+    assert emitter.error_count == 1
+    assert isinstance(emitter.last_error, ValueError)
+    assert emitter.depth == 0
+
+
+def test_key_emitter_queues_press_counts_as_single_action() -> None:
+    emitter = KeyEmitter(RecordingKeySink())
+
+    emitter.press(".", 8)
+
+    assert emitter.depth == 1
+    assert list(emitter.actions) == [KeyAction("press", ".", 8)]
+
+
+def test_key_emitter_drops_new_actions_when_queue_is_full() -> None:
+    emitter = KeyEmitter(RecordingKeySink(), maxsize=2)
+
+    assert emitter.enqueue(KeyAction("press", "z"))
+    assert emitter.enqueue(KeyAction("down", "e"))
+    assert not emitter.enqueue(KeyAction("press", "a"))
+
+    assert emitter.depth == 2
+    assert emitter.dropped_count == 1
+
+
+def test_key_emitter_always_accepts_key_up_when_queue_is_full() -> None:
+    emitter = KeyEmitter(RecordingKeySink(), maxsize=1)
+    emitter.key_down("e")
+
+    emitter.key_up("e")
+
+    assert emitter.depth == 2
+    assert emitter.dropped_count == 0
+
+
+def test_key_emitter_close_drains_pending_actions() -> None:
+    sink = RecordingKeySink()
+    emitter = KeyEmitter(sink)
+    emitter.key_down("e")
+    emitter.key_up("e")
+
+    emitter.start()
+    emitter.close()
+
+    assert sink.actions == [("down", "e"), ("up", "e")]
+    assert emitter.depth == 0
+
+
+def test_key_emitter_flushes_after_each_action_when_paced(
+    mocker: MockerFixture,
+) -> None:
+    sleep_mock = mocker.patch("key_emitter.time.sleep")
+    sink = RecordingKeySink()
+    emitter = KeyEmitter(sink, min_interval=0.05)
+
+    emitter.emit(KeyAction("press", "z", 2))
+
+    assert sink.pressed_keys() == ["z", "z"]
+    assert sink.flush_count == 2
+    assert sleep_mock.call_count == 2
+
+
+def test_key_emitter_records_latency_of_first_key_per_event(
+    mocker: MockerFixture,
+) -> None:
+    stats = LatencyStats()
+    emitter = KeyEmitter(RecordingKeySink(), latency_stats=stats)
+    mocker.patch("key_emitter.time.monotonic_ns", return_value=5_000_000)
+
+    stats.begin_event("axis", 1_000_000)
+    emitter.press("z", 2)
+    emitter.press("a")
+    emitter.key_down("e")
+    while emitter.actions:
+        emitter.emit(emitter.actions.popleft())
+
+    histogram = stats.histograms["axis"]
+    assert histogram.count == 1
+    assert histogram.max_ns == 4_000_000
+    assert stats.histograms["button"].count == 0
+
+
+def test_event_without_keys_does_not_charge_later_resync(
+    mocker: MockerFixture,
+) -> None:
+    stats = LatencyStats()
+    emitter = KeyEmitter(RecordingKeySink(), latency_stats=stats)
+    controller = MasconController(MasconDevice(key_sink=emitter), latency_stats=stats)
+    controller.attach_device(0)
+    mocker.patch("key_emitter.time.monotonic_ns", return_value=301_000_000)
+
+    # 同じノッチの中でのレバーの揺れはキーを出さない
+    controller.handle_events([AxisMotion(0.0, timestamp_ns=1_000_000)])
+    controller.resync_all_notches()
+    while emitter.actions:
+        emitter.emit(emitter.actions.popleft())
+
+    assert emitter.key_counts
+    assert stats.histograms["axis"].count == 0
@@ -0,0 +1,159 @@
+import sys
+from unittest.mock import Mock
+
+import pytest
+
+mock = Mock()
+sys.modules["pyautogui"] = mock
+
+from key_macro import Hold, Macro, MacroAction, Tap, Wait, compile_macro  # noqa: E402
+from key_scheduler import ManualClock  # noqa: E402
+from latency_stats import LatencyStats  # noqa: E402
+from mascon_controller import (  # noqa: E402
+    MasconController,
+    MasconDevice,
+    RecordingKeySink,
+    ZuikiMasconButton,
+)
+
+OVERLAY_MACRO = Macro(
+    (Tap(("command", "g")), Wait(0.5), Hold(("down",), 0.2), Tap(("enter",)))
+)
+
+
+def create_controller(
+    clock: ManualClock, sink: RecordingKeySink, stats: LatencyStats | None = None
+) -> MasconController:
+    return MasconController(
+        MasconDevice(
+            key_sink=sink, mapping={ZuikiMasconButton.HOME: OVERLAY_MACRO}, clock=clock
+        ),
+        latency_stats=stats,
+    )
+
+
+def test_compile_macro_flattens_steps_with_offsets() -> None:
+    assert compile_macro(OVERLAY_MACRO) == (
+        MacroAction("down", "command", 0.0),
+        MacroAction("down", "g", 0.0),
+        MacroAction("up", "g", 0.0),
+        MacroAction("up", "command", 0.0),
+        MacroAction("down", "down", 0.5),
+        MacroAction("up", "down", 0.7),
+        MacroAction("down", "enter", 0.7),
+        MacroAction("up", "enter", 0.7),
+    )
+
+
+@pytest.mark.parametrize(
+    "macro",
+    [
+        Macro(()),
+        Macro((Wait(1.0),)),
+        Macro((Tap(()),)),
+        Macro((Tap(("a",)), Wait(-1.0))),
+        Macro((Hold(("a",), -0.1),)),
+    ],
+)
+def test_compile_macro_rejects_invalid_macros(macro: Macro) -> None:
+    with pytest.raises(ValueError):
+        compile_macro(macro)
+
+
+def test_controller_rejects_invalid_macro_when_mapping_is_loaded() -> None:
+    with pytest.raises(ValueError):
+        MasconController(
+            MasconDevice(
+                key_sink=RecordingKeySink(), mapping={ZuikiMasconButton.HOME: Macro(())}
+            )
+        )
+
+
+def test_macro_runs_step_by_step_without_blocking() -> None:
+    clock = ManualClock()
+    sink = RecordingKeySink()
+    controller = create_controller(clock, sink)
+
+    controller.primary.handle_button_down(ZuikiMasconButton.HOME)
+    controller.primary.handle_button_up(ZuikiMasconButton.HOME)
+
+    assert sink.actions == [
+        ("down", "command"),
+        ("down", "g"),
+        ("up", "g"),
+        ("up", "command"),
+    ]
+    assert controller.pending_deadline == 0.5
+
+    clock.now = 0.5
+    controller.poll_timers()
+
+    assert sink.actions[-1] == ("down", "down")
+
+    clock.now = 0.7
+    controller.poll_timers()
+
+    assert sink.actions[-3:] == [("up", "down"), ("down", "enter"), ("up", "enter")]
+    assert controller.primary.macro_runs == {}
+    assert controller.pending_deadline is None
+
+
+def test_pressing_macro_button_again_cancels_and_releases_held_keys() -> None:
+    clock = ManualClock()
+    sink = RecordingKeySink()
+    controller = create_controller(clock, sink)
+    controller.primary.handle_button_down(ZuikiMasconButton.HOME)
+    controller.primary.handle_button_up(ZuikiMasconButton.HOME)
+    clock.now = 0.6
+    controller.poll_timers()
+
+    controller.primary.handle_button_down(ZuikiMasconButton.HOME)
+    clock.now = 2.0
+    controller.poll_timers()
+
+    assert sink.actions[-2:] == [("down", "down"), ("up", "down")]
+    assert controller.primary.macro_runs == {}
+    assert controller.pending_deadline is None
+
+
+def test_macro_step_lag_is_recorded_in_stats() -> None:
+    clock = ManualClock()
+    stats = LatencyStats()
+    controller = create_controller(clock, RecordingKeySink(), stats)
+
+    controller.primary.handle_button_down(ZuikiMasconButton.HOME)
+    clock.now = 0.51
+    controller.poll_timers()
+
+    assert stats.macro_step_lag.count == 5
+    assert stats.macro_step_lag.max_ns == 10_000_000
+    assert "macro_step_lag: n=5" in stats.format_summary()
+
+
+def test_macro_releases_fn_after_arrow_keys_with_workaround() -> None:
+    clock = ManualClock()
+    sink = RecordingKeySink()
+    controller = MasconController(
+        MasconDevice(
+            key_sink=sink,
+            mapping={
+                ZuikiMasconButton.HOME: Macro((Tap(("up",)), Hold(("down",), 0.2)))
+            },
+            clock=clock,
+            fn_workaround=True,
+        )
+    )
+
+    controller.primary.handle_button_down(ZuikiMasconButton.HOME)
+    clock.now = 0.2
+    controller.poll_timers()
+
+    assert sink.actions == [
+        ("down", "up"),
+        ("up", "up"),
+        ("up", "fn"),
+        ("down", "down"),
+        ("up", "down"),
+        ("up", "fn"),
+    ]
+    assert controller.primary.macro_runs == {}
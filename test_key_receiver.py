@@ -0,0 +1,212 @@
+import ipaddress
+import socket
+import sys
+from unittest.mock import Mock
+
+import pytest
+
+mock = Mock()
+sys.modules["pyautogui"] = mock
+
+from key_receiver import MAX_RECEIVED_PRESSES, KeyReceiver  # noqa: E402
+from mascon_controller import RecordingKeySink  # noqa: E402
+from network_key_sink import (  # noqa: E402
+    SEQUENCE_MODULUS,
+    DatagramKind,
+    KeyDatagram,
+    NetworkKeySink,
+    decode_datagram,
+    encode_datagram,
+)
+
+PEER = ("127.0.0.1", 9)
+
+
+def create_receiver(
+    fn_workaround: bool = False,
+) -> tuple[KeyReceiver, RecordingKeySink]:
+    sink = RecordingKeySink()
+    return KeyReceiver(sink, ("127.0.0.1", 0), fn_workaround), sink
+
+
+def datagram(
+    kind: DatagramKind = "press",
+    key: str = "z",
+    sequence: int = 0,
+    session: int = 1,
+    presses: int = 1,
+) -> bytes:
+    return encode_datagram(KeyDatagram(kind, key, presses, session, sequence, 0))
+
+
+def test_receiver_applies_datagrams_in_order() -> None:
+    receiver, sink = create_receiver()
+
+    receiver.handle_datagram(datagram("down", "backspace", 0), PEER)
+    receiver.handle_datagram(datagram("press", "z", 1), PEER)
+    receiver.handle_datagram(datagram("up", "backspace", 2), PEER)
+    receiver.close()
+
+    assert sink.actions == [
+        ("down", "backspace"),
+        ("press", "z"),
+        ("up", "backspace"),
+    ]
+    assert receiver.received_count == 3
+    assert receiver.lost_count == 0
+    assert not receiver.held_keys
+
+
+def test_receiver_requests_resync_when_datagrams_are_lost() -> None:
+    receiver, sink = create_receiver()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        sender.bind(("127.0.0.1", 0))
+        sender.settimeout(5)
+        peer = sender.getsockname()
+
+        receiver.handle_datagram(datagram(sequence=10), peer)
+        receiver.handle_datagram(datagram(sequence=13), peer)
+        reply = decode_datagram(sender.recv(1024))
+        # 抜けた番号が遅れて届いても、順序を守るため捨てる
+        receiver.handle_datagram(datagram(sequence=11), peer)
+    receiver.close()
+
+    assert reply.kind == "resync"
+    assert reply.session == 1
+    # 最初に抜けた番号を知らせる
+    assert reply.sequence == 11
+    assert sink.pressed_keys() == ["z", "z"]
+    assert receiver.lost_count == 2
+    assert receiver.stale_count == 1
+    assert receiver.resync_request_count == 1
+
+
+def test_receiver_releases_held_keys_when_a_key_up_is_lost() -> None:
+    receiver, sink = create_receiver()
+
+    receiver.handle_datagram(datagram("down", "backspace", 0), PEER)
+    # 1番のkey_upが失われた
+    receiver.handle_datagram(datagram("press", "z", 2), PEER)
+
+    assert sink.actions == [
+        ("down", "backspace"),
+        ("up", "backspace"),
+        ("press", "z"),
+    ]
+    assert not receiver.held_keys
+    assert receiver.lost_count == 1
+    receiver.close()
+
+
+def test_receiver_follows_sequence_wraparound() -> None:
+    receiver, sink = create_receiver()
+
+    receiver.handle_datagram(datagram(sequence=SEQUENCE_MODULUS - 1), PEER)
+    receiver.handle_datagram(datagram(sequence=0), PEER)
+    receiver.close()
+
+    assert sink.pressed_keys() == ["z", "z"]
+    assert receiver.lost_count == 0
+
+
+def test_receiver_restarts_numbering_for_a_new_sender_session() -> None:
+    receiver, sink = create_receiver()
+
+    receiver.handle_datagram(datagram("down", "backspace", 50, session=1), PEER)
+    receiver.handle_datagram(datagram("press", "z", 0, session=2), PEER)
+    receiver.close()
+
+    # 起動し直した送り手が離せなくなったキーは、受け手が離す
+    assert sink.actions == [
+        ("down", "backspace"),
+        ("up", "backspace"),
+        ("press", "z"),
+    ]
+    assert receiver.lost_count == 0
+    assert receiver.stale_count == 0
+
+
+def test_receiver_rejects_unknown_keys_and_replies() -> None:
+    receiver, sink = create_receiver()
+
+    receiver.handle_datagram(b"garbage", PEER)
+    receiver.handle_datagram(datagram("press", "not-a-key"), PEER)
+    receiver.handle_datagram(datagram("resync", ""), PEER)
+    receiver.close()
+
+    assert sink.actions == []
+    assert receiver.invalid_count == 3
+
+
+def test_receiver_limits_presses_per_datagram() -> None:
+    receiver, sink = create_receiver()
+
+    receiver.handle_datagram(datagram("press", "z", presses=255), PEER)
+    receiver.close()
+
+    assert sink.pressed_keys() == ["z"] * MAX_RECEIVED_PRESSES
+
+
+def test_receiver_requires_allowed_hosts_off_loopback() -> None:
+    with pytest.raises(ValueError):
+        KeyReceiver(RecordingKeySink(), ("0.0.0.0", 0))
+
+
+def test_receiver_accepts_only_allowed_hosts_off_loopback() -> None:
+    sink = RecordingKeySink()
+    receiver = KeyReceiver(
+        sink,
+        ("0.0.0.0", 0),
+        allowed_hosts=frozenset({ipaddress.ip_address("192.0.2.1")}),
+    )
+
+    receiver.handle_datagram(datagram("press", "z", 0), ("192.0.2.1", 9))
+    receiver.handle_datagram(datagram("press", "x", 1), ("198.51.100.7", 9))
+    receiver.handle_datagram(datagram("press", "c", 1), ("::ffff:192.0.2.1", 9))
+    receiver.handle_datagram(datagram("press", "v", 2), PEER)
+    receiver.close()
+
+    assert sink.pressed_keys() == ["z", "c", "v"]
+    assert receiver.rejected_count == 1
+
+
+def test_receiver_releases_fn_for_pyautogui_workaround() -> None:
+    receiver, sink = create_receiver(fn_workaround=True)
+
+    receiver.handle_datagram(datagram("down", "up", 0), PEER)
+    receiver.handle_datagram(datagram("up", "up", 1), PEER)
+    receiver.close()
+
+    assert sink.actions == [("down", "up"), ("up", "up"), ("up", "fn")]
+
+
+def test_receiver_releases_held_keys_on_close() -> None:
+    receiver, sink = create_receiver()
+
+    receiver.handle_datagram(datagram("down", "backspace"), PEER)
+    receiver.close()
+
+    assert sink.actions == [("down", "backspace"), ("up", "backspace")]
+
+
+def test_network_key_sink_and_receiver_over_loopback() -> None:
+    receiver, sink = create_receiver()
+    receiver.start()
+    network_sink = NetworkKeySink(receiver.address)
+    network_sink.start()
+
+    network_sink.press(".")
+    network_sink.key_down("enter")
+    network_sink.key_up("enter")
+    network_sink.echo()
+    for _ in range(500):
+        if network_sink.round_trip.count:
+            break
+        receiver.stop_requested.wait(0.01)
+    network_sink.close()
+    receiver.close()
+
+    assert sink.actions == [("press", "."), ("down", "enter"), ("up", "enter")]
+    assert network_sink.round_trip.count == 1
+    assert receiver.received_count == 4
+    assert not receiver.thread.is_alive()
@@ -0,0 +1,60 @@
+from key_scheduler import KeyScheduler
+from latency_stats import LatencyStats
+
+
+def test_key_scheduler_runs_due_timers_in_deadline_order() -> None:
+    scheduler = KeyScheduler()
+    fired: list[str] = []
+    scheduler.schedule(2.0, lambda: fired.append("late"))
+    scheduler.schedule(1.0, lambda: fired.append("first"))
+    scheduler.schedule(1.0, lambda: fired.append("second"))
+
+    assert scheduler.run_due(0.5) == 0
+    assert scheduler.next_deadline == 1.0
+    assert scheduler.run_due(1.0) == 2
+    assert fired == ["first", "second"]
+    assert scheduler.next_deadline == 2.0
+
+
+def test_key_scheduler_skips_cancelled_timers() -> None:
+    scheduler = KeyScheduler()
+    fired: list[str] = []
+    timer = scheduler.schedule(1.0, lambda: fired.append("cancelled"))
+    scheduler.schedule(3.0, lambda: fired.append("kept"))
+
+    timer.cancel()
+
+    assert scheduler.next_deadline == 3.0
+    assert scheduler.run_due(5.0) == 1
+    assert fired == ["kept"]
+    assert scheduler.next_deadline is None
+
+
+def test_key_scheduler_records_lag_behind_deadline() -> None:
+    stats = LatencyStats()
+    scheduler = KeyScheduler(stats)
+    scheduler.schedule(1.0, lambda: None)
+    scheduler.schedule(1.5, lambda: None)
+
+    scheduler.run_due(1.502)
+
+    assert scheduler.fired_count == 2
+    assert scheduler.max_lag == 0.502
+    assert stats.timer_lag.count == 2
+    assert stats.timer_lag.max_ns == 502_000_000
+    assert "timer_lag: n=2" in stats.format_summary()
+
+
+def test_key_scheduler_runs_timers_scheduled_by_callbacks_when_due() -> None:
+    scheduler = KeyScheduler()
+    fired: list[float] = []
+
+    def repeat() -> None:
+        fired.append(len(fired))
+        scheduler.schedule(10.0, repeat)
+
+    scheduler.schedule(1.0, repeat)
+    scheduler.run_due(1.0)
+
+    assert fired == [0]
+    assert scheduler.next_deadline == 10.0
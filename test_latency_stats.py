@@ -0,0 +1,70 @@
+from latency_stats import (
+    LATENCY_BUCKET_BOUNDS_NS,
+    LATENCY_BUCKET_MAX_NS,
+    LATENCY_BUCKET_MIN_NS,
+    LatencyHistogram,
+    LatencyStats,
+)
+
+
+def test_latency_bucket_bounds_are_increasing() -> None:
+    assert LATENCY_BUCKET_BOUNDS_NS[0] == LATENCY_BUCKET_MIN_NS
+    assert LATENCY_BUCKET_BOUNDS_NS[-1] == LATENCY_BUCKET_MAX_NS
+    assert all(
+        lower < upper
+        for lower, upper in zip(LATENCY_BUCKET_BOUNDS_NS, LATENCY_BUCKET_BOUNDS_NS[1:])
+    )
+
+
+def test_latency_histogram_percentiles_stay_within_bucket_error() -> None:
+    histogram = LatencyHistogram()
+    for latency_ms in range(1, 101):
+        histogram.record(latency_ms * 1_000_000)
+
+    assert histogram.count == 100
+    assert histogram.max_ns == 100_000_000
+    for quantile, expected_ms in ((0.5, 50), (0.95, 95), (0.99, 99)):
+        value = histogram.percentile_ns(quantile) / 1_000_000
+        assert expected_ms <= value <= expected_ms * 1.2
+
+
+def test_latency_histogram_percentile_does_not_exceed_max() -> None:
+    histogram = LatencyHistogram()
+    histogram.record(1_000)
+    histogram.record(20_000_000_000)
+
+    assert histogram.percentile_ns(0.5) == LATENCY_BUCKET_MIN_NS
+    assert histogram.percentile_ns(0.99) == 20_000_000_000
+
+
+def test_latency_histogram_is_empty_without_samples() -> None:
+    assert LatencyHistogram().percentile_ns(0.99) == 0
+
+
+def test_latency_stats_takes_event_only_once() -> None:
+    stats = LatencyStats()
+    stats.begin_event("axis", 123)
+
+    assert stats.take_event() == ("axis", 123)
+    assert stats.take_event() is None
+
+
+def test_latency_stats_summary_is_split_by_event_kind() -> None:
+    stats = LatencyStats()
+    stats.record("button", 2_000_000)
+
+    summary = stats.summary_ms()
+
+    assert summary["button"]["count"] == 1
+    assert summary["button"]["max"] == 2.0
+    assert summary["axis"]["count"] == 0
+    assert "button: n=1" in stats.format_summary()
+
+
+def test_latency_stats_end_event_discards_untaken_event() -> None:
+    stats = LatencyStats()
+
+    stats.begin_event("axis", 1_000)
+    stats.end_event()
+
+    assert stats.take_event() is None
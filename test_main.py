@@ -1,6 +1,10 @@
+import os
+import signal
+import subprocess
 import sys
 from argparse import Namespace
-from unittest.mock import Mock
+from pathlib import Path
+from unittest.mock import Mock, call
 
 import pytest
 from pytest_mock import MockerFixture
@@ -9,22 +13,18 @@ mock = Mock()
 sys.modules["pyautogui"] = mock
 
 import main  # noqa: E402
-from mascon_controller import MasconController  # noqa: E402
-
-
-def test_handle_pygame_events_uses_controller(
-    mocker: MockerFixture,
-) -> None:
-    event = Mock()
-    event.type = main.pygame.JOYAXISMOTION
-    event.dict = {"value": 1.0}
-    mocker.patch("main.pygame.event.get", return_value=[event])
-    controller = MasconController()
-    handle_axis_motion_mock = mocker.patch.object(controller, "handle_axis_motion")
-
-    main.handle_pygame_events(controller, Namespace(verbose=False))
-
-    handle_axis_motion_mock.assert_called_once_with(1.0)
+from mascon_controller import (  # noqa: E402
+    MasconController,
+    MasconDevice,
+    PyAutoGuiKeySink,
+    ZuikiMasconButton,
+)
+from network_key_sink import NetworkKeySink  # noqa: E402
+from session_recording import (  # noqa: E402
+    RecordedEvent,
+    SessionRecorder,
+    SessionRecording,
+)
 
 
 def test_warn_if_accessibility_permission_is_missing_outputs_warning(
@@ -54,18 +54,39 @@ def test_warn_if_accessibility_permission_is_missing_skips_non_macos(
     permission_mock.assert_not_called()
 
 
-def test_main_starts_status_window(
-    mocker: MockerFixture,
+def test_main_starts_status_window_and_input_thread(
+    mocker: MockerFixture, tmp_path: Path
 ) -> None:
-    args = Namespace(profile="default", verbose=False)
+    args = Namespace(
+        profile="default",
+        key_sink="pyautogui",
+        key_interval_ms=0.0,
+        calibration=tmp_path / "calibration.json",
+        mapping=tmp_path / "mapping.toml",
+        calibrate=False,
+        hysteresis=0.05,
+        min_dwell_ms=30.0,
+        record=None,
+        replay=None,
+        replay_speed=1.0,
+        no_gui=False,
+        startup_report=False,
+        stats=False,
+        verbose=False,
+        log_format="text",
+        metrics_port=None,
+        metrics_socket=None,
+    )
     root = Mock()
     mocker.patch("main.parse_args", return_value=args)
-    mocker.patch("main.tk.Tk", return_value=root)
+    mocker.patch("tkinter.Tk", return_value=root)
     prompt_mock = mocker.patch("main.prompt_for_accessibility_permission")
     warn_mock = mocker.patch("main.warn_if_accessibility_permission_is_missing")
-    status_window_mock = mocker.patch("main.StatusWindow")
-    initialize_mock = mocker.patch("main.initialize_pygame")
-    poll_mock = mocker.patch("main.poll_pygame_events")
+    status_window_mock = mocker.patch("status_window.StatusWindow")
+    input_thread_mock = mocker.patch("main.InputThread")
+    emitter_mock = mocker.patch("main.KeyEmitter")
+    stop_mock = mocker.patch("main.stop_input")
+    watch_mock = mocker.patch("main.close_when_input_thread_stops")
 
     main.main()
 
@@ -74,7 +95,326 @@ def test_main_starts_status_window(
     status_window_mock.assert_called_once()
     controller = status_window_mock.call_args.args[1]
     assert isinstance(controller, MasconController)
-    assert controller.profile == main.TrainProfile.DEFAULT
-    initialize_mock.assert_called_once_with(controller)
-    poll_mock.assert_called_once_with(root, controller, args)
+    assert controller.primary.profile == main.TrainProfile.DEFAULT
+    assert controller.axis_calibrations == {}
+    assert controller.primary.notch_filter.hysteresis == 0.05
+    assert controller.primary.notch_filter.min_dwell == 0.03
+    emitter = emitter_mock.return_value
+    assert controller.primary.key_sink is emitter
+    assert isinstance(emitter_mock.call_args.args[0], PyAutoGuiKeySink)
+    assert emitter_mock.call_args.kwargs["min_interval"] == 0.0
+    assert controller.latency_stats is emitter_mock.call_args.kwargs["latency_stats"]
+    emitter.start.assert_called_once_with()
+    input_thread = input_thread_mock.return_value
+    input_thread_mock.assert_called_once_with(
+        controller,
+        state_log=None,
+        recorder=None,
+        startup_report=None,
+        key_emitter=emitter,
+    )
+    input_thread.start.assert_called_once_with()
+    status_window_mock.call_args.kwargs["on_close"]()
+    stop_mock.assert_called_once_with(input_thread, emitter, None)
+    watch_mock.assert_called_once_with(
+        root, input_thread, status_window_mock.return_value
+    )
     root.mainloop.assert_called_once_with()
+
+
+def test_main_runs_calibration_without_status_window(
+    mocker: MockerFixture, tmp_path: Path
+) -> None:
+    path = tmp_path / "calibration.json"
+    mocker.patch(
+        "main.parse_args",
+        return_value=Namespace(calibrate=True, calibration=path),
+    )
+    calibrate_mock = mocker.patch("main.calibrate")
+    status_window_mock = mocker.patch("status_window.StatusWindow")
+
+    main.main()
+
+    calibrate_mock.assert_called_once_with(path)
+    status_window_mock.assert_not_called()
+
+
+def test_main_replays_recording_to_recording_sink(
+    mocker: MockerFixture, tmp_path: Path, capsys: pytest.CaptureFixture[str]
+) -> None:
+    path = tmp_path / "session.zmrec"
+    recorder = SessionRecorder(path)
+    recorder.record(RecordedEvent(0, main.pygame.JOYAXISMOTION, 0, 1, 0.0))
+    recorder.record(RecordedEvent(1_000, main.pygame.JOYAXISMOTION, 0, 1, 0.3))
+    recorder.close()
+    args = Namespace(
+        calibrate=False,
+        replay=path,
+        replay_speed=0.0,
+        profile="default",
+        key_sink="print",
+        key_interval_ms=0.0,
+        calibration=tmp_path / "calibration.json",
+        mapping=tmp_path / "mapping.toml",
+        hysteresis=0.02,
+        min_dwell_ms=0.0,
+        stats=False,
+        verbose=False,
+        log_format="text",
+        metrics_port=None,
+        metrics_socket=None,
+    )
+    mocker.patch("main.parse_args", return_value=args)
+    status_window_mock = mocker.patch("status_window.StatusWindow")
+
+    main.main()
+
+    assert capsys.readouterr().out.splitlines() == ["press z"]
+    status_window_mock.assert_not_called()
+
+
+def test_create_notch_filter_prefers_arguments_over_recorded_settings() -> None:
+    recording = SessionRecording([], hysteresis=0.05, min_dwell=0.03)
+
+    recorded = main.create_notch_filter(
+        Namespace(hysteresis=None, min_dwell_ms=None), recording
+    )
+    overridden = main.create_notch_filter(
+        Namespace(hysteresis=0.1, min_dwell_ms=0.0), recording
+    )
+    default = main.create_notch_filter(Namespace(hysteresis=None, min_dwell_ms=None))
+
+    assert (recorded.hysteresis, recorded.min_dwell) == (0.05, 0.03)
+    assert (overridden.hysteresis, overridden.min_dwell) == (0.1, 0.0)
+    assert (default.hysteresis, default.min_dwell) == (
+        main.DEFAULT_NOTCH_HYSTERESIS,
+        0.0,
+    )
+
+
+def test_main_reports_unreadable_recording(
+    mocker: MockerFixture, tmp_path: Path, capsys: pytest.CaptureFixture[str]
+) -> None:
+    path = tmp_path / "session.zmrec"
+    path.write_bytes(b"not a recording")
+    mocker.patch(
+        "main.parse_args",
+        return_value=Namespace(calibrate=False, replay=path),
+    )
+
+    with pytest.raises(SystemExit):
+        main.main()
+
+    assert "記録ファイル" in capsys.readouterr().err
+
+
+def test_main_without_gui_skips_status_window(
+    mocker: MockerFixture, tmp_path: Path
+) -> None:
+    args = Namespace(
+        profile="default",
+        key_sink="pyautogui",
+        key_interval_ms=0.0,
+        calibration=tmp_path / "calibration.json",
+        mapping=tmp_path / "mapping.toml",
+        calibrate=False,
+        hysteresis=0.02,
+        min_dwell_ms=0.0,
+        record=None,
+        replay=None,
+        no_gui=True,
+        startup_report=False,
+        stats=False,
+        verbose=True,
+        log_format="text",
+        metrics_port=None,
+        metrics_socket=None,
+    )
+    mocker.patch("main.parse_args", return_value=args)
+    mocker.patch("main.prompt_for_accessibility_permission")
+    mocker.patch("main.warn_if_accessibility_permission_is_missing")
+    input_thread_mock = mocker.patch("main.InputThread")
+    emitter_mock = mocker.patch("main.KeyEmitter")
+    headless_mock = mocker.patch("main.run_headless")
+    status_window_mock = mocker.patch("main.run_status_window")
+
+    main.main()
+
+    headless_mock.assert_called_once_with(
+        input_thread_mock.return_value, emitter_mock.return_value, None
+    )
+    status_window_mock.assert_not_called()
+
+
+def test_main_applies_mapping_file_and_stops_watcher(
+    mocker: MockerFixture, tmp_path: Path
+) -> None:
+    mapping_path = tmp_path / "mapping.toml"
+    mapping_path.write_text(
+        '[buttons]\na = "x"\n\n[profiles.tobu]\nlabel = "東武線"\n',
+        encoding="utf-8",
+    )
+    args = Namespace(
+        profile="tobu",
+        key_sink="pyautogui",
+        key_interval_ms=0.0,
+        calibration=tmp_path / "calibration.json",
+        mapping=mapping_path,
+        hysteresis=0.02,
+        min_dwell_ms=0.0,
+        calibrate=False,
+        record=None,
+        replay=None,
+        no_gui=True,
+        startup_report=False,
+        stats=False,
+        verbose=False,
+        log_format="text",
+        metrics_port=None,
+        metrics_socket=None,
+    )
+    mocker.patch("main.parse_args", return_value=args)
+    mocker.patch("main.prompt_for_accessibility_permission")
+    mocker.patch("main.warn_if_accessibility_permission_is_missing")
+    input_thread_mock = mocker.patch("main.InputThread")
+    mocker.patch("main.KeyEmitter")
+    mocker.patch("main.run_headless")
+    watcher_mock = mocker.patch("mapping_config.MappingConfigWatcher")
+
+    main.main()
+
+    controller = input_thread_mock.call_args.args[0]
+    assert controller.primary.mapping[ZuikiMasconButton.A] == "x"
+    assert controller.profile_labels[main.TrainProfile.TOBU] == "東武線"
+    watcher_mock.assert_called_once_with(
+        mapping_path, controller, on_error=main.warn_about_mapping_reload_error
+    )
+    watcher_mock.return_value.start.assert_called_once_with()
+    watcher_mock.return_value.stop.assert_called_once_with()
+
+
+def test_load_mapping_file_exits_on_invalid_file(
+    tmp_path: Path, capsys: pytest.CaptureFixture[str]
+) -> None:
+    path = tmp_path / "mapping.toml"
+    path.write_text('[buttons]\na = "no-such-key"\n', encoding="utf-8")
+
+    with pytest.raises(SystemExit):
+        main.load_mapping_file(path, MasconController())
+
+    assert "マッピングファイル" in capsys.readouterr().err
+
+
+def test_resolve_mapped_keys_exits_on_keys_x11_cannot_send(
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    sink = Mock(spec=main.XTestKeySink)
+    sink.resolve_keys.side_effect = ValueError("unknown key for X11: 'fn'")
+    controller = MasconController()
+
+    with pytest.raises(SystemExit):
+        main.resolve_mapped_keys(sink, controller)
+
+    assert controller.resolve_keys is sink.resolve_keys
+    assert "X11で送れないキー" in capsys.readouterr().err
+
+
+def test_network_key_sink_requests_notch_resync() -> None:
+    args = Namespace(key_sink="network", key_receiver=("127.0.0.1", 9))
+    sink = main.create_output_sink(args)
+    controller = MasconController(MasconDevice(key_sink=sink))
+
+    main.start_network_key_sink(sink, controller)
+    assert isinstance(sink, NetworkKeySink)
+    assert sink.on_resync_request is not None
+    sink.on_resync_request()
+    main.close_network_key_sink(sink)
+
+    assert controller.is_resync_pending
+    assert not sink.thread.is_alive()
+
+
+def test_run_headless_stops_input_thread_on_sigterm(mocker: MockerFixture) -> None:
+    input_thread = Mock()
+    input_thread.join.side_effect = lambda: os.kill(os.getpid(), signal.SIGTERM)
+    emitter = Mock()
+    stop_mock = mocker.patch("main.stop_input")
+    handlers = {
+        signum: signal.getsignal(signum) for signum in (signal.SIGINT, signal.SIGTERM)
+    }
+
+    try:
+        main.run_headless(input_thread, emitter)
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+    input_thread.stop_requested.set.assert_called_once_with()
+    emitter.start.assert_called_once_with()
+    input_thread.start.assert_called_once_with()
+    stop_mock.assert_called_once_with(input_thread, emitter, None)
+
+
+def test_main_module_does_not_import_tkinter() -> None:
+    code = (
+        "import sys\n"
+        "from unittest.mock import Mock\n"
+        "sys.modules['pyautogui'] = Mock()\n"
+        "import main\n"
+        "print('tkinter' in sys.modules)\n"
+    )
+    completed = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        check=True,
+        cwd=Path(main.__file__).parent,
+        text=True,
+    )
+
+    assert completed.stdout.splitlines()[-1] == "False"
+
+
+def test_load_axis_calibrations_warns_about_invalid_file(
+    tmp_path: Path, capsys: pytest.CaptureFixture[str]
+) -> None:
+    path = tmp_path / "calibration.json"
+    path.write_text('{"devices": {"mascon": {"thresholds": [1, 0]}}}')
+
+    assert main.load_axis_calibrations(path) == {}
+    assert "キャリブレーションファイル" in capsys.readouterr().err
+
+
+def test_stop_input_stops_input_thread_before_draining_emitter() -> None:
+    manager = Mock()
+
+    main.stop_input(manager.input_thread, manager.emitter)
+
+    assert manager.mock_calls == [
+        call.input_thread.stop(),
+        call.emitter.close(),
+    ]
+
+
+def test_close_when_input_thread_stops_closes_status_window() -> None:
+    root = Mock()
+    input_thread = Mock()
+    input_thread.is_alive.return_value = False
+    status_window = Mock()
+
+    main.close_when_input_thread_stops(root, input_thread, status_window)
+
+    status_window.close.assert_called_once_with()
+    root.after.assert_not_called()
+
+
+def test_close_when_input_thread_stops_keeps_watching_running_thread() -> None:
+    root = Mock()
+    input_thread = Mock()
+    input_thread.is_alive.return_value = True
+    status_window = Mock()
+
+    main.close_when_input_thread_stops(root, input_thread, status_window)
+
+    status_window.close.assert_not_called()
+    root.after.assert_called_once()
+    assert root.after.call_args.args[0] == main.INPUT_THREAD_WATCH_INTERVAL_MS
@@ -0,0 +1,280 @@
+import os
+import sys
+import tomllib
+from collections.abc import Iterable
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+
+mock = Mock()
+sys.modules["pyautogui"] = mock
+
+from key_macro import Hold, Macro, Tap, Wait  # noqa: E402
+from mapping_config import (  # noqa: E402
+    MappingConfigWatcher,
+    parse_mapping_config,
+)
+from mascon_controller import (  # noqa: E402
+    MAPPING_TO_KEYBOARD,
+    PROFILE_LABELS,
+    PROFILE_LIMITS,
+    ButtonDown,
+    DeviceBinding,
+    DpadButton,
+    HoldKeys,
+    MasconController,
+    MasconDevice,
+    Notch,
+    ProfileLimit,
+    RecordingKeySink,
+    RepeatKey,
+    TrainProfile,
+    ZuikiMasconButton,
+)
+
+MAPPING_FILE = """
+[buttons]
+a = "h"
+home = ["command", "g"]
+up = { hold = "up", duration = 0.5 }
+down = { repeat = "down", interval = 0.1 }
+capture = { macro = [
+    { tap = ["command", "g"] },
+    { wait = 0.5 },
+    { hold = "down", duration = 0.2 },
+] }
+
+[profiles.tobu]
+label = "東武線"
+max_power = "P4"
+"""
+
+
+def write_mapping_file(path: Path, text: str) -> None:
+    path.write_text(text, encoding="utf-8")
+    # 同じ時刻・同じ大きさでも変更として見えるよう、更新日時を進める
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_parse_mapping_config_merges_with_defaults() -> None:
+    config = parse_mapping_config(tomllib.loads(MAPPING_FILE))
+
+    assert config.mapping[ZuikiMasconButton.A] == "h"
+    assert config.mapping[ZuikiMasconButton.HOME] == ("command", "g")
+    assert config.mapping[DpadButton.UP] == HoldKeys(("up",), 0.5)
+    assert config.mapping[DpadButton.DOWN] == RepeatKey("down", 0.1)
+    assert config.mapping[ZuikiMasconButton.CAPTURE] == Macro(
+        (Tap(("command", "g")), Wait(0.5), Hold(("down",), 0.2))
+    )
+    assert (
+        config.mapping[ZuikiMasconButton.B] == MAPPING_TO_KEYBOARD[ZuikiMasconButton.B]
+    )
+    assert config.profile_limits[TrainProfile.TOBU] == ProfileLimit(
+        max_power=Notch.P4, max_brake=PROFILE_LIMITS[TrainProfile.TOBU].max_brake
+    )
+    assert (
+        config.profile_limits[TrainProfile.SEIBU] == PROFILE_LIMITS[TrainProfile.SEIBU]
+    )
+    assert config.profile_labels == {
+        **PROFILE_LABELS,
+        TrainProfile.TOBU: "東武線",
+    }
+
+
+def test_parse_mapping_config_builds_device_bindings() -> None:
+    config = parse_mapping_config(
+        tomllib.loads(
+            MAPPING_FILE
+            + """
+[devices."ZUIKI Mascon"]
+lever_axis = 2
+
+[devices."Other Pad"]
+profile = "seibu"
+buttons = { b = "k" }
+"""
+        )
+    )
+
+    assert config.device_bindings["ZUIKI Mascon"] == DeviceBinding(lever_axis=2)
+    binding = config.device_bindings["Other Pad"]
+    assert binding.profile == TrainProfile.SEIBU
+    assert binding.lever_axis is None
+    # 書かなかったボタンは、ファイル全体の割り当てを使う
+    assert binding.mapping == {**config.mapping, ZuikiMasconButton.B: "k"}
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "[keys]",
+        '[buttons]\nzz = "a"',
+        "[buttons]\na = 1",
+        "[buttons]\na = [1]",
+        '[buttons]\na = { hold = "a" }',
+        '[buttons]\na = { repeat = "a", interval = true }',
+        '[buttons]\na = { macro = [{ press = "a" }] }',
+        '[profiles.keio]\nlabel = "京王"',
+        '[profiles.tobu]\nmax_power = "B1"',
+        '[profiles.tobu]\nmax_brake = "P1"',
+        '[profiles.tobu]\nmax_brake = "EB"',
+        '[profiles.tobu]\nlabel = ""',
+        "[profiles.tobu]\nspeed = 1",
+        'devices = "pad"',
+        '[devices.pad]\nprofile = "keio"',
+        "[devices.pad]\nlever_axis = -1",
+        "[devices.pad]\nlever_axis = true",
+        '[devices.pad]\nbuttons = { zz = "a" }',
+        '[devices.pad]\nsink = "xtest"',
+    ],
+)
+def test_parse_mapping_config_rejects_invalid_settings(text: str) -> None:
+    with pytest.raises(ValueError):
+        parse_mapping_config(tomllib.loads(text))
+
+
+def test_watcher_applies_changed_file(tmp_path: Path) -> None:
+    path = tmp_path / "mapping.toml"
+    controller = MasconController(MasconDevice(key_sink=RecordingKeySink()))
+    on_error = Mock()
+    watcher = MappingConfigWatcher(path, controller, on_error)
+    subscription = controller.subscribe()
+
+    assert not watcher.check_once()
+
+    write_mapping_file(path, MAPPING_FILE)
+
+    assert watcher.check_once()
+    assert not watcher.check_once()
+    assert watcher.reload_count == 1
+    assert controller.primary.mapping[ZuikiMasconButton.A] == "h"
+    assert controller.primary.profile_limits[TrainProfile.TOBU].max_power == Notch.P4
+    state = subscription.latest()
+    assert state is not None
+    assert state.profile_labels == ("標準", "東武線", "西武")
+    on_error.assert_not_called()
+
+
+def test_watcher_keeps_previous_tables_on_invalid_edit(tmp_path: Path) -> None:
+    path = tmp_path / "mapping.toml"
+    controller = MasconController(MasconDevice(key_sink=RecordingKeySink()))
+    on_error = Mock()
+    watcher = MappingConfigWatcher(path, controller, on_error)
+    write_mapping_file(path, MAPPING_FILE)
+    watcher.check_once()
+    compiled_mapping = controller.primary.compiled_mapping
+
+    write_mapping_file(path, '[buttons]\na = "no-such-key"\n')
+
+    assert not watcher.check_once()
+    assert watcher.error_count == 1
+    assert controller.primary.compiled_mapping is compiled_mapping
+    assert controller.primary.mapping[ZuikiMasconButton.A] == "h"
+    on_error.assert_called_once()
+    assert on_error.call_args.args[0] == path
+    assert isinstance(on_error.call_args.args[1], ValueError)
+
+    write_mapping_file(path, "[buttons\n")
+
+    assert not watcher.check_once()
+    assert watcher.error_count == 2
+
+
+def test_watcher_releases_pressed_keys_before_swapping(tmp_path: Path) -> None:
+    path = tmp_path / "mapping.toml"
+    sink = RecordingKeySink()
+    controller = MasconController(MasconDevice(key_sink=sink))
+    controller.attach_device(0)
+    watcher = MappingConfigWatcher(path, controller, Mock())
+    controller.handle_events(
+        [ButtonDown(ZuikiMasconButton.A), ButtonDown(ZuikiMasconButton.HOME)]
+    )
+    sink.actions.clear()
+
+    write_mapping_file(path, MAPPING_FILE)
+    watcher.check_once()
+
+    assert set(sink.actions) == {
+        ("up", "backspace"),
+        ("up", "command"),
+        ("up", "g"),
+    }
+    assert controller.primary.pressed_buttons == set()
+
+    sink.actions.clear()
+    controller.handle_events([ButtonDown(ZuikiMasconButton.A)])
+
+    assert sink.actions == [("down", "h")]
+
+
+def test_watcher_keeps_settings_when_file_is_deleted(tmp_path: Path) -> None:
+    path = tmp_path / "mapping.toml"
+    controller = MasconController(MasconDevice(key_sink=RecordingKeySink()))
+    watcher = MappingConfigWatcher(path, controller, Mock())
+    write_mapping_file(path, MAPPING_FILE)
+    watcher.check_once()
+
+    path.unlink()
+
+    assert not watcher.check_once()
+    assert controller.primary.mapping[ZuikiMasconButton.A] == "h"
+
+    write_mapping_file(path, '[buttons]\na = "j"\n')
+
+    assert watcher.check_once()
+    assert controller.primary.mapping[ZuikiMasconButton.A] == "j"
+
+
+def test_watcher_thread_stops() -> None:
+    watcher = MappingConfigWatcher(
+        Path("missing.toml"), MasconController(), Mock(), interval=0.01
+    )
+    watcher.start()
+    watcher.stop()
+
+    assert not watcher.thread.is_alive()
+
+
+def test_watcher_rejects_keys_the_key_sink_cannot_send(tmp_path: Path) -> None:
+    path = tmp_path / "mapping.toml"
+
+    def resolve_keys(keys: Iterable[str]) -> None:
+        if "fn" in keys:
+            raise ValueError("unknown key for X11: 'fn'")
+
+    controller = MasconController(
+        MasconDevice(key_sink=RecordingKeySink()), resolve_keys=resolve_keys
+    )
+    on_error = Mock()
+    watcher = MappingConfigWatcher(path, controller, on_error)
+    compiled_mapping = controller.primary.compiled_mapping
+
+    write_mapping_file(path, '[buttons]\na = "fn"\n')
+
+    assert not watcher.check_once()
+    assert controller.primary.compiled_mapping is compiled_mapping
+    assert isinstance(on_error.call_args.args[1], ValueError)
+
+    # デバイスごとの割り当ても確かめる
+    write_mapping_file(path, '[devices.pad]\nbuttons = { a = "fn" }\n')
+
+    assert not watcher.check_once()
+    assert controller.device_bindings == {}
+    assert on_error.call_count == 2
+
+
+def test_watcher_binds_devices_connected_after_reload(tmp_path: Path) -> None:
+    path = tmp_path / "mapping.toml"
+    sink = RecordingKeySink()
+    controller = MasconController(MasconDevice(key_sink=sink))
+    controller.attach_device(0)
+    watcher = MappingConfigWatcher(path, controller, Mock())
+
+    write_mapping_file(path, '[devices.pad]\nbuttons = { a = "k" }\n')
+
+    assert watcher.check_once()
+    controller.attach_device(1, "pad")
+    controller.handle_events([ButtonDown(ZuikiMasconButton.A, 1)])
+    assert sink.actions == [("down", "k")]
@@ -1,4 +1,10 @@
+import io
+import shutil
+import subprocess
 import sys
+import threading
+import time
+from collections.abc import Iterator
 from unittest.mock import Mock, call
 
 import pytest
@@ -7,14 +13,54 @@ from pytest_mock import MockerFixture
 mock = Mock()
 sys.modules["pyautogui"] = mock
 
+from key_emitter import KeyEmitter  # noqa: E402
+from key_macro import Macro, Tap  # noqa: E402
+from key_scheduler import ManualClock  # noqa: E402
+from latency_stats import LatencyStats  # noqa: E402
 from mascon_controller import (  # noqa: E402
+    DEFAULT_AXIS_CALIBRATION,
+    KEY_NAMES,
+    MAPPING_SLOT_COUNT,
+    MAPPING_TO_KEYBOARD,
+    NOTCH_KEYS,
+    PROFILE_LIMITS,
+    PYAUTOGUI_UNUSED_MODULES,
+    RESYNC_ANCHOR_KEYS,
+    RESYNC_BACKLOG_THRESHOLD,
+    RESYNC_CHORD_WINDOW,
+    X11_KEYSYM_NAMES,
+    X11_UNSUPPORTED_KEYS,
+    AxisCalibration,
+    AxisMotion,
+    ButtonDown,
+    ButtonUp,
+    DeviceBinding,
     DpadButton,
+    HatMotion,
+    HoldKeys,
+    KeyMapping,
     MasconController,
+    MasconDevice,
     Notch,
-    PROFILE_LIMITS,
+    NotchFilter,
+    NullKeySink,
+    PrintingKeySink,
+    ProfileLimit,
+    PyAutoGuiKeySink,
+    RecordingKeySink,
+    RepeatKey,
     TrainProfile,
+    XTestKeySink,
     ZuikiMasconButton,
+    apply_notch_key,
+    build_notch_transitions,
+    build_resync_keys,
+    coalesce_axis_motions,
+    compile_mapping,
+    create_key_sink,
+    effective_notch_order,
     get_notch,
+    mapped_keys,
     project_notch,
     update_notch,
 )
@@ -39,88 +85,173 @@ def test_get_notch() -> None:
 
 
 @pytest.mark.parametrize(
-    ("current", "next_notch", "calls"),
+    ("value", "expected"),
     [
-        pytest.param(Notch.P2, Notch.P5, [call("z", 3)], id="P2 -> P5"),
-        pytest.param(Notch.P2, Notch.P1, [call("a", 1)], id="P2 -> P1"),
-        pytest.param(Notch.P2, Notch.N, [call("s")], id="P2 -> N"),
-        pytest.param(Notch.P2, Notch.B5, [call("s"), call(".", 5)], id="P2 -> B5"),
-        pytest.param(Notch.P2, Notch.EB, [call("s"), call("/")], id="P2 -> EB"),
-        pytest.param(Notch.N, Notch.P2, [call("z", 2)], id="N -> P2"),
-        pytest.param(Notch.N, Notch.B5, [call(".", 5)], id="N -> B5"),
-        pytest.param(Notch.N, Notch.EB, [call("/")], id="N -> EB"),
-        pytest.param(Notch.B5, Notch.P2, [call("m"), call("z", 2)], id="B5 -> P2"),
-        pytest.param(Notch.B5, Notch.N, [call("m")], id="B5 -> N"),
-        pytest.param(Notch.B5, Notch.B1, [call(",", 4)], id="B5 -> B1"),
-        pytest.param(Notch.B5, Notch.B8, [call(".", 3)], id="B5 -> B8"),
-        pytest.param(Notch.B5, Notch.EB, [call("/")], id="B5 -> EB"),
-        pytest.param(Notch.EB, Notch.P2, [call("m"), call("z", 2)], id="EB -> P2"),
-        pytest.param(Notch.EB, Notch.N, [call("m")], id="EB -> N"),
+        pytest.param(0.9, Notch.P4, id="threshold belongs to lower notch"),
+        pytest.param(0.9000001, Notch.P5, id="above threshold"),
+        pytest.param(-0.9, Notch.B8, id="lowest threshold"),
+        pytest.param(-0.1, Notch.B1, id="N lower threshold"),
+        pytest.param(0.15, Notch.N, id="N upper threshold"),
     ],
 )
-def test_update_notch(
-    mocker: MockerFixture, current: Notch, next_notch: Notch, calls: list[object]
+def test_get_notch_threshold_boundaries(value: float, expected: Notch) -> None:
+    assert get_notch(value, False) == expected
+
+
+def test_get_notch_uses_custom_calibration() -> None:
+    calibration = AxisCalibration(tuple(-0.65 + 0.1 * index for index in range(13)))
+
+    assert get_notch(-0.66, False, calibration) == Notch.B8
+    assert get_notch(-0.66, True, calibration) == Notch.EB
+    assert get_notch(0.0, False, calibration) == Notch.B1
+    assert get_notch(0.6, False, calibration) == Notch.P5
+
+
+@pytest.mark.parametrize(
+    "thresholds",
+    [
+        pytest.param((0.0,) * 13, id="not increasing"),
+        pytest.param(tuple(range(12)), id="too few"),
+    ],
+)
+def test_axis_calibration_rejects_invalid_thresholds(
+    thresholds: tuple[float, ...],
 ) -> None:
-    press_mock = mocker.patch("mascon_controller.press")
-    update_notch(current, next_notch, Notch.B8)
-    assert press_mock.call_args_list == calls
+    with pytest.raises(ValueError):
+        AxisCalibration(thresholds)
+
+
+@pytest.mark.parametrize(
+    ("current", "next_notch", "keys"),
+    [
+        pytest.param(Notch.P2, Notch.P5, ["z", "z", "z"], id="P2 -> P5"),
+        pytest.param(Notch.P2, Notch.P1, ["a"], id="P2 -> P1"),
+        pytest.param(Notch.P2, Notch.N, ["s"], id="P2 -> N"),
+        pytest.param(Notch.P2, Notch.B5, ["s", ".", ".", ".", ".", "."], id="P2 -> B5"),
+        pytest.param(Notch.P2, Notch.EB, ["s", "/"], id="P2 -> EB"),
+        pytest.param(Notch.N, Notch.P2, ["z", "z"], id="N -> P2"),
+        pytest.param(Notch.N, Notch.B5, [".", ".", ".", ".", "."], id="N -> B5"),
+        pytest.param(Notch.N, Notch.EB, ["/"], id="N -> EB"),
+        pytest.param(Notch.B5, Notch.P2, ["m", "z", "z"], id="B5 -> P2"),
+        pytest.param(Notch.B5, Notch.N, ["m"], id="B5 -> N"),
+        pytest.param(Notch.B5, Notch.B1, ["m", "."], id="B5 -> B1"),
+        pytest.param(Notch.B3, Notch.B1, [",", ","], id="B3 -> B1"),
+        pytest.param(Notch.P3, Notch.P1, ["a", "a"], id="P3 -> P1"),
+        pytest.param(Notch.P5, Notch.P1, ["s", "z"], id="P5 -> P1"),
+        pytest.param(Notch.B5, Notch.B8, [".", ".", "."], id="B5 -> B8"),
+        pytest.param(Notch.B5, Notch.EB, ["/"], id="B5 -> EB"),
+        pytest.param(Notch.EB, Notch.P2, ["m", "z", "z"], id="EB -> P2"),
+        pytest.param(Notch.EB, Notch.N, ["m"], id="EB -> N"),
+        pytest.param(Notch.EB, Notch.B1, ["m", "."], id="EB -> B1"),
+    ],
+)
+def test_update_notch(current: Notch, next_notch: Notch, keys: list[str]) -> None:
+    sink = RecordingKeySink()
+    update_notch(current, next_notch, PROFILE_LIMITS[TrainProfile.DEFAULT], sink)
+    assert sink.pressed_keys() == keys
 
 
 @pytest.mark.parametrize(
     "notch",
     [Notch.P2, Notch.N, Notch.B5, Notch.EB],
 )
-def test_update_notch_does_nothing_when_notch_is_unchanged(
-    mocker: MockerFixture, notch: Notch
-) -> None:
-    press_mock = mocker.patch("mascon_controller.press")
-    update_notch(notch, notch, Notch.B8)
-    press_mock.assert_not_called()
+def test_update_notch_does_nothing_when_notch_is_unchanged(notch: Notch) -> None:
+    sink = RecordingKeySink()
+    update_notch(notch, notch, PROFILE_LIMITS[TrainProfile.DEFAULT], sink)
+    assert sink.actions == []
 
 
 @pytest.mark.parametrize(
-    ("profile", "current", "next_notch", "calls"),
+    ("profile", "current", "next_notch", "keys"),
     [
         pytest.param(
             TrainProfile.DEFAULT,
             Notch.EB,
             Notch.B8,
-            [call(",", 1)],
+            [","],
             id="default EB -> B8",
         ),
         pytest.param(
             TrainProfile.DEFAULT,
             Notch.EB,
             Notch.B5,
-            [call(",", 4)],
+            [",", ",", ",", ","],
             id="default EB -> B5",
         ),
         pytest.param(
             TrainProfile.TOBU,
             Notch.EB,
             Notch.B7,
-            [call(",", 1)],
+            [","],
             id="tobu EB -> B7",
         ),
         pytest.param(
             TrainProfile.TOBU,
             Notch.EB,
             Notch.B5,
-            [call(",", 3)],
+            [",", ",", ","],
             id="tobu EB -> B5",
         ),
     ],
 )
 def test_update_notch_from_emergency_brake_uses_profile_brake_order(
-    mocker: MockerFixture,
     profile: TrainProfile,
     current: Notch,
     next_notch: Notch,
-    calls: list[object],
+    keys: list[str],
 ) -> None:
-    press_mock = mocker.patch("mascon_controller.press")
-    update_notch(current, next_notch, PROFILE_LIMITS[profile].max_brake)
-    assert press_mock.call_args_list == calls
+    sink = RecordingKeySink()
+    update_notch(current, next_notch, PROFILE_LIMITS[profile], sink)
+    assert sink.pressed_keys() == keys
+
+
+def shortest_distances(profile_limit: ProfileLimit) -> dict[tuple[Notch, Notch], int]:
+    # 最短経路表とは独立に、EBを経由しないFloyd-Warshallで最短キー数を求める
+    notches = effective_notch_order(profile_limit)
+    distances = {
+        (start, goal): 0 if start == goal else len(notches) * 2
+        for start in notches
+        for goal in notches
+    }
+    for start in notches:
+        for key in NOTCH_KEYS:
+            goal = apply_notch_key(start, key, profile_limit)
+            if goal is not None and goal != start:
+                distances[start, goal] = 1
+    for via in notches:
+        if via == Notch.EB:
+            continue
+        for start in notches:
+            for goal in notches:
+                distances[start, goal] = min(
+                    distances[start, goal],
+                    distances[start, via] + distances[via, goal],
+                )
+    return distances
+
+
+@pytest.mark.parametrize("profile", list(TrainProfile))
+def test_notch_transitions_reach_every_notch_with_fewest_keys(
+    profile: TrainProfile,
+) -> None:
+    profile_limit = PROFILE_LIMITS[profile]
+    notches = effective_notch_order(profile_limit)
+    transitions = build_notch_transitions(profile_limit)
+    distances = shortest_distances(profile_limit)
+
+    assert len(transitions) == len(notches) ** 2
+    for start in notches:
+        for goal in notches:
+            keys = transitions[start, goal]
+            current = start
+            for index, key in enumerate(keys):
+                if index > 0:
+                    assert current != Notch.EB
+                next_notch = apply_notch_key(current, key, profile_limit)
+                assert next_notch is not None
+                current = next_notch
+            assert current == goal
+            assert len(keys) == distances[start, goal]
 
 
 @pytest.mark.parametrize(
@@ -160,61 +291,433 @@ def test_project_notch_keeps_emergency_brake(profile: TrainProfile) -> None:
     assert project_notch(Notch.EB, PROFILE_LIMITS[profile]) == Notch.EB
 
 
-def test_controller_axis_motion_updates_raw_and_effective_notches(
-    mocker: MockerFixture,
-) -> None:
-    press_mock = mocker.patch("mascon_controller.press")
-    controller = MasconController(profile=TrainProfile.TOBU)
+def test_notch_filter_holds_notch_inside_hysteresis_band() -> None:
+    notch_filter = NotchFilter(hysteresis=0.05)
 
-    controller.handle_axis_motion(1.0)
+    assert notch_filter.update(0.1, 0.0, DEFAULT_AXIS_CALIBRATION) == Notch.N
+    assert notch_filter.update(0.16, 0.0, DEFAULT_AXIS_CALIBRATION) == Notch.N
+    assert notch_filter.update(0.14, 0.0, DEFAULT_AXIS_CALIBRATION) == Notch.N
+    assert notch_filter.update(0.19, 0.0, DEFAULT_AXIS_CALIBRATION) == Notch.N
+    assert notch_filter.update(0.21, 0.0, DEFAULT_AXIS_CALIBRATION) == Notch.P1
+    assert notch_filter.update(0.12, 0.0, DEFAULT_AXIS_CALIBRATION) == Notch.P1
+    assert notch_filter.update(0.09, 0.0, DEFAULT_AXIS_CALIBRATION) == Notch.N
+    assert notch_filter.suppressed_count == 3
 
-    assert controller.raw_notch == Notch.P5
-    assert controller.notch == Notch.P3
-    assert press_mock.call_args_list == [call("z", 3)]
 
+def test_notch_filter_moves_across_several_notches_at_once() -> None:
+    notch_filter = NotchFilter(hysteresis=0.05)
+    notch_filter.update(0.0, 0.0, DEFAULT_AXIS_CALIBRATION)
 
-def test_controller_zl_button_down_enters_emergency_brake(
-    mocker: MockerFixture,
-) -> None:
-    press_mock = mocker.patch("mascon_controller.press")
-    controller = MasconController(raw_notch=Notch.B8)
+    assert notch_filter.update(0.58, 0.0, DEFAULT_AXIS_CALIBRATION) == Notch.P2
+    assert notch_filter.update(-1.0, 0.0, DEFAULT_AXIS_CALIBRATION) == Notch.B8
 
-    controller.handle_button_down(ZuikiMasconButton.ZL)
 
-    assert controller.raw_notch == Notch.EB
-    assert controller.notch == Notch.EB
-    assert ZuikiMasconButton.ZL in controller.pressed_buttons
-    assert press_mock.call_args_list == [call("/")]
+def test_notch_filter_commits_after_minimum_dwell() -> None:
+    notch_filter = NotchFilter(hysteresis=0.0, min_dwell=0.05)
+    notch_filter.update(0.0, 0.0, DEFAULT_AXIS_CALIBRATION)
 
+    assert notch_filter.update(0.3, 1.0, DEFAULT_AXIS_CALIBRATION) == Notch.N
+    assert notch_filter.pending_deadline == pytest.approx(1.05)
+    assert notch_filter.poll(1.04) is None
+    assert notch_filter.poll(1.05) == Notch.P1
+    assert notch_filter.pending_deadline is None
 
-def test_controller_zl_button_up_releases_emergency_brake(
-    mocker: MockerFixture,
-) -> None:
-    press_mock = mocker.patch("mascon_controller.press")
+
+def test_notch_filter_counts_discarded_pending_notches() -> None:
+    notch_filter = NotchFilter(hysteresis=0.0, min_dwell=0.05)
+    notch_filter.update(0.0, 0.0, DEFAULT_AXIS_CALIBRATION)
+
+    notch_filter.update(0.3, 1.0, DEFAULT_AXIS_CALIBRATION)
+    notch_filter.update(0.0, 1.01, DEFAULT_AXIS_CALIBRATION)
+
+    assert notch_filter.poll(2.0) is None
+    assert notch_filter.notch == Notch.N
+    assert notch_filter.suppressed_count == 1
+
+
+def test_controller_commits_dwelling_notch_when_polled() -> None:
+    sink = RecordingKeySink()
+    now = [0.0]
     controller = MasconController(
-        raw_notch=Notch.EB,
-        pressed_buttons={ZuikiMasconButton.ZL},
+        MasconDevice(
+            key_sink=sink,
+            notch_filter=NotchFilter(min_dwell=0.05),
+            clock=lambda: now[0],
+        )
     )
+    controller.primary.handle_axis_motion(0.0)
+
+    controller.primary.handle_axis_motion(0.45)
+    controller.poll_pending_notch()
+    assert controller.primary.raw_notch == Notch.N
+    assert sink.actions == []
+
+    now[0] = 0.05
+    controller.poll_pending_notch()
+    assert controller.primary.raw_notch == Notch.P2
+    assert sink.pressed_keys() == ["z", "z"]
+
+
+def test_controller_keeps_emergency_brake_with_hysteresis() -> None:
+    sink = RecordingKeySink()
+    controller = MasconController(MasconDevice(key_sink=sink))
+    controller.primary.handle_axis_motion(-1.0)
+    controller.primary.handle_button_down(ZuikiMasconButton.ZL)
+
+    controller.primary.handle_axis_motion(-0.89)
+
+    assert controller.primary.raw_notch == Notch.EB
+    assert sink.pressed_keys() == ["."] * 8 + ["/"]
+
+
+def test_controller_axis_motion_updates_raw_and_effective_notches() -> None:
+    sink = RecordingKeySink()
+    controller = MasconController(
+        MasconDevice(profile=TrainProfile.TOBU, key_sink=sink)
+    )
+
+    controller.primary.handle_axis_motion(1.0)
+
+    assert controller.primary.raw_notch == Notch.P5
+    assert controller.primary.notch == Notch.P3
+    assert sink.pressed_keys() == ["z", "z", "z"]
+
+
+def test_controller_zl_button_down_enters_emergency_brake() -> None:
+    sink = RecordingKeySink()
+    clock = ManualClock()
+    controller = MasconController(
+        MasconDevice(raw_notch=Notch.B8, key_sink=sink, clock=clock)
+    )
+
+    controller.primary.handle_button_down(ZuikiMasconButton.ZL)
+
+    # 合わせ直しの組み合わせでないと分かるまで待つ
+    assert controller.primary.raw_notch == Notch.B8
+    clock.now = RESYNC_CHORD_WINDOW
+    controller.poll_timers()
+    assert controller.primary.raw_notch == Notch.EB
+    assert controller.primary.notch == Notch.EB
+    assert ZuikiMasconButton.ZL in controller.primary.pressed_buttons
+    assert sink.pressed_keys() == ["/"]
+
+
+def test_controller_zl_button_up_releases_emergency_brake() -> None:
+    sink = RecordingKeySink()
+    controller = MasconController(
+        MasconDevice(
+            raw_notch=Notch.EB, pressed_buttons={ZuikiMasconButton.ZL}, key_sink=sink
+        )
+    )
+
+    controller.primary.handle_button_up(ZuikiMasconButton.ZL)
+
+    assert controller.primary.raw_notch == Notch.B8
+    assert controller.primary.notch == Notch.B8
+    assert ZuikiMasconButton.ZL not in controller.primary.pressed_buttons
+    assert sink.pressed_keys() == [","]
+
+
+def test_coalesce_axis_motions_keeps_last_value_per_device() -> None:
+    batch = [
+        AxisMotion(0.2, instance_id=0),
+        AxisMotion(-0.5, instance_id=1),
+        ButtonDown(ZuikiMasconButton.A),
+        AxisMotion(0.6, instance_id=0),
+        HatMotion(0, 1),
+        AxisMotion(1.0, instance_id=0),
+    ]
+
+    assert coalesce_axis_motions(batch) == [
+        AxisMotion(-0.5, instance_id=1),
+        ButtonDown(ZuikiMasconButton.A),
+        HatMotion(0, 1),
+        AxisMotion(1.0, instance_id=0),
+    ]
+
+
+def test_coalesce_axis_motions_does_not_merge_across_zl_button() -> None:
+    batch = [
+        AxisMotion(-1.0),
+        ButtonDown(ZuikiMasconButton.ZL),
+        AxisMotion(-0.95),
+        AxisMotion(0.0),
+        ButtonUp(ZuikiMasconButton.ZL),
+    ]
+
+    assert coalesce_axis_motions(batch) == [
+        AxisMotion(-1.0),
+        ButtonDown(ZuikiMasconButton.ZL),
+        AxisMotion(0.0),
+        ButtonUp(ZuikiMasconButton.ZL),
+    ]
+
+
+def test_controller_handle_events_sends_single_transition_for_lever_sweep() -> None:
+    sink = RecordingKeySink()
+    controller = MasconController(MasconDevice(key_sink=sink))
+    controller.attach_device(0)
+    sweep = [AxisMotion(value / 20) for value in range(20, -20, -1)]
+
+    controller.handle_events(sweep)
+
+    assert controller.primary.raw_notch == Notch.B8
+    assert sink.pressed_keys() == ["."] * 8
+
+
+def test_controller_marks_timestamped_events_for_latency_stats() -> None:
+    stats = LatencyStats()
+    emitter = KeyEmitter(RecordingKeySink(), latency_stats=stats)
+    controller = MasconController(MasconDevice(key_sink=emitter), latency_stats=stats)
+    controller.attach_device(0)
+
+    controller.handle_event(ButtonDown(ZuikiMasconButton.A, timestamp_ns=42))
+
+    assert emitter.actions[-1].origin == ("button", 42)
 
-    controller.handle_button_up(ZuikiMasconButton.ZL)
+    controller.handle_event(ButtonUp(ZuikiMasconButton.A))
 
-    assert controller.raw_notch == Notch.B8
-    assert controller.notch == Notch.B8
-    assert ZuikiMasconButton.ZL not in controller.pressed_buttons
-    assert press_mock.call_args_list == [call(",", 1)]
+    assert emitter.actions[-1].origin is None
+    assert stats.take_event() is None
+
+
+def test_controller_handle_events_keeps_button_order_around_transition() -> None:
+    sink = RecordingKeySink()
+    controller = MasconController(MasconDevice(key_sink=sink))
+    controller.attach_device(0)
+
+    controller.handle_events(
+        [
+            ButtonDown(ZuikiMasconButton.Y),
+            AxisMotion(0.3),
+            AxisMotion(0.5),
+            ButtonUp(ZuikiMasconButton.Y),
+        ]
+    )
+
+    assert sink.actions == [
+        ("down", "space"),
+        ("press", "z"),
+        ("press", "z"),
+        ("up", "space"),
+    ]
 
 
 def test_controller_change_profile_updates_profile_and_effective_notch() -> None:
-    controller = MasconController(raw_notch=Notch.P5)
+    controller = MasconController(MasconDevice(raw_notch=Notch.P5))
+
+    assert controller.primary.notch == Notch.P5
+
+    controller.change_profile(TrainProfile.TOBU)
+
+    assert controller.primary.profile == TrainProfile.TOBU
+    assert controller.primary.profile_limit == PROFILE_LIMITS[TrainProfile.TOBU]
+    assert controller.primary.raw_notch == Notch.P5
+    assert controller.primary.notch == Notch.P3
+    assert controller.primary.notch_transitions is build_notch_transitions(
+        PROFILE_LIMITS[TrainProfile.TOBU]
+    )
+
+
+def press_notch_keys(
+    current: Notch, keys: tuple[str, ...], profile_limit: ProfileLimit
+) -> Notch:
+    # ゲーム側と同じく、当てはまらないキーは無視する
+    for key in keys:
+        next_notch = apply_notch_key(current, key, profile_limit)
+        if next_notch is not None:
+            current = next_notch
+    return current
+
+
+@pytest.mark.parametrize("profile", list(TrainProfile))
+def test_resync_keys_reach_lever_notch_from_any_game_notch(
+    profile: TrainProfile,
+) -> None:
+    profile_limit = PROFILE_LIMITS[profile]
+    resync_keys = build_resync_keys(profile_limit)
+
+    for game_notch in Notch:
+        for anchor, keys in RESYNC_ANCHOR_KEYS.items():
+            assert press_notch_keys(game_notch, keys, profile_limit) == anchor
+        for goal, keys in resync_keys.items():
+            assert press_notch_keys(game_notch, keys, profile_limit) == goal
+
+    assert set(resync_keys) == set(effective_notch_order(profile_limit))
+    transitions = build_notch_transitions(profile_limit)
+    for goal, keys in resync_keys.items():
+        assert len(keys) == min(
+            len(anchor_keys + transitions[anchor, goal])
+            for anchor, anchor_keys in RESYNC_ANCHOR_KEYS.items()
+        )
 
-    assert controller.notch == Notch.P5
+
+def test_resync_keys_choose_the_nearer_anchor() -> None:
+    resync_keys = build_resync_keys(PROFILE_LIMITS[TrainProfile.DEFAULT])
+
+    assert resync_keys[Notch.N] == ("s", "m")
+    assert resync_keys[Notch.P2] == ("s", "m", "z", "z")
+    assert resync_keys[Notch.EB] == ("s", "/")
+    assert resync_keys[Notch.B8] == ("s", "/", ",")
+
+
+def test_controller_change_profile_resyncs_game_notch() -> None:
+    sink = RecordingKeySink()
+    controller = MasconController(MasconDevice(raw_notch=Notch.P5, key_sink=sink))
 
     controller.change_profile(TrainProfile.TOBU)
 
-    assert controller.profile == TrainProfile.TOBU
-    assert controller.profile_limit == PROFILE_LIMITS[TrainProfile.TOBU]
-    assert controller.raw_notch == Notch.P5
-    assert controller.notch == Notch.P3
+    assert sink.pressed_keys() == ["s", "m", "z", "z", "z"]
+    assert controller.primary.resync_count == 1
+
+
+def test_resync_chord_resyncs_without_sending_mapped_keys() -> None:
+    sink = RecordingKeySink()
+    controller = MasconController(MasconDevice(raw_notch=Notch.B2, key_sink=sink))
+    controller.attach_device(0)
+
+    controller.handle_events(
+        [ButtonDown(ZuikiMasconButton.ZL), ButtonDown(ZuikiMasconButton.CAPTURE)]
+    )
+    controller.handle_events(
+        [ButtonUp(ZuikiMasconButton.CAPTURE), ButtonUp(ZuikiMasconButton.ZL)]
+    )
+
+    assert sink.actions == [
+        ("press", "s"),
+        ("press", "m"),
+        ("press", "."),
+        ("press", "."),
+    ]
+    assert controller.primary.resync_count == 1
+    assert controller.primary.pressed_buttons == set()
+
+
+@pytest.mark.parametrize(
+    "first, second",
+    [
+        (ZuikiMasconButton.ZL, ZuikiMasconButton.CAPTURE),
+        (ZuikiMasconButton.CAPTURE, ZuikiMasconButton.ZL),
+    ],
+)
+def test_resync_chord_has_no_side_effects_in_either_order(
+    first: ZuikiMasconButton, second: ZuikiMasconButton
+) -> None:
+    sink = RecordingKeySink()
+    clock = ManualClock()
+    controller = MasconController(
+        MasconDevice(raw_notch=Notch.B8, key_sink=sink, clock=clock)
+    )
+    controller.attach_device(0)
+
+    controller.handle_events([ButtonDown(first)])
+    clock.now = RESYNC_CHORD_WINDOW / 2
+    controller.poll_timers()
+    controller.handle_events([ButtonDown(second)])
+    clock.now = RESYNC_CHORD_WINDOW * 2
+    controller.poll_timers()
+    controller.handle_events([ButtonUp(first), ButtonUp(second)])
+
+    # キャプチャーボタンのキーもEBも送らず、B8のまま合わせ直す
+    assert sink.actions == [("press", "s"), ("press", "/"), ("press", ",")]
+    assert controller.primary.raw_notch == Notch.B8
+    assert controller.primary.resync_count == 1
+
+
+def test_resync_chord_button_alone_sends_its_keys_after_the_window() -> None:
+    sink = RecordingKeySink()
+    clock = ManualClock()
+    controller = MasconController(MasconDevice(key_sink=sink, clock=clock))
+    controller.attach_device(0)
+
+    controller.handle_events([ButtonDown(ZuikiMasconButton.CAPTURE)])
+    assert sink.actions == []
+    clock.now = RESYNC_CHORD_WINDOW
+    controller.poll_timers()
+    assert sink.actions == [("down", "command"), ("down", "1")]
+
+    sink.actions.clear()
+    # 待っている間に離したときは、押してすぐ離したものとして送る
+    controller.handle_events(
+        [
+            ButtonUp(ZuikiMasconButton.CAPTURE),
+            ButtonDown(ZuikiMasconButton.CAPTURE),
+            ButtonUp(ZuikiMasconButton.CAPTURE),
+        ]
+    )
+    assert sink.actions == [
+        ("up", "command"),
+        ("up", "1"),
+        ("down", "command"),
+        ("down", "1"),
+        ("up", "command"),
+        ("up", "1"),
+    ]
+    assert controller.pending_deadline is None
+
+
+def test_release_all_inputs_skips_keys_of_chord_button() -> None:
+    sink = RecordingKeySink()
+    controller = MasconController(MasconDevice(key_sink=sink))
+    controller.attach_device(0)
+    controller.handle_events(
+        [ButtonDown(ZuikiMasconButton.ZL), ButtonDown(ZuikiMasconButton.CAPTURE)]
+    )
+    sink.actions.clear()
+
+    controller.release_all_inputs()
+
+    assert sink.actions == []
+    assert controller.primary.chord_buttons == set()
+
+
+def test_controller_resyncs_reconnected_device(mocker: MockerFixture) -> None:
+    joystick = Mock()
+    joystick.get_instance_id.return_value = 42
+    mocker.patch("mascon_controller.pygame.joystick.Joystick", return_value=joystick)
+    sink = RecordingKeySink()
+    controller = MasconController(MasconDevice(raw_notch=Notch.P1, key_sink=sink))
+
+    controller.register_joystick(0)
+    assert sink.actions == []
+
+    controller.unregister_joystick(42)
+    controller.register_joystick(0)
+
+    assert sink.pressed_keys() == ["s", "m", "z"]
+
+
+def test_controller_resyncs_after_key_backlog_drains() -> None:
+    sink = RecordingKeySink()
+    controller = MasconController(MasconDevice(raw_notch=Notch.B1, key_sink=sink))
+
+    controller.check_key_backlog(RESYNC_BACKLOG_THRESHOLD, 0)
+    assert not controller.is_resync_pending
+
+    controller.check_key_backlog(RESYNC_BACKLOG_THRESHOLD + 1, 0)
+    controller.check_key_backlog(1, 0)
+    assert sink.actions == []
+
+    controller.check_key_backlog(0, 0)
+    controller.check_key_backlog(0, 0)
+    assert sink.pressed_keys() == ["s", "m", "."]
+
+    sink.actions.clear()
+    controller.check_key_backlog(0, 3)
+    controller.check_key_backlog(0, 3)
+    assert sink.pressed_keys() == ["s", "m", "."]
+
+
+def test_controller_resyncs_when_key_sink_requests_it() -> None:
+    sink = RecordingKeySink()
+    controller = MasconController(MasconDevice(raw_notch=Notch.B1, key_sink=sink))
+
+    controller.request_resync()
+    controller.check_key_backlog(2, 0)
+    assert sink.actions == []
+
+    controller.check_key_backlog(0, 0)
+    assert sink.pressed_keys() == ["s", "m", "."]
 
 
 def test_controller_register_joystick_keeps_joystick_instance(
@@ -230,6 +733,21 @@ def test_controller_register_joystick_keeps_joystick_instance(
     assert controller.joysticks == {42: joystick}
 
 
+def test_controller_register_joystick_selects_calibration_by_device_name(
+    mocker: MockerFixture,
+) -> None:
+    joystick = Mock()
+    joystick.get_instance_id.return_value = 42
+    joystick.get_name.return_value = "mascon"
+    mocker.patch("mascon_controller.pygame.joystick.Joystick", return_value=joystick)
+    calibration = AxisCalibration(tuple(-0.65 + 0.1 * index for index in range(13)))
+    controller = MasconController(axis_calibrations={"mascon": calibration})
+
+    controller.register_joystick(0)
+
+    assert controller.primary.axis_calibration is calibration
+
+
 def test_controller_initialize_joysticks_registers_connected_devices(
     mocker: MockerFixture,
 ) -> None:
@@ -242,16 +760,504 @@ def test_controller_initialize_joysticks_registers_connected_devices(
     assert register_mock.call_args_list == [call(0), call(1)]
 
 
-def test_controller_release_all_inputs_releases_pressed_buttons(
+def test_controller_keeps_separate_state_per_device() -> None:
+    sink = RecordingKeySink()
+    controller = MasconController(MasconDevice(key_sink=sink))
+    controller.attach_device(0)
+    other = controller.attach_device(1)
+
+    controller.handle_events(
+        [AxisMotion(0.3, 0), AxisMotion(-0.3, 1), ButtonDown(ZuikiMasconButton.A, 1)]
+    )
+
+    assert controller.devices[0] is controller.primary
+    assert controller.primary.raw_notch == Notch.P1
+    assert controller.primary.pressed_buttons == set()
+    assert other.raw_notch == Notch.B2
+    assert other.pressed_buttons == {ZuikiMasconButton.A}
+    assert sink.actions == [
+        ("press", "z"),
+        ("press", "."),
+        ("press", "."),
+        ("down", "backspace"),
+    ]
+
+
+def test_controller_routes_bound_device_to_its_own_mapping_profile_and_sink() -> None:
+    sink = RecordingKeySink()
+    pad_sink = RecordingKeySink()
+    controller = MasconController(
+        MasconDevice(key_sink=sink),
+        device_bindings={
+            "pad": DeviceBinding(
+                mapping={ZuikiMasconButton.A: "k"},
+                profile=TrainProfile.TOBU,
+                key_sink=pad_sink,
+            )
+        },
+    )
+    controller.attach_device(0, "pad")
+
+    controller.handle_events([AxisMotion(1.0), ButtonDown(ZuikiMasconButton.A)])
+
+    assert controller.devices[0] is not controller.primary
+    assert controller.devices[0].notch == Notch.P3
+    assert pad_sink.actions == [
+        ("press", "z"),
+        ("press", "z"),
+        ("press", "z"),
+        ("down", "k"),
+    ]
+    assert sink.actions == []
+
+
+def test_controller_reads_lever_axis_from_calibration_unless_bound() -> None:
+    sink = RecordingKeySink()
+    calibration = AxisCalibration(DEFAULT_AXIS_CALIBRATION.thresholds, lever_axis=3)
+    controller = MasconController(
+        MasconDevice(key_sink=sink),
+        axis_calibrations={"pad": calibration, "other": calibration},
+        device_bindings={
+            "mascon": DeviceBinding(lever_axis=2),
+            "other": DeviceBinding(lever_axis=0),
+        },
+    )
+    controller.attach_device(0, "mascon")
+    controller.attach_device(1, "pad")
+    controller.attach_device(2, "other")
+
+    controller.handle_events(
+        [
+            AxisMotion(0.3, 0, axis=2),
+            AxisMotion(0.3, 1, axis=3),
+            AxisMotion(0.3, 2, axis=3),
+        ]
+    )
+
+    # レバーの軸だけを変えるデバイスも、主デバイスが空いていればそこに結び付ける
+    assert controller.devices[0] is controller.primary
+    assert controller.primary.lever_axis == 2
+    assert controller.devices[1].lever_axis == 3
+    assert controller.devices[2].lever_axis == 0
+    assert controller.ignored_event_count == 1
+    assert sink.actions == [("press", "z"), ("press", "z")]
+
+
+def test_controller_ignores_unknown_devices_and_axes() -> None:
+    sink = RecordingKeySink()
+    controller = MasconController(MasconDevice(key_sink=sink))
+    controller.attach_device(0)
+
+    controller.handle_events(
+        [
+            AxisMotion(0.3, 7),
+            AxisMotion(0.3, 0, axis=0),
+            ButtonDown(ZuikiMasconButton.A, 7),
+        ]
+    )
+
+    assert sink.actions == []
+    assert controller.ignored_event_count == 3
+
+
+def test_controller_detach_device_releases_its_buttons_and_frees_primary() -> None:
+    sink = RecordingKeySink()
+    controller = MasconController(MasconDevice(key_sink=sink))
+    controller.attach_device(0)
+    controller.handle_events([ButtonDown(ZuikiMasconButton.A)])
+
+    controller.detach_device(0)
+
+    assert sink.actions == [("down", "backspace"), ("up", "backspace")]
+    assert controller.devices == {}
+    assert controller.attach_device(3) is controller.primary
+
+
+def test_controller_holds_keys_for_mapped_duration() -> None:
+    sink = RecordingKeySink()
+    clock = ManualClock()
+    controller = MasconController(
+        MasconDevice(
+            key_sink=sink,
+            mapping={ZuikiMasconButton.A: HoldKeys(("k",), 0.2)},
+            clock=clock,
+        )
+    )
+
+    controller.primary.handle_button_down(ZuikiMasconButton.A)
+    controller.primary.handle_button_up(ZuikiMasconButton.A)
+    clock.now = 0.1
+    controller.poll_timers()
+
+    assert sink.actions == [("down", "k")]
+    assert controller.pending_deadline == 0.2
+
+    clock.now = 0.25
+    controller.poll_timers()
+
+    assert sink.actions == [("down", "k"), ("up", "k")]
+    assert controller.pending_deadline is None
+    assert controller.primary.scheduler.max_lag == pytest.approx(0.05)
+
+
+def test_controller_repress_extends_hold_instead_of_pressing_again() -> None:
+    sink = RecordingKeySink()
+    clock = ManualClock()
+    controller = MasconController(
+        MasconDevice(
+            key_sink=sink,
+            mapping={ZuikiMasconButton.A: HoldKeys(("k",), 0.2)},
+            clock=clock,
+        )
+    )
+
+    controller.primary.handle_button_down(ZuikiMasconButton.A)
+    controller.primary.handle_button_up(ZuikiMasconButton.A)
+    clock.now = 0.15
+    controller.primary.handle_button_down(ZuikiMasconButton.A)
+    clock.now = 0.3
+    controller.poll_timers()
+
+    assert sink.actions == [("down", "k")]
+
+    clock.now = 0.35
+    controller.poll_timers()
+
+    assert sink.actions == [("down", "k"), ("up", "k")]
+
+
+def test_controller_repeats_key_while_button_is_held() -> None:
+    sink = RecordingKeySink()
+    clock = ManualClock()
+    controller = MasconController(
+        MasconDevice(
+            key_sink=sink, mapping={DpadButton.RIGHT: RepeatKey("g", 0.1)}, clock=clock
+        )
+    )
+
+    controller.primary.handle_hat_motion(1, 0)
+    for now in (0.1, 0.2, 0.25):
+        clock.now = now
+        controller.poll_timers()
+    controller.primary.handle_hat_motion(0, 0)
+    clock.now = 1.0
+    controller.poll_timers()
+
+    assert sink.pressed_keys() == ["g", "g", "g"]
+    assert controller.pending_deadline is None
+
+
+def test_controller_release_all_inputs_cancels_timed_keys() -> None:
+    sink = RecordingKeySink()
+    clock = ManualClock()
+    controller = MasconController(
+        MasconDevice(
+            key_sink=sink,
+            mapping={
+                ZuikiMasconButton.A: HoldKeys(("k",), 0.2),
+                ZuikiMasconButton.B: RepeatKey("r", 0.1),
+            },
+            clock=clock,
+        )
+    )
+    controller.primary.handle_button_down(ZuikiMasconButton.A)
+    controller.primary.handle_button_up(ZuikiMasconButton.A)
+    controller.primary.handle_button_down(ZuikiMasconButton.B)
+
+    controller.release_all_inputs()
+    clock.now = 1.0
+    controller.poll_timers()
+
+    assert sink.actions == [("down", "k"), ("press", "r"), ("up", "k")]
+    assert controller.primary.timers == {}
+
+
+def test_controller_release_all_inputs_releases_pressed_buttons() -> None:
+    sink = RecordingKeySink()
+    controller = MasconController(
+        MasconDevice(
+            pressed_buttons={ZuikiMasconButton.A, DpadButton.UP}, key_sink=sink
+        )
+    )
+
+    controller.release_all_inputs()
+
+    assert sorted(sink.actions) == [("up", "backspace"), ("up", "up")]
+    assert sink.flush_count == 1
+    assert controller.primary.pressed_buttons == set()
+
+
+def test_controller_button_and_hat_send_mapped_keys() -> None:
+    sink = RecordingKeySink()
+    controller = MasconController(MasconDevice(key_sink=sink))
+
+    controller.primary.handle_button_down(ZuikiMasconButton.HOME)
+    controller.primary.handle_hat_motion(0, 1)
+    controller.primary.handle_hat_motion(0, 0)
+    controller.primary.handle_button_up(ZuikiMasconButton.HOME)
+
+    assert sink.actions == [
+        ("down", "command"),
+        ("down", "g"),
+        ("down", "up"),
+        ("up", "up"),
+        ("up", "command"),
+        ("up", "g"),
+    ]
+
+
+def test_compile_mapping_indexes_keys_by_button() -> None:
+    compiled = compile_mapping(MAPPING_TO_KEYBOARD)
+
+    assert len(compiled) == MAPPING_SLOT_COUNT
+    home = compiled[ZuikiMasconButton.HOME]
+    assert home is not None
+    assert home.down_keys == ("command", "g")
+    assert home.up_keys == ("command", "g")
+    assert compiled[ZuikiMasconButton.ZL] is None
+
+
+def test_compile_mapping_releases_fn_after_arrow_keys_for_pyautogui() -> None:
+    up = compile_mapping(MAPPING_TO_KEYBOARD, fn_workaround=True)[DpadButton.UP]
+    left = compile_mapping(MAPPING_TO_KEYBOARD, fn_workaround=True)[DpadButton.LEFT]
+
+    assert up is not None and up.up_keys == ("up", "fn")
+    assert left is not None and left.up_keys == ("b",)
+
+
+def test_controller_sends_fn_release_only_with_workaround() -> None:
+    sink = RecordingKeySink()
+    controller = MasconController(MasconDevice(key_sink=sink, fn_workaround=True))
+
+    controller.primary.handle_hat_motion(0, 1)
+    controller.primary.handle_hat_motion(0, 0)
+
+    assert sink.actions == [("down", "up"), ("up", "up"), ("up", "fn")]
+
+
+def test_mapped_keys_lists_every_key_the_mapping_can_send() -> None:
+    compiled = compile_mapping(
+        {
+            ZuikiMasconButton.A: "backspace",
+            ZuikiMasconButton.B: RepeatKey("k", 0.1),
+            ZuikiMasconButton.HOME: Macro((Tap(("command", "g")),)),
+            DpadButton.UP: "up",
+        },
+        fn_workaround=True,
+    )
+
+    assert mapped_keys(compiled) == {"backspace", "k", "command", "g", "up", "fn"}
+
+
+@pytest.mark.parametrize(
+    "mapping",
+    [
+        {ZuikiMasconButton.A: "nosuchkey"},
+        {ZuikiMasconButton.A: ("command", "G")},
+        {ZuikiMasconButton.A: ()},
+        {ZuikiMasconButton.ZL: "z"},
+        {ZuikiMasconButton.A: HoldKeys(("k",), -1.0)},
+        {ZuikiMasconButton.A: RepeatKey("k", 0.0)},
+        {ZuikiMasconButton.A: Macro((Tap(("nosuchkey",)),))},
+    ],
+)
+def test_invalid_mapping_is_rejected_when_loaded(mapping: KeyMapping) -> None:
+    with pytest.raises(ValueError):
+        compile_mapping(mapping)
+    with pytest.raises(ValueError):
+        MasconController(MasconDevice(key_sink=RecordingKeySink(), mapping=mapping))
+
+
+def test_pyautogui_key_sink_blocks_unused_pyautogui_modules(
     mocker: MockerFixture,
 ) -> None:
-    key_up_mock = mocker.patch("mascon_controller.key_up")
-    controller = MasconController(pressed_buttons={ZuikiMasconButton.A, DpadButton.UP})
+    # patch.dictは終了時にsys.modules全体を元に戻す
+    mocker.patch.dict(sys.modules, {"pyautogui": Mock()})
+    for name in PYAUTOGUI_UNUSED_MODULES:
+        sys.modules.pop(name, None)
+
+    PyAutoGuiKeySink()
+
+    for name in PYAUTOGUI_UNUSED_MODULES:
+        assert sys.modules[name] is None
+        with pytest.raises(ImportError):
+            __import__(name)
+
+
+def test_pyautogui_key_sink_leaves_pacing_to_key_emitter(
+    mocker: MockerFixture,
+) -> None:
+    pyautogui = Mock(PAUSE=0.1)
+    mocker.patch.dict(sys.modules, {"pyautogui": pyautogui})
+
+    PyAutoGuiKeySink()
+
+    assert pyautogui.PAUSE == 0
+
+
+def test_print_key_sink_name_prints_each_action_as_it_is_sent() -> None:
+    output = io.StringIO()
+    sink = PrintingKeySink(output)
+
+    sink.key_down("backspace")
+    sink.press("z", 2)
+    sink.key_up("backspace")
+    sink.flush()
+
+    assert output.getvalue().splitlines() == [
+        "down backspace",
+        "press z",
+        "press z",
+        "up backspace",
+    ]
+    assert isinstance(create_key_sink("print"), PrintingKeySink)
+
+
+def test_controller_without_key_sink_does_not_load_pyautogui(
+    mocker: MockerFixture,
+) -> None:
+    pyautogui = Mock()
+    mocker.patch.dict(sys.modules, {"pyautogui": pyautogui})
+
+    controller = MasconController()
+    controller.attach_device(0)
+    controller.primary.handle_button_down(ZuikiMasconButton.A)
+
+    assert isinstance(controller.primary.key_sink, NullKeySink)
+    pyautogui.keyDown.assert_not_called()
+
+
+def test_create_key_sink_rejects_unknown_backend() -> None:
+    with pytest.raises(ValueError, match="unknown key sink"):
+        create_key_sink("unknown")
 
-    controller.release_all_inputs()
 
-    key_up_mock.assert_has_calls(
-        [call(ZuikiMasconButton.A), call(DpadButton.UP)], any_order=True
+@pytest.fixture
+def xvfb_display() -> Iterator[str]:
+    if shutil.which("Xvfb") is None:
+        pytest.skip("Xvfb is not installed")
+    pytest.importorskip("Xlib")
+
+    display = ":97"
+    process = subprocess.Popen(
+        ["Xvfb", display, "-nolisten", "tcp"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
     )
-    assert key_up_mock.call_count == 2
-    assert controller.pressed_buttons == set()
+    time.sleep(0.5)
+    try:
+        yield display
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def test_every_key_name_has_an_x11_keysym() -> None:
+    pytest.importorskip("Xlib")
+    from Xlib import XK  # pyright: ignore[reportMissingModuleSource]
+
+    XK.load_keysym_group("xf86")
+
+    unresolved = {
+        key
+        for key in KEY_NAMES - X11_UNSUPPORTED_KEYS
+        if not XK.string_to_keysym(X11_KEYSYM_NAMES.get(key, key))
+    }
+
+    assert unresolved == set()
+
+
+def test_xtest_key_sink_sends_keys_to_x_server(xvfb_display: str) -> None:
+    from Xlib.display import Display  # pyright: ignore[reportMissingModuleSource]
+
+    sink = XTestKeySink(xvfb_display)
+    observer = Display(xvfb_display)
+    keycode = sink.keycode(",")
+
+    def is_pressed() -> bool:
+        return bool(observer.query_keymap()[keycode // 8] & (1 << (keycode % 8)))
+
+    sink.key_down(",")
+    sink.flush()
+    time.sleep(0.1)
+    assert is_pressed()
+
+    sink.key_up(",")
+    sink.flush()
+    time.sleep(0.1)
+    assert not is_pressed()
+
+    sink.close()
+    observer.close()
+
+
+def test_controller_snapshot_version_changes_only_with_state() -> None:
+    controller = MasconController(MasconDevice(key_sink=RecordingKeySink()))
+    first = controller.snapshot()
+
+    assert controller.snapshot() is first
+
+    controller.primary.handle_axis_motion(0.3)
+    second = controller.snapshot()
+
+    assert second.version == first.version + 1
+    assert second.notch == Notch.P1
+
+    controller.primary.handle_axis_motion(0.3)
+
+    assert controller.snapshot() is second
+
+
+def test_controller_publishes_only_real_state_changes() -> None:
+    controller = MasconController(MasconDevice(key_sink=RecordingKeySink()))
+    controller.attach_device(0)
+    subscription = controller.subscribe()
+
+    controller.handle_events([AxisMotion(0.3), ButtonDown(ZuikiMasconButton.A)])
+    controller.handle_events([AxisMotion(0.3)])
+    controller.change_profile(TrainProfile.TOBU)
+
+    states = subscription.drain()
+    assert [state.version for state in states] == [0, 1, 2, 3]
+    assert states[1].notch == Notch.P1
+    assert states[2].pressed_buttons == {ZuikiMasconButton.A}
+    assert states[3].profile == TrainProfile.TOBU
+
+
+def test_state_subscription_drops_oldest_when_full() -> None:
+    controller = MasconController(MasconDevice(key_sink=RecordingKeySink()))
+    controller.attach_device(0)
+    subscription = controller.subscribe(maxsize=2)
+
+    for value in (0.3, 0.5, 0.7):
+        controller.handle_events([AxisMotion(value)])
+
+    assert subscription.dropped_count == 2
+    assert [state.notch for state in subscription.drain()] == [Notch.P2, Notch.P3]
+    assert subscription.get(timeout=0) is None
+
+
+def test_state_subscription_get_waits_for_publisher() -> None:
+    controller = MasconController(MasconDevice(key_sink=RecordingKeySink()))
+    subscription = controller.subscribe()
+    subscription.drain()
+    timer = threading.Timer(0.01, controller.change_profile, [TrainProfile.SEIBU])
+
+    timer.start()
+    state = subscription.get(timeout=1.0)
+    timer.join()
+
+    assert state is not None
+    assert state.profile == TrainProfile.SEIBU
+
+
+def test_unsubscribed_consumer_receives_nothing() -> None:
+    controller = MasconController(MasconDevice(key_sink=RecordingKeySink()))
+    controller.attach_device(0)
+    subscription = controller.subscribe()
+    controller.unsubscribe(subscription)
+
+    controller.handle_events([AxisMotion(0.3)])
+
+    assert subscription.latest() is not None
+    assert subscription.latest() is None
@@ -0,0 +1,157 @@
+import socket
+import sys
+import urllib.error
+import urllib.request
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+
+mock = Mock()
+sys.modules["pyautogui"] = mock
+
+from key_emitter import KeyEmitter  # noqa: E402
+from latency_stats import LatencyStats  # noqa: E402
+from mascon_controller import (  # noqa: E402
+    AxisMotion,
+    ButtonDown,
+    MasconController,
+    MasconDevice,
+    RecordingKeySink,
+    TrainProfile,
+    ZuikiMasconButton,
+)
+from metrics_server import (  # noqa: E402
+    MetricsExporter,
+    MetricsServer,
+    escape_label_value,
+)
+
+
+def create_exporter() -> tuple[MasconController, KeyEmitter, MetricsExporter]:
+    latency_stats = LatencyStats()
+    emitter = KeyEmitter(RecordingKeySink(), latency_stats=latency_stats)
+    controller = MasconController(
+        MasconDevice(key_sink=emitter), latency_stats=latency_stats
+    )
+    controller.attach_device(0)
+    return controller, emitter, MetricsExporter(controller, emitter, latency_stats)
+
+
+def metric_lines(text: str) -> set[str]:
+    return {line for line in text.splitlines() if not line.startswith("#")}
+
+
+def test_exporter_renders_controller_and_emitter_metrics() -> None:
+    controller, emitter, exporter = create_exporter()
+    emitter.start()
+    with controller.lock:
+        controller.handle_events(
+            [
+                AxisMotion(0.3, timestamp_ns=1),
+                AxisMotion(0.5, instance_id=9),
+                ButtonDown(ZuikiMasconButton.A, timestamp_ns=1),
+            ]
+        )
+        controller.change_profile(TrainProfile.TOBU)
+    emitter.close()
+
+    text = exporter.render()
+    lines = metric_lines(text)
+
+    assert "# TYPE zuiki_mascon_events_total counter" in text
+    assert 'zuiki_mascon_events_total{type="axis"} 1' in lines
+    assert 'zuiki_mascon_events_total{type="button"} 1' in lines
+    assert 'zuiki_mascon_events_total{type="hat"} 0' in lines
+    assert "zuiki_mascon_ignored_events_total 1" in lines
+    assert 'zuiki_mascon_keys_emitted_total{action="press",key="z"} 2' in lines
+    assert 'zuiki_mascon_keys_emitted_total{action="down",key="backspace"} 1' in lines
+    assert "zuiki_mascon_key_queue_depth 0" in lines
+    assert "zuiki_mascon_key_sink_errors_total 0" in lines
+    assert "zuiki_mascon_notch_resyncs_total 1" in lines
+    assert "zuiki_mascon_notch 1" in lines
+    assert 'zuiki_mascon_profile_info{profile="tobu",label="東武"} 1' in lines
+    assert 'zuiki_mascon_profile_info{profile="default",label="標準"} 0' in lines
+    assert "zuiki_mascon_joysticks 0" in lines
+    assert "# TYPE zuiki_mascon_input_latency_seconds histogram" in text
+    assert 'zuiki_mascon_input_latency_seconds_bucket{type="axis",le="+Inf"} 1' in lines
+    assert 'zuiki_mascon_input_latency_seconds_count{type="axis"} 1' in lines
+    assert 'zuiki_mascon_input_latency_seconds_count{type="hat"} 0' in lines
+
+
+def test_exporter_histogram_buckets_are_cumulative() -> None:
+    controller, _, exporter = create_exporter()
+    assert controller.latency_stats is not None
+    controller.latency_stats.record_timer_lag(100_000)
+    controller.latency_stats.record_timer_lag(2_000_000)
+    controller.latency_stats.record_timer_lag(20_000_000_000)
+
+    lines = metric_lines(exporter.render())
+
+    buckets = [
+        int(line.rsplit(" ", 1)[1])
+        for line in sorted(lines)
+        if line.startswith("zuiki_mascon_timer_lag_seconds_bucket")
+    ]
+    assert 'zuiki_mascon_timer_lag_seconds_bucket{le="1e-05"} 0' not in lines
+    assert 'zuiki_mascon_timer_lag_seconds_bucket{le="10"} 2' in lines
+    assert 'zuiki_mascon_timer_lag_seconds_bucket{le="+Inf"} 3' in lines
+    assert "zuiki_mascon_timer_lag_seconds_count 3" in lines
+    assert "zuiki_mascon_timer_lag_seconds_sum 20.0021" in lines
+    assert max(buckets) == 3
+
+
+def test_escape_label_value() -> None:
+    assert escape_label_value('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+
+
+def test_metrics_server_serves_on_localhost_port() -> None:
+    controller, _, exporter = create_exporter()
+    server = MetricsServer(exporter, port=0)
+    server.start()
+    try:
+        url = f"http://127.0.0.1:{server.port}"
+        with urllib.request.urlopen(f"{url}/metrics", timeout=5) as response:
+            assert response.status == 200
+            assert response.headers["Content-Type"].startswith("text/plain")
+            body = response.read().decode()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/other", timeout=5)
+    finally:
+        server.stop()
+
+    assert "zuiki_mascon_events_total" in body
+    assert not server.thread.is_alive()
+    assert exporter.subscription not in controller.subscriptions
+
+
+def test_metrics_server_serves_on_unix_socket(tmp_path: Path) -> None:
+    path = tmp_path / "metrics.sock"
+    # 前回の起動で残ったソケットファイル
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(str(path))
+    stale.close()
+    _, _, exporter = create_exporter()
+    server = MetricsServer(exporter, socket_path=path)
+    server.start()
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(5)
+            client.connect(str(path))
+            client.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+            response = b""
+            while chunk := client.recv(65536):
+                response += chunk
+    finally:
+        server.stop()
+
+    assert response.startswith(b"HTTP/1.0 200")
+    assert b"zuiki_mascon_joysticks 0" in response
+    assert not path.exists()
+
+
+def test_metrics_server_requires_an_address() -> None:
+    _, _, exporter = create_exporter()
+
+    with pytest.raises(ValueError):
+        MetricsServer(exporter)
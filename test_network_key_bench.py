@@ -0,0 +1,23 @@
+import json
+import sys
+from dataclasses import asdict
+from unittest.mock import Mock
+
+mock = Mock()
+sys.modules["pyautogui"] = mock
+
+from bench.network_key_bench import format_results, run_benchmarks  # noqa: E402
+
+
+def test_run_benchmarks_measures_loopback_round_trips_and_throughput() -> None:
+    report = run_benchmarks(round_trips=20, datagrams=200)
+
+    assert report.round_trip.round_trips == 20
+    # ループバックでも負荷が高いとUDPは落ちることがあるため、少しの取りこぼしは許す
+    assert report.round_trip.lost <= 2
+    assert 0 < report.round_trip.p50_us <= report.round_trip.max_us
+    assert report.throughput.datagrams == 200
+    assert report.throughput.received + report.throughput.lost == 200
+    assert report.throughput.send_per_sec > 0
+    assert f"round trip (20, lost {report.round_trip.lost})" in format_results(report)
+    json.dumps(asdict(report))
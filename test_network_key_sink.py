@@ -0,0 +1,129 @@
+import socket
+import sys
+import threading
+from unittest.mock import Mock
+
+import pytest
+
+mock = Mock()
+sys.modules["pyautogui"] = mock
+
+from cli_defaults import parse_address  # noqa: E402
+from network_key_sink import (  # noqa: E402
+    DATAGRAM_HEADER,
+    SEQUENCE_MODULUS,
+    KeyDatagram,
+    NetworkKeySink,
+    decode_datagram,
+    encode_datagram,
+    sequence_gap,
+)
+
+
+def test_datagram_round_trips_through_bytes() -> None:
+    datagram = KeyDatagram("press", "backspace", 3, 0xDEADBEEF, 7, 123_456_789)
+
+    data = encode_datagram(datagram)
+
+    assert len(data) == DATAGRAM_HEADER.size + len("backspace")
+    assert decode_datagram(data) == datagram
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"XX" + bytes(DATAGRAM_HEADER.size - 2),
+        encode_datagram(KeyDatagram("down", "z", 1, 0, 0, 0))[:-2],
+        encode_datagram(KeyDatagram("down", "z", 1, 0, 0, 0)) + b"x" * 64,
+    ],
+)
+def test_decode_datagram_rejects_invalid_data(data: bytes) -> None:
+    with pytest.raises(ValueError):
+        decode_datagram(data)
+
+
+def test_encode_datagram_rejects_long_key_names() -> None:
+    with pytest.raises(ValueError):
+        encode_datagram(KeyDatagram("down", "k" * 33, 1, 0, 0, 0))
+
+
+def test_sequence_gap_wraps_around() -> None:
+    assert sequence_gap(5, 5) == 0
+    assert sequence_gap(5, 8) == 3
+    assert sequence_gap(5, 3) == -2
+    assert sequence_gap(SEQUENCE_MODULUS - 1, 1) == 2
+    assert sequence_gap(1, SEQUENCE_MODULUS - 1) == -2
+
+
+def test_parse_address() -> None:
+    assert parse_address("192.168.0.2:47810") == ("192.168.0.2", 47810)
+    assert parse_address("[::1]:9") == ("::1", 9)
+    for text in ("47810", "host:", ":1", "host:port", "host:70000"):
+        with pytest.raises(ValueError):
+            parse_address(text)
+
+
+def test_network_key_sink_sends_numbered_datagrams() -> None:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver:
+        receiver.bind(("127.0.0.1", 0))
+        receiver.settimeout(5)
+        sink = NetworkKeySink(receiver.getsockname())
+
+        sink.key_down("backspace")
+        sink.key_up("backspace")
+        sink.press("z", 2)
+        datagrams = [decode_datagram(receiver.recv(1024)) for _ in range(3)]
+        sink.close()
+
+    assert [(d.kind, d.key, d.presses, d.sequence) for d in datagrams] == [
+        ("down", "backspace", 1, 0),
+        ("up", "backspace", 1, 1),
+        ("press", "z", 2, 2),
+    ]
+    assert {d.session for d in datagrams} == {sink.session}
+    assert datagrams[0].timestamp_ns <= datagrams[2].timestamp_ns
+
+
+def test_network_key_sink_handles_replies() -> None:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver:
+        receiver.bind(("127.0.0.1", 0))
+        receiver.settimeout(5)
+        resync_requested = threading.Event()
+        sink = NetworkKeySink(receiver.getsockname(), resync_requested.set)
+        sink.start()
+
+        sink.echo()
+        data, peer = receiver.recvfrom(1024)
+        echo = decode_datagram(data)
+        receiver.sendto(data, peer)
+        receiver.sendto(
+            encode_datagram(KeyDatagram("resync", "", 1, sink.session, 1, 0)), peer
+        )
+        # 別の送り手あての返信は無視する
+        receiver.sendto(
+            encode_datagram(KeyDatagram("resync", "", 1, sink.session ^ 1, 1, 0)), peer
+        )
+        assert resync_requested.wait(timeout=5)
+        sink.close()
+
+    assert echo.kind == "echo"
+    assert sink.round_trip.count == 1
+    assert sink.resync_request_count == 1
+    assert not sink.thread.is_alive()
+
+
+def test_network_key_sink_keeps_numbering_when_sends_fail() -> None:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as unused:
+        unused.bind(("127.0.0.1", 0))
+        address = unused.getsockname()
+    sink = NetworkKeySink(address)
+
+    # 受け手がいないポートへ送ると、LinuxではICMPによるエラーが次の送信で返る
+    for _ in range(3):
+        sink.press("z")
+    sink.close()
+
+    assert sink.sequence == 3
+    if sys.platform == "linux":
+        assert sink.send_error_count >= 1
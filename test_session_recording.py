@@ -0,0 +1,286 @@
+import sys
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+from pytest_mock import MockerFixture
+
+mock = Mock()
+sys.modules["pyautogui"] = mock
+
+from key_macro import Macro, Tap, Wait  # noqa: E402
+from mascon_controller import (  # noqa: E402
+    AxisCalibration,
+    MasconController,
+    MasconDevice,
+    NotchFilter,
+    RecordingKeySink,
+    RepeatKey,
+    ZuikiMasconButton,
+)
+from session_recording import (  # noqa: E402
+    DEVICE_NAME_LENGTH,
+    RECORD,
+    RECORDING_HEADER,
+    RECORDING_MAGIC,
+    RecordedEvent,
+    SessionRecorder,
+    SessionRecording,
+    group_recorded_batches,
+    pygame,
+    read_recording,
+    recorded_event_from_pygame,
+    replay_session,
+)
+
+EVENTS = [
+    RecordedEvent(0, pygame.JOYDEVICEADDED, 0, 0, name="ZUIKI Mascon"),
+    RecordedEvent(10, pygame.JOYAXISMOTION, 0, 1, 0.3),
+    RecordedEvent(10, pygame.JOYBUTTONDOWN, 0, ZuikiMasconButton.A),
+    RecordedEvent(2_000_000_000, pygame.JOYBUTTONUP, 0, ZuikiMasconButton.A),
+    RecordedEvent(2_000_000_010, pygame.JOYHATMOTION, 0, 0, hat=(-1, 1)),
+    RecordedEvent(3_000_000_000, pygame.JOYDEVICEREMOVED, 0),
+]
+
+
+class FakeTime:
+    def __init__(self) -> None:
+        self.now = 100.0
+        self.sleeps: list[float] = []
+
+    def clock(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def write_recording(path: Path, events: list[RecordedEvent]) -> None:
+    recorder = SessionRecorder(path)
+    for event in events:
+        recorder.record(event)
+    recorder.close()
+
+
+def test_recording_round_trips_fixed_size_records(tmp_path: Path) -> None:
+    path = tmp_path / "session.zmrec"
+
+    write_recording(path, EVENTS)
+
+    assert path.stat().st_size == (
+        len(RECORDING_MAGIC)
+        + RECORDING_HEADER.size
+        + RECORD.size * len(EVENTS)
+        + DEVICE_NAME_LENGTH.size
+        + len("ZUIKI Mascon")
+    )
+    assert read_recording(path) == SessionRecording(EVENTS)
+
+
+def test_recording_keeps_notch_filter_settings(tmp_path: Path) -> None:
+    path = tmp_path / "session.zmrec"
+    recorder = SessionRecorder(path, hysteresis=0.05, min_dwell=0.03)
+    recorder.record(EVENTS[1])
+    recorder.close()
+
+    assert read_recording(path) == SessionRecording(EVENTS[1:2], 0.05, 0.03)
+
+
+def test_recorder_buffers_records_until_buffer_is_full(tmp_path: Path) -> None:
+    path = tmp_path / "session.zmrec"
+    recorder = SessionRecorder(path, buffer_records=2)
+
+    header_size = len(RECORDING_MAGIC) + RECORDING_HEADER.size
+
+    recorder.record(EVENTS[1])
+    assert path.stat().st_size == header_size
+
+    recorder.record(EVENTS[2])
+    assert path.stat().st_size == header_size + RECORD.size * 2
+
+    recorder.record(EVENTS[3])
+    recorder.close()
+    assert read_recording(path).events == EVENTS[1:4]
+
+
+def test_recorded_event_converts_to_and_from_pygame_events() -> None:
+    for event in EVENTS[1:5]:
+        assert (
+            recorded_event_from_pygame(event.to_pygame_event(), event.timestamp_ns)
+            == event
+        )
+
+    assert recorded_event_from_pygame(pygame.event.Event(pygame.QUIT), 0) is None
+
+
+def test_recorded_device_added_event_keeps_joystick_name(
+    mocker: MockerFixture,
+) -> None:
+    joystick = mocker.patch.object(pygame.joystick, "Joystick").return_value
+    joystick.get_instance_id.return_value = 3
+    joystick.get_name.return_value = "ZUIKI Mascon"
+    event = pygame.event.Event(pygame.JOYDEVICEADDED, device_index=1)
+
+    assert recorded_event_from_pygame(event, 5) == RecordedEvent(
+        5, pygame.JOYDEVICEADDED, 3, 1, name="ZUIKI Mascon"
+    )
+
+
+def test_read_recording_rejects_other_files(tmp_path: Path) -> None:
+    path = tmp_path / "session.zmrec"
+    path.write_bytes(b"something else")
+
+    with pytest.raises(ValueError):
+        read_recording(path)
+
+    path.write_bytes(RECORDING_MAGIC + b"\x00" * (RECORD.size - 1))
+
+    with pytest.raises(ValueError):
+        read_recording(path)
+
+    # 名前の途中で途切れたファイル
+    write_recording(path, EVENTS[:1])
+    path.write_bytes(path.read_bytes()[:-1])
+
+    with pytest.raises(ValueError):
+        read_recording(path)
+
+
+def test_group_recorded_batches_splits_by_timestamp() -> None:
+    batches = list(group_recorded_batches(EVENTS))
+
+    assert [timestamp for timestamp, _ in batches] == [
+        0,
+        10,
+        2_000_000_000,
+        2_000_000_010,
+        3_000_000_000,
+    ]
+    assert batches[1][1] == EVENTS[1:3]
+
+
+def test_replay_session_sends_keys_in_real_time() -> None:
+    sink = RecordingKeySink()
+    controller = MasconController(MasconDevice(key_sink=sink))
+    fake_time = FakeTime()
+
+    batch_count = replay_session(
+        EVENTS, controller, clock=fake_time.clock, sleep=fake_time.sleep
+    )
+
+    assert batch_count == 5
+    assert sum(fake_time.sleeps) == pytest.approx(3.0)
+    assert sink.actions[:5] == [
+        ("press", "z"),
+        ("down", "backspace"),
+        ("up", "backspace"),
+        ("down", "up"),
+        ("down", "b"),
+    ]
+    # 再生の終わりに押したままのキーを離す
+    assert set(sink.actions[5:]) == {("up", "b"), ("up", "up")}
+
+
+def test_replay_session_scales_waits_by_speed() -> None:
+    fake_time = FakeTime()
+
+    replay_session(
+        EVENTS,
+        MasconController(MasconDevice(key_sink=RecordingKeySink())),
+        speed=4.0,
+        clock=fake_time.clock,
+        sleep=fake_time.sleep,
+    )
+
+    assert sum(fake_time.sleeps) == pytest.approx(0.75)
+
+
+def test_replay_session_without_speed_does_not_wait() -> None:
+    fake_time = FakeTime()
+
+    replay_session(
+        EVENTS,
+        MasconController(MasconDevice(key_sink=RecordingKeySink())),
+        speed=None,
+        clock=fake_time.clock,
+        sleep=fake_time.sleep,
+    )
+
+    assert fake_time.sleeps == []
+
+
+def test_replay_session_commits_dwell_with_recorded_time() -> None:
+    events = [
+        RecordedEvent(0, pygame.JOYAXISMOTION, 0, 1, 0.0),
+        RecordedEvent(1_000_000, pygame.JOYAXISMOTION, 0, 1, 0.3),
+        RecordedEvent(100_000_000, pygame.JOYBUTTONDOWN, 0, ZuikiMasconButton.A),
+    ]
+    sink = RecordingKeySink()
+    controller = MasconController(
+        MasconDevice(key_sink=sink, notch_filter=NotchFilter(min_dwell=0.05))
+    )
+
+    replay_session(events, controller, speed=None)
+
+    assert sink.pressed_keys() == ["z"]
+    assert sink.actions.index(("press", "z")) == 0
+
+
+def test_replay_session_fires_timers_between_batches() -> None:
+    events = [
+        RecordedEvent(0, pygame.JOYBUTTONDOWN, 0, ZuikiMasconButton.A),
+        RecordedEvent(350_000_000, pygame.JOYBUTTONUP, 0, ZuikiMasconButton.A),
+    ]
+    sink = RecordingKeySink()
+    controller = MasconController(
+        MasconDevice(key_sink=sink, mapping={ZuikiMasconButton.A: RepeatKey("k", 0.1)})
+    )
+
+    replay_session(events, controller, speed=None)
+
+    # 0秒で押し、0.1秒ごとに0.3秒まで押し直す
+    assert sink.pressed_keys() == ["k"] * 4
+
+
+def test_replay_session_finishes_pending_timers_at_the_end() -> None:
+    events = [
+        RecordedEvent(0, pygame.JOYBUTTONDOWN, 0, ZuikiMasconButton.HOME),
+        RecordedEvent(10_000_000, pygame.JOYBUTTONUP, 0, ZuikiMasconButton.HOME),
+        RecordedEvent(20_000_000, pygame.JOYBUTTONDOWN, 0, ZuikiMasconButton.A),
+    ]
+    sink = RecordingKeySink()
+    controller = MasconController(
+        MasconDevice(
+            key_sink=sink,
+            mapping={
+                ZuikiMasconButton.HOME: Macro((Tap(("a",)), Wait(0.5), Tap(("b",)))),
+                ZuikiMasconButton.A: RepeatKey("k", 0.1),
+            },
+        )
+    )
+
+    replay_session(events, controller, speed=None)
+
+    # 記録の終わりで押したままの繰り返し入力は止め、マクロの残りは出し切る
+    assert sink.actions == [
+        ("down", "a"),
+        ("up", "a"),
+        ("press", "k"),
+        ("down", "b"),
+        ("up", "b"),
+    ]
+    assert controller.pending_deadline is None
+
+
+def test_replay_session_attaches_devices_with_recorded_name() -> None:
+    calibration = AxisCalibration(tuple(-0.65 + 0.1 * index for index in range(13)))
+    sink = RecordingKeySink()
+    controller = MasconController(
+        MasconDevice(key_sink=sink), axis_calibrations={"ZUIKI Mascon": calibration}
+    )
+
+    replay_session(EVENTS, controller, speed=None)
+
+    assert controller.devices[0] is controller.primary
+    assert controller.primary.axis_calibration == calibration
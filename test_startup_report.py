@@ -0,0 +1,109 @@
+import io
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from startup_report import StartupReport
+
+# 起動してから最初の入力イベントを処理するまでの時間の上限
+TIME_TO_FIRST_EVENT_BUDGET_SECONDS = 1.0
+
+FIRST_EVENT_SCRIPT = """
+import time
+
+started = time.perf_counter()
+
+import sys
+
+import main
+import pygame
+from input_thread import InputThread
+from key_emitter import KeyEmitter
+from latency_stats import LatencyStats
+from mascon_controller import RecordingKeySink
+from startup_report import StartupReport
+
+report = StartupReport(started)
+report.mark("import")
+# オプションを指定しないときと同じ手順でコントローラーを作る
+sys.argv = ["main.py", "--no-gui"]
+args = main.parse_args()
+latency_stats = LatencyStats()
+emitter = KeyEmitter(RecordingKeySink(), latency_stats=latency_stats)
+controller = main.create_controller(args, emitter, latency_stats)
+main.load_mapping_file(args.mapping, controller)
+assert main.create_state_log(args) is None
+assert main.create_metrics_server(args, controller, emitter, latency_stats) is None
+thread = InputThread(controller, startup_report=report, key_emitter=emitter)
+thread.start()
+while not report.has_phase("sdl_init"):
+    time.sleep(0.001)
+pygame.event.post(
+    pygame.event.Event(pygame.JOYHATMOTION, instance_id=0, hat=0, value=(0, 1))
+)
+while not report.is_reported:
+    time.sleep(0.001)
+thread.stop()
+print(report.format(), file=sys.stderr)
+print(report.total)
+heavy_modules = ("tkinter", "pyautogui", "PIL", "http.server", "tomllib")
+print(",".join(name for name in heavy_modules if name in sys.modules))
+"""
+
+
+def test_startup_report_measures_each_phase() -> None:
+    now = iter([1.5, 1.75, 2.5])
+    output = io.StringIO()
+    report = StartupReport(1.0, output, clock=lambda: next(now))
+
+    report.mark("import")
+    report.mark("sdl_init")
+    report.mark("first_event")
+    report.report()
+    report.report()
+
+    assert report.phases == [("import", 0.5), ("sdl_init", 0.25), ("first_event", 0.75)]
+    assert report.total == 1.5
+    assert output.getvalue() == (
+        "import: 500.0 ms\nsdl_init: 250.0 ms\nfirst_event: 750.0 ms\ntotal: 1500.0 ms\n"
+    )
+
+
+def test_startup_report_without_output_prints_nothing(
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    report = StartupReport(0.0, clock=lambda: 1.0)
+
+    report.mark("import")
+    report.report()
+
+    assert report.is_reported
+    assert capsys.readouterr().err == ""
+
+
+@pytest.mark.skipif(
+    sys.platform != "linux", reason="startup budget is measured on Linux"
+)
+def test_time_to_first_event_stays_within_budget(tmp_path: Path) -> None:
+    completed = subprocess.run(
+        [sys.executable, "-c", FIRST_EVENT_SCRIPT],
+        capture_output=True,
+        check=True,
+        cwd=Path(__file__).parent,
+        env={
+            **os.environ,
+            # 手元の設定ファイルがあっても読み込まない
+            "HOME": str(tmp_path),
+            "SDL_VIDEODRIVER": "dummy",
+            "PYGAME_HIDE_SUPPORT_PROMPT": "1",
+        },
+        text=True,
+        timeout=30,
+    )
+    total, loaded_heavy_modules = completed.stdout.splitlines()[-2:]
+
+    assert float(total) < TIME_TO_FIRST_EVENT_BUDGET_SECONDS, completed.stderr
+    assert loaded_heavy_modules == ""
@@ -0,0 +1,147 @@
+import io
+import json
+import sys
+from unittest.mock import Mock
+
+mock = Mock()
+sys.modules["pyautogui"] = mock
+
+from key_emitter import KeyEmitter  # noqa: E402
+from mascon_controller import (  # noqa: E402
+    AxisMotion,
+    ButtonDown,
+    MasconController,
+    MasconDevice,
+    Notch,
+    RecordingKeySink,
+    ZuikiMasconButton,
+)
+from state_log import KeyEntry, StateEntry, StateLog  # noqa: E402
+
+
+def state_entry(timestamp_ns: int, notch: Notch = Notch.N) -> StateEntry:
+    return StateEntry(timestamp_ns, notch, notch, frozenset(), 0)
+
+
+def test_state_log_writes_text_lines() -> None:
+    stream = io.StringIO()
+    log = StateLog(stream)
+
+    log.append(
+        StateEntry(
+            0,
+            Notch.P3,
+            Notch.P5,
+            frozenset({ZuikiMasconButton.B, ZuikiMasconButton.A}),
+            2,
+        )
+    )
+    log.append(KeyEntry(1, "press", "z", 3))
+    log.append(KeyEntry(2, "down", "enter", 1))
+    log.close()
+
+    assert stream.getvalue().splitlines() == [
+        "P3 P5 [A, B] suppressed=2",
+        "key press z x3",
+        "key down enter",
+    ]
+
+
+def test_state_log_writes_json_lines() -> None:
+    stream = io.StringIO()
+    log = StateLog(stream, "json")
+
+    log.append(state_entry(10, Notch.B1))
+    log.append(KeyEntry(20, "press", ".", 1))
+    log.close()
+
+    assert [json.loads(line) for line in stream.getvalue().splitlines()] == [
+        {
+            "timestamp_ns": 10,
+            "event": "state",
+            "notch": "B1",
+            "raw_notch": "B1",
+            "pressed_buttons": [],
+            "suppressed_transitions": 0,
+        },
+        {
+            "timestamp_ns": 20,
+            "event": "key",
+            "kind": "press",
+            "key": ".",
+            "presses": 1,
+        },
+    ]
+
+
+def test_state_log_collapses_identical_consecutive_lines() -> None:
+    stream = io.StringIO()
+    log = StateLog(stream, repeat_interval=1.0)
+
+    for timestamp_ns in range(0, 2_500_000_000, 100_000_000):
+        log.append(state_entry(timestamp_ns))
+    log.append(state_entry(2_500_000_000, Notch.P1))
+    log.append(state_entry(2_600_000_000))
+    log.close()
+
+    # 1秒ごとに、それまでに省いた行の数を書き出す
+    assert stream.getvalue().splitlines() == [
+        "N N [] suppressed=0",
+        "N N [] suppressed=0 (repeated 10 times)",
+        "N N [] suppressed=0 (repeated 10 times)",
+        "N N [] suppressed=0 (repeated 4 times)",
+        "P1 P1 [] suppressed=0",
+        "N N [] suppressed=0",
+    ]
+
+
+def test_state_log_counts_entries_overwritten_before_writing() -> None:
+    stream = io.StringIO()
+    log = StateLog(stream, capacity=4)
+
+    for index in range(6):
+        log.append(KeyEntry(index, "press", str(index), 1))
+    log.close()
+
+    assert log.dropped_count == 2
+    assert stream.getvalue().splitlines() == [
+        "dropped 2 log entries",
+        "key press 2",
+        "key press 3",
+        "key press 4",
+        "key press 5",
+    ]
+
+
+def test_state_log_thread_flushes_in_background() -> None:
+    stream = Mock()
+    log = StateLog(stream, flush_interval=0.001)
+    log.start()
+
+    log.append(KeyEntry(0, "press", "z", 1))
+    log.close()
+
+    stream.write.assert_called_once_with("key press z\n")
+    assert not log.thread.is_alive()
+
+
+def test_controller_and_emitter_write_to_state_log() -> None:
+    stream = io.StringIO()
+    log = StateLog(stream)
+    controller = MasconController(MasconDevice(key_sink=RecordingKeySink()))
+    controller.attach_device(0)
+    emitter = KeyEmitter(RecordingKeySink(), log=log)
+    controller.primary.key_sink = emitter
+    emitter.start()
+
+    controller.handle_events([AxisMotion(0.3), ButtonDown(ZuikiMasconButton.A)])
+    assert emitter.wait_until_idle(timeout=1.0)
+    log.log_state(controller)
+    emitter.close()
+    log.close()
+
+    assert stream.getvalue().splitlines() == [
+        "key press z",
+        "key down backspace",
+        "P1 P1 [A] suppressed=0",
+    ]
@@ -8,8 +8,21 @@ import accessibility_permission
 mock = Mock()
 sys.modules["pyautogui"] = mock
 
+from latency_stats import LatencyStats  # noqa: E402
+from mascon_controller import (  # noqa: E402
+    PROFILE_LABELS,
+    PROFILE_LIMITS,
+    AxisMotion,
+    MasconController,
+    Notch,
+    ProfileLimit,
+    TrainProfile,
+    effective_notch_order,
+)
 from status_window import (  # noqa: E402
+    StatusWindow,
     accessibility_permission_status,
+    latency_status,
     should_show_accessibility_permission_status,
 )
 
@@ -42,3 +55,159 @@ def test_should_hide_accessibility_permission_status_on_non_macos(
     mocker.patch.object(accessibility_permission.sys, "platform", "linux")
 
     assert not should_show_accessibility_permission_status()
+
+
+def test_latency_status_lists_measured_event_kinds() -> None:
+    stats = LatencyStats()
+
+    assert latency_status(stats) == "入力遅延 (ms): 計測なし"
+
+    stats.record("hat", 1_500_000)
+
+    text = latency_status(stats)
+    assert text.startswith("入力遅延 (ms): hat p50 1.5")
+    assert "axis" not in text
+
+
+def new_widget(*args: object, **kwargs: object) -> Mock:
+    return Mock()
+
+
+def as_mock(widget: object) -> Mock:
+    assert isinstance(widget, Mock)
+    return widget
+
+
+def create_status_window(
+    mocker: MockerFixture, controller: MasconController
+) -> StatusWindow:
+    mocker.patch("status_window.tk.Label", side_effect=new_widget)
+    mocker.patch("status_window.tk.Frame", side_effect=new_widget)
+    mocker.patch("status_window.tk.Button", side_effect=new_widget)
+    mocker.patch(
+        "status_window.should_show_accessibility_permission_status",
+        return_value=False,
+    )
+    return StatusWindow(Mock(), controller)
+
+
+def config_call_count(window: StatusWindow) -> int:
+    widgets = [
+        window.notch_label,
+        window.profile_limit_label,
+        window.raw_label,
+        window.controller_label,
+        *window.profile_buttons.values(),
+        *window.notch_labels.values(),
+    ]
+    return sum(as_mock(widget).config.call_count for widget in widgets)
+
+
+def test_render_status_skips_pass_when_state_is_unchanged(
+    mocker: MockerFixture,
+) -> None:
+    window = create_status_window(mocker, MasconController())
+    calls = config_call_count(window)
+
+    window.render_status()
+    window.render_status()
+
+    assert config_call_count(window) == calls
+
+
+def test_render_status_only_reconfigures_changed_widgets(
+    mocker: MockerFixture,
+) -> None:
+    controller = MasconController()
+    controller.attach_device(0)
+    window = create_status_window(mocker, controller)
+    calls = config_call_count(window)
+
+    controller.handle_events([AxisMotion(0.3)])
+    window.render_status()
+
+    # 大きなノッチ表示、raw input、ノッチバーの新旧2つだけが変わる
+    assert config_call_count(window) == calls + 4
+    as_mock(window.notch_label).config.assert_called_with(text="P1", fg="#0969da")
+
+
+def test_render_status_reuses_notch_labels_when_profile_changes(
+    mocker: MockerFixture,
+) -> None:
+    controller = MasconController()
+    window = create_status_window(mocker, controller)
+    labels = dict(window.notch_labels)
+    for label in labels.values():
+        as_mock(label).reset_mock()
+
+    window.change_profile(TrainProfile.TOBU)
+
+    assert window.notch_labels == labels
+    assert window.visible_notches == effective_notch_order(
+        PROFILE_LIMITS[TrainProfile.TOBU]
+    )
+    hidden = set(effective_notch_order(PROFILE_LIMITS[TrainProfile.DEFAULT])) - set(
+        window.visible_notches
+    )
+    for item, label in labels.items():
+        as_mock(label).destroy.assert_not_called()
+        if item in hidden:
+            as_mock(label).grid_remove.assert_called_once_with()
+        else:
+            as_mock(label).grid_remove.assert_not_called()
+
+    window.change_profile(TrainProfile.DEFAULT)
+
+    for item in hidden:
+        as_mock(labels[item]).grid.assert_called_once_with()
+
+
+def test_render_status_applies_profile_labels_and_limits_from_mapping(
+    mocker: MockerFixture,
+) -> None:
+    controller = MasconController()
+    window = create_status_window(mocker, controller)
+
+    controller.apply_mapping(
+        controller.primary.mapping,
+        {
+            **PROFILE_LIMITS,
+            TrainProfile.DEFAULT: ProfileLimit(max_power=Notch.P4, max_brake=Notch.B7),
+        },
+        {**PROFILE_LABELS, TrainProfile.TOBU: "東武線"},
+    )
+    window.render_status()
+
+    assert window.visible_notches == effective_notch_order(
+        ProfileLimit(max_power=Notch.P4, max_brake=Notch.B7)
+    )
+    as_mock(window.profile_buttons[TrainProfile.TOBU]).config.assert_called_with(
+        text="東武線"
+    )
+
+
+def test_accessibility_status_renders_only_when_permission_flips(
+    mocker: MockerFixture,
+) -> None:
+    window = create_status_window(mocker, MasconController())
+    monitor = Mock()
+    window.accessibility_monitor = monitor
+    label = as_mock(window.accessibility_label)
+    button = as_mock(window.accessibility_settings_button)
+
+    monitor.is_granted.return_value = None
+    window.update_accessibility_status()
+    monitor.is_granted.return_value = False
+    window.update_accessibility_status()
+    window.update_accessibility_status()
+
+    label.config.assert_called_once_with(
+        text="アクセシビリティ権限: 未許可", fg="#b42318"
+    )
+    button.pack.assert_called_once_with(side="left", padx=(8, 0))
+
+    monitor.is_granted.return_value = True
+    window.update_accessibility_status()
+
+    button.pack_forget.assert_called_once_with()
+    assert label.config.call_count == 2
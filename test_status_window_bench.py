@@ -0,0 +1,74 @@
+import json
+import sys
+import tkinter as tk
+from dataclasses import asdict
+from unittest.mock import Mock
+
+from pytest_mock import MockerFixture
+
+mock = Mock()
+sys.modules["pyautogui"] = mock
+
+from bench.status_window_bench import (  # noqa: E402
+    format_results,
+    legacy_rebuild_notch_bar,
+    run_benchmarks,
+)
+from mascon_controller import (  # noqa: E402
+    PROFILE_LIMITS,
+    MasconController,
+    TrainProfile,
+)
+from status_window import StatusWindow  # noqa: E402
+
+
+def new_widget(*args: object, **kwargs: object) -> Mock:
+    return Mock()
+
+
+def patch_tk(mocker: MockerFixture) -> None:
+    mocker.patch("status_window.tk.Label", side_effect=new_widget)
+    mocker.patch("status_window.tk.Frame", side_effect=new_widget)
+    mocker.patch("status_window.tk.Button", side_effect=new_widget)
+    mocker.patch(
+        "status_window.should_show_accessibility_permission_status",
+        return_value=False,
+    )
+
+
+def test_legacy_rebuild_destroys_and_recreates_labels(mocker: MockerFixture) -> None:
+    patch_tk(mocker)
+    window = StatusWindow(Mock(), MasconController())
+    labels: list[tk.Label] = []
+
+    legacy_rebuild_notch_bar(
+        window, Mock(), labels, PROFILE_LIMITS[TrainProfile.DEFAULT]
+    )
+    old_labels = list(labels)
+    legacy_rebuild_notch_bar(window, Mock(), labels, PROFILE_LIMITS[TrainProfile.TOBU])
+
+    assert len(old_labels) == 15
+    assert len(labels) == 12
+    for label in old_labels:
+        assert isinstance(label, Mock)
+        label.destroy.assert_called_once_with()
+        assert label not in labels
+
+
+def test_run_benchmarks_reports_pooled_and_legacy_switches(
+    mocker: MockerFixture,
+) -> None:
+    patch_tk(mocker)
+    root = Mock()
+
+    report = run_benchmarks(root, switches=6)
+
+    assert [result.name for result in report.results] == [
+        "legacy_rebuild",
+        "pooled",
+    ]
+    assert all(result.switches == 6 for result in report.results)
+    assert all(result.max_us >= result.mean_us > 0 for result in report.results)
+    assert root.update_idletasks.call_count == 12
+    assert json.loads(json.dumps(asdict(report)))["results"][1]["name"] == "pooled"
+    assert "pooled" in format_results(report.results)
@@ -0,0 +1,2 @@
+KeyPress: int
+KeyRelease: int
@@ -0,0 +1,2 @@
+def string_to_keysym(keysym: str) -> int: ...
+def load_keysym_group(group: str) -> None: ...
@@ -0,0 +1,6 @@
+class Display:
+    def __init__(self, display: str | None = None) -> None: ...
+    def keysym_to_keycode(self, keysym: int) -> int: ...
+    def query_keymap(self) -> list[int]: ...
+    def flush(self) -> None: ...
+    def close(self) -> None: ...